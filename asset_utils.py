@@ -0,0 +1,142 @@
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from openai_utils import generate_voice_clip, generate_image, voice_clip_filename
+import metrics_utils
+
+# Number of TTS / DALL-E requests in flight at once. Override with the ASSET_WORKERS environment variable.
+DEFAULT_MAX_WORKERS = int(os.getenv("ASSET_WORKERS", "8"))
+
+
+class AssetGenerator:
+    def __init__(self, output_folder, voice="alloy", image_size="1024x1024", image_style=None, max_workers=None,
+                 manifest=None, audio_format=None):
+        """
+        Generates section voice clips and images on a background thread pool as sections are submitted.
+
+        Files are written as {i:03}.mp3 (or the extension of the audio format) and {i:03}.png,
+        so create_video_from_clips picks them up in order.
+        A failure in one section is reported and recorded, but does not stop the other sections.
+
+        Args:
+            output_folder: The directory where the assets will be saved.
+            voice (str): The default voice to use for text-to-speech.
+            image_size (str): The size of the generated images.
+            image_style (str): Optional DALL-E style, e.g. "vivid".
+            max_workers (int): Number of concurrent requests. Defaults to DEFAULT_MAX_WORKERS.
+            manifest: Optional RunManifest. Assets it already records are skipped, and new ones are recorded.
+            audio_format (str): TTS response format of the voice clips. Defaults to openai_utils.TTS_RESPONSE_FORMAT.
+        """
+        self.output_folder = Path(output_folder)
+        self.voice = voice
+        self.image_size = image_size
+        self.image_style = image_style
+        self.manifest = manifest
+        self.audio_format = audio_format
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or DEFAULT_MAX_WORKERS)
+        self.futures = {}
+        self.submitted = set()
+        self.started = time.perf_counter()
+
+    def submit(self, i, section) -> None:
+        """
+        Queue the voice clip and image of section i. Submitting the same section twice is a no-op.
+
+        Args:
+            i (int): The section index, used for the file names.
+            section (dict): Dict with the keys 'voiceover' and 'image_description'.
+                            A section may also set 'voice' to override the default voice,
+                            and 'audio_filename' to override the default clip name.
+        """
+        if i in self.submitted:
+            return
+        self.submitted.add(i)
+        if not isinstance(section, dict):
+            print(f"Warning: section {i} is not a dictionary! Skipping...")
+            return
+        voiceover = section.get("voiceover")
+        audio_filename = section.get("audio_filename", voice_clip_filename(f"{i:03}", self.audio_format))
+        if voiceover and not (self.manifest and self.manifest.has_asset(audio_filename)):
+            # Run in a copy of the caller's context, so the calls count towards the caller's run metrics
+            future = self.executor.submit(contextvars.copy_context().run, generate_voice_clip, voiceover,
+                                          section.get("voice", self.voice), self.output_folder, audio_filename,
+                                          self.audio_format)
+            self.futures[future] = (i, "voice")
+            future.add_done_callback(self._record_asset)
+        image_description = section.get("image_description")
+        if image_description and not (self.manifest and self.manifest.has_asset(f"{i:03}.png")):
+            future = self.executor.submit(contextvars.copy_context().run, generate_image, image_description,
+                                          self.image_size, self.output_folder, f"{i:03}.png", style=self.image_style)
+            self.futures[future] = (i, "image")
+            future.add_done_callback(self._record_asset)
+
+    def _record_asset(self, future) -> None:
+        """
+        Record a finished asset in the manifest as soon as it exists, so a run that fails before wait()
+        doesn't generate it again on --resume.
+        """
+        if self.manifest is None or future.cancelled() or future.exception() is not None:
+            return
+        path = future.result()
+        if path is not None:
+            try:
+                self.manifest.record_asset(path)
+            except Exception as e:
+                print(f"Failed to record {path} in the manifest: {e}")
+
+    def wait(self) -> dict:
+        """
+        Wait for every submitted asset to finish and shut down the thread pool.
+
+        Returns:
+            dict: Section index mapped to a dict of {"voice"|"image": error message} for failed assets.
+        """
+        failures = {}
+        for future in as_completed(self.futures):
+            i, kind = self.futures[future]
+            try:
+                path = future.result()
+                if path is None:
+                    raise RuntimeError("no file was produced")
+                print(f"Finished {kind} for section {i}")
+            except Exception as e:
+                print(f"Section {i} {kind} generation failed: {e}")
+                failures.setdefault(i, {})[kind] = str(e)
+        self.executor.shutdown()
+        # From the first submit, so it overlaps with whatever produced the sections
+        metrics_utils.record_stage("assets", time.perf_counter() - self.started)
+
+        if failures:
+            print(f"{len(failures)} of {len(self.submitted)} sections had failures: {sorted(failures)}")
+        return failures
+
+    def shutdown(self) -> None:
+        """
+        Cancel the assets that haven't started and wait for the ones in flight, which are still recorded.
+        Call it in a finally block, so a run that fails before wait() doesn't leave the workers running.
+        """
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def generate_assets(sections, output_folder, voice="alloy", image_size="1024x1024", image_style=None, max_workers=None, manifest=None):
+    """
+    Generate the voice clip and image for every section of a script concurrently.
+
+    :param sections: List of section dicts, see AssetGenerator.submit.
+    :param output_folder: The directory where the assets will be saved.
+    :param voice: The default voice to use for text-to-speech.
+    :param image_size: The size of the generated images.
+    :param image_style: Optional DALL-E style, e.g. "vivid".
+    :param max_workers: Number of concurrent requests. Defaults to DEFAULT_MAX_WORKERS.
+    :param manifest: Optional RunManifest. Assets it already records are skipped, and new ones are recorded.
+    :return: Dict mapping section index to a dict of {"voice"|"image": error message} for failed assets.
+    """
+    generator = AssetGenerator(output_folder, voice, image_size, image_style, max_workers, manifest)
+    try:
+        for i, section in enumerate(sections):
+            generator.submit(i, section)
+        return generator.wait()
+    finally:
+        generator.shutdown()
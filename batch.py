@@ -0,0 +1,136 @@
+import argparse
+import json
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+import dotenv
+import profile_utils
+from listicle import make_listicle
+from explainer import make_explainer
+from scripted import make_scripted_video
+from long_video import make_long_video
+from debater import make_debate, load_debate_config
+from roundtable import make_roundtable
+
+# load environment variables
+dotenv.load_dotenv()
+
+# Options a job may pass on to the long_video entry point, besides its topic.
+LONG_VIDEO_OPTIONS = ("pipeline", "context", "context_tokens", "recent_segments", "parallel", "smooth",
+                      "section_workers")
+
+
+def load_jobs(path):
+    """
+    Read a JSONL file of jobs, skipping blank lines.
+
+    Each job is an object with a 'format' (listicle, explainer, scripted, long_video, debate or roundtable)
+    and a 'topic'. Scripted jobs take the draft script as 'script' instead. Debates take a 'config', either
+    a path such as debate_config.json or the config object itself. Roundtables take a list of
+    'participants' with 'name', 'role', 'model' and 'temperature'. Long video jobs take the options of
+    long_video.make_long_video.
+    """
+    jobs = []
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                jobs.append(json.loads(line))
+    return jobs
+
+
+def run_job(job):
+    """
+    Run one job headlessly and return the path of its output folder.
+    """
+    job_format = job.get("format")
+    topic = job.get("topic")
+    if job_format == "listicle":
+        return make_listicle(topic)
+    if job_format == "explainer":
+        return make_explainer(topic)
+    if job_format == "scripted":
+        return make_scripted_video(job.get("script", topic), confirm=False)
+    if job_format == "long_video":
+        options = {key: job[key] for key in LONG_VIDEO_OPTIONS if key in job}
+        return make_long_video(topic, resume=job.get("resume"), **options)
+    if job_format == "debate":
+        config = job.get("config", "debate_config.json")
+        if not isinstance(config, dict):
+            config = load_debate_config(config)
+        return make_debate(topic, config)
+    if job_format == "roundtable":
+        if not job.get("resume") and not (topic and job.get("participants")):
+            raise ValueError("roundtable jobs need a topic and participants")
+        return make_roundtable(topic, job.get("participants"), resume=job.get("resume"))
+    raise ValueError(f"Unknown job format: {job_format!r}")
+
+
+def _timestamp(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat()
+
+
+def run_batch(jobs, concurrency=2):
+    """
+    Run jobs concurrently, at most concurrency at a time. A failed job does not stop the others.
+
+    :param jobs: List of job dicts, see load_jobs.
+    :param concurrency: Number of jobs running at once.
+    :return: Summary dict with one result per job, in input order, and the totals.
+    """
+    def run(index, job):
+        started = time.time()
+        result = {"index": index, "format": job.get("format"), "topic": job.get("topic")}
+        print(f"Starting job {index}: {job.get('format')} - {job.get('topic')}")
+        try:
+            output_folder = run_job(job)
+            result["status"] = "ok"
+            result["output_folder"] = str(output_folder) if output_folder else None
+        except Exception as e:
+            traceback.print_exc()
+            result["status"] = "failed"
+            result["error"] = f"{type(e).__name__}: {e}"
+        finished = time.time()
+        result.update(started_at=_timestamp(started), finished_at=_timestamp(finished),
+                      duration_seconds=round(finished - started, 3))
+        print(f"Job {index} {result['status']} after {result['duration_seconds']:.1f}s")
+        return result
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(run, range(len(jobs)), jobs))
+    finished = time.time()
+
+    succeeded = sum(1 for result in results if result["status"] == "ok")
+    return {
+        "jobs": results,
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "concurrency": concurrency,
+        "started_at": _timestamp(started),
+        "finished_at": _timestamp(finished),
+        "duration_seconds": round(finished - started, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many video jobs from a JSONL file without prompts.")
+    parser.add_argument("jobs", help="JSONL file with one job per line.")
+    parser.add_argument("--concurrency", type=int, default=2, help="Number of jobs running at once.")
+    parser.add_argument("--summary", default="batch_summary.json", help="Where to write the JSON summary.")
+    profile_utils.add_profile_argument(parser)
+    args = parser.parse_args()
+    if args.profile:
+        # Runs share the process, so only one of the jobs running at a time is profiled
+        profile_utils.enable()
+
+    summary = run_batch(load_jobs(args.jobs), args.concurrency)
+    Path(args.summary).write_text(json.dumps(summary, indent=2, ensure_ascii=False))
+    print(f"{summary['succeeded']} of {summary['total']} jobs succeeded in {summary['duration_seconds']:.1f}s. "
+          f"Summary written to {args.summary}")
+
+
+if __name__ == "__main__":
+    main()
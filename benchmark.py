@@ -0,0 +1,216 @@
+import argparse
+import functools
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+import fake_openai
+
+# End to end benchmark of every video format against the local fake OpenAI server.
+# Each format runs in its own process, so its peak RSS is measured on its own.
+
+REPO_DIR = Path(__file__).resolve().parent
+
+FORMATS = ("listicle", "explainer", "scripted", "long_video", "debate", "roundtable")
+
+# Stage name -> (module, function) timed in every module that imported it.
+STAGE_FUNCTIONS = {
+    "chat": ("openai_utils", "chat_completion"),
+    "tts": ("openai_utils", "generate_voice_clip"),
+    "images": ("openai_utils", "generate_image"),
+    "render": ("video_utils", "create_video_from_clips"),
+    "encode": ("ffmpeg_utils", "encode_segment"),
+    "concat": ("ffmpeg_utils", "concat_segments"),
+}
+
+BENCHMARK_PARTICIPANTS = [
+    {"name": "Alex", "role": "Expert", "model": "gpt-4-turbo-preview", "temperature": "1.0"},
+    {"name": "Jordan", "role": "Skeptic", "model": "gpt-4-turbo-preview", "temperature": "1.0"},
+]
+
+
+class StageTimer:
+    def __init__(self):
+        """
+        Collects the calls, busy time and first start / last end of each stage.
+
+        Busy time adds up the calls, so it exceeds the wall time when a stage runs concurrently.
+        Nested calls of the same stage on one thread are only counted once.
+        """
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stages = {}
+
+    def wrap(self, stage, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            active = getattr(self.local, "active", set())
+            self.local.active = active
+            if stage in active:
+                return function(*args, **kwargs)
+            active.add(stage)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                active.discard(stage)
+                with self.lock:
+                    stats = self.stages.setdefault(stage, {"calls": 0, "busy": 0.0, "first_start": start, "last_end": end})
+                    stats["calls"] += 1
+                    stats["busy"] += end - start
+                    stats["first_start"] = min(stats["first_start"], start)
+                    stats["last_end"] = max(stats["last_end"], end)
+        return timed
+
+    def install(self):
+        """
+        Replace every stage function in the loaded modules of this repo with its timed version.
+        """
+        for stage, (module_name, function_name) in STAGE_FUNCTIONS.items():
+            original = getattr(sys.modules[module_name], function_name)
+            timed = self.wrap(stage, original)
+            for module in list(sys.modules.values()):
+                module_file = getattr(module, "__file__", None)
+                if module_file and Path(module_file).resolve().parent == REPO_DIR \
+                        and getattr(module, function_name, None) is original:
+                    setattr(module, function_name, timed)
+
+    def report(self, started):
+        return {
+            stage: {
+                "calls": stats["calls"],
+                "busy_seconds": round(stats["busy"], 3),
+                "start_offset_seconds": round(stats["first_start"] - started, 3),
+                "span_seconds": round(stats["last_end"] - stats["first_start"], 3),
+            }
+            for stage, stats in sorted(self.stages.items())
+        }
+
+
+def run_format(video_format, topic):
+    """
+    Run one format end to end in this process and measure it.
+
+    :return: Dict with the wall time, CPU time, per-stage times, peak RSS and output folder.
+    """
+    import listicle, explainer, scripted, long_video, debater, roundtable
+
+    timer = StageTimer()
+    timer.install()
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    if video_format == "listicle":
+        output_folder = listicle.make_listicle(topic)
+    elif video_format == "explainer":
+        output_folder = explainer.make_explainer(topic)
+    elif video_format == "scripted":
+        output_folder = scripted.make_scripted_video(f"A short video about {topic}.", confirm=False)
+    elif video_format == "long_video":
+        output_folder = long_video.make_long_video(topic)
+    elif video_format == "debate":
+        output_folder = debater.make_debate(topic, debater.load_debate_config(REPO_DIR / "debate_config.json"))
+    else:
+        output_folder = roundtable.make_roundtable(topic, BENCHMARK_PARTICIPANTS)
+    wall = time.perf_counter() - started
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "format": video_format,
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(time.process_time() - cpu_started, 3),
+        "child_cpu_seconds": round(children.ru_utime + children.ru_stime, 3),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "peak_child_rss_bytes": children.ru_maxrss * 1024,
+        "stages": timer.report(started),
+        "output_folder": str(output_folder),
+    }
+
+
+def run_benchmark(formats, base_url, topic, work_dir, keep=False):
+    """
+    Run each format in a fresh process against base_url, with every cache disabled.
+
+    :return: List of result dicts, see run_format. A failed format has 'error' instead.
+    """
+    results = []
+    for video_format in formats:
+        run_dir = Path(tempfile.mkdtemp(prefix=f"{video_format}-", dir=work_dir))
+        result_file = run_dir / "result.json"
+        env = {
+            **os.environ,
+            "OPENAI_BASE_URL": base_url,
+            "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "benchmark"),
+            "TTS_CACHE_MAX_BYTES": "0",
+            "IMAGE_CACHE_MAX_BYTES": "0",
+            "COMPLETION_CACHE_MODE": "passthrough",
+            "CONTENT_MILL_CACHE_DIR": str(run_dir / "cache"),
+        }
+        print(f"Running {video_format}...")
+        process = subprocess.run(
+            [sys.executable, str(REPO_DIR / "benchmark.py"), "--run-format", video_format, "--topic", topic,
+             "--output", str(result_file)],
+            cwd=run_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+        )
+        if process.returncode == 0 and result_file.exists():
+            result = json.loads(result_file.read_text())
+            print(f"{video_format}: {result['wall_seconds']:.2f}s wall, "
+                  f"{result['peak_rss_bytes'] / 1024**2:.0f} MiB peak RSS")
+        else:
+            result = {"format": video_format, "error": process.stdout[-2000:]}
+            print(f"{video_format} failed:\n{process.stdout[-2000:]}")
+        results.append(result)
+        if not keep:
+            shutil.rmtree(run_dir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every video format end to end against a fake OpenAI API.")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--topic", default="The history of the bicycle")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results.")
+    parser.add_argument("--base-url", help="Use an already running server instead of starting a fake one.")
+    parser.add_argument("--work-dir", help="Where the run folders are created. Defaults to a temporary folder.")
+    parser.add_argument("--keep", action="store_true", help="Keep the run folders.")
+    parser.add_argument("--run-format", choices=FORMATS, help=argparse.SUPPRESS)
+    fake_openai.add_config_arguments(parser)
+    args = parser.parse_args()
+
+    if args.run_format:
+        # Child process: run one format in the current folder and write its measurements
+        result = run_format(args.run_format, args.topic)
+        Path(args.output).write_text(json.dumps(result, indent=2))
+        return
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = fake_openai.start_server(fake_openai.config_from_args(args))
+        base_url = server.base_url
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="content-mill-benchmark-")
+    Path(work_dir).mkdir(parents=True, exist_ok=True)
+    try:
+        results = run_benchmark(args.formats, base_url, args.topic, work_dir, args.keep)
+    finally:
+        if server:
+            server.shutdown()
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    fake_server = {key: value for key, value in vars(args).items()
+                   if key not in ("formats", "topic", "output", "base_url", "work_dir", "keep", "run_format")}
+    Path(args.output).write_text(json.dumps({"base_url": args.base_url, "fake_server": fake_server,
+                                             "results": results}, indent=2))
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
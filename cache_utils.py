@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+# Root of the persistent caches. Lives outside the per-run OutputFolder so it is shared across runs.
+CACHE_DIR = Path(os.getenv("CONTENT_MILL_CACHE_DIR", Path.home() / ".cache" / "content-mill"))
+
+
+def make_key(*parts) -> str:
+    """
+    Build a content-addressed cache key from the given parts.
+
+    :param parts: JSON-serialisable values that identify the cached content.
+    :return: A sha256 hex digest.
+    """
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    def __init__(self, name: str, max_bytes: int, suffix: str = ""):
+        """
+        Initialize a DiskCache instance.
+
+        Entries are files named by their key. The modification time of an entry is bumped on every hit,
+        so evicting the oldest files first gives LRU behaviour.
+
+        Args:
+            name (str): Subdirectory of CACHE_DIR holding this cache.
+            max_bytes (int): Size cap for the cache. Least recently used entries are evicted above it.
+            suffix (str): File extension for cached entries, e.g. ".mp3".
+        """
+        self.path = CACHE_DIR / name
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def entry_path(self, key: str) -> Path:
+        return self.path / f"{key}{self.suffix}"
+
+    def metadata_path(self, key: str) -> Path:
+        return self.path / f"{key}.meta.json"
+
+    def get_metadata(self, key: str) -> dict:
+        """
+        Return the metadata stored alongside an entry, or an empty dict if there is none.
+        """
+        try:
+            with open(self.metadata_path(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def get(self, key: str, destination) -> bool:
+        """
+        Materialise a cached entry at destination.
+
+        The entry is copied rather than hardlinked, so editing the file at destination in place,
+        e.g. replacing a bad image, never changes the cached entry.
+
+        Returns:
+            bool: True on a cache hit, False on a miss.
+        """
+        entry = self.entry_path(key)
+        if not entry.exists():
+            return False
+        destination = Path(destination)
+        try:
+            if destination.exists():
+                destination.unlink()
+            shutil.copyfile(entry, destination)
+            os.utime(entry)
+        except FileNotFoundError:
+            # Evicted by another thread or process between the check and the copy.
+            return False
+        return True
+
+    def put(self, key: str, source, metadata: dict = None) -> None:
+        """
+        Store a copy of source under key, then evict old entries if the cache is over its size cap.
+
+        Args:
+            key (str): The cache key.
+            source: Path of the file to store.
+            metadata (dict): Optional JSON-serialisable metadata stored next to the entry.
+        """
+        entry = self.entry_path(key)
+        tmp = entry.with_name(f"{entry.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        if metadata is not None:
+            with open(tmp, "w") as f:
+                json.dump(metadata, f, indent=2, ensure_ascii=False)
+            os.replace(tmp, self.metadata_path(key))
+        shutil.copyfile(source, tmp)
+        os.replace(tmp, entry)
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Delete least recently used entries until the cache fits within max_bytes.
+        """
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in self.path.iterdir():
+                if entry.suffix == ".tmp" or entry.name.endswith(".meta.json"):
+                    continue
+                key = entry.name[:len(entry.name) - len(self.suffix)] if self.suffix else entry.name
+                metadata = self.metadata_path(key)
+                try:
+                    stat = entry.stat()
+                    size = stat.st_size + (metadata.stat().st_size if metadata.exists() else 0)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, size, entry, metadata))
+                total += size
+            entries.sort()
+            for _, size, entry, metadata in entries:
+                if total <= self.max_bytes:
+                    break
+                entry.unlink(missing_ok=True)
+                metadata.unlink(missing_ok=True)
+                total -= size
+
+
+class CompletionCacheMiss(Exception):
+    """Raised in replay mode when a chat completion has not been recorded."""
+
+
+class JsonFileStore:
+    def __init__(self, path):
+        """
+        Store recorded completions as one small JSON file per key.
+
+        Args:
+            path: Directory holding the recordings.
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key: str):
+        try:
+            with open(self.path / f"{key}.json") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, record: dict) -> None:
+        tmp = self.path / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(record, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, self.path / f"{key}.json")
+
+
+class CompletionCache:
+    MODES = ("passthrough", "record", "replay")
+
+    def __init__(self, mode: str = "passthrough", store=None):
+        """
+        Record/replay cache for chat completions.
+
+        Modes:
+            passthrough: Always call the API. Nothing is read or written.
+            record: Serve recorded completions, call the API for anything missing and record the result.
+            replay: Serve recorded completions only. A miss raises CompletionCacheMiss instead of calling the API.
+
+        Args:
+            mode (str): One of MODES.
+            store: Any object with get(key) and put(key, record) methods. Defaults to a JsonFileStore under CACHE_DIR.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown completion cache mode '{mode}'. Expected one of {self.MODES}.")
+        self.mode = mode
+        self.store = store if store is not None else JsonFileStore(CACHE_DIR / "completions")
+        self._memory = {}
+
+    @staticmethod
+    def make_request_key(model, messages, response_format=None, temperature=None) -> str:
+        return make_key(model, messages, response_format, temperature)
+
+    def get_or_create(self, create, model, messages, response_format=None, temperature=None) -> str:
+        """
+        Return the completion content for a request, calling create() to produce it when needed.
+
+        Args:
+            create: Zero-argument callable that performs the API call and returns the content string.
+            model, messages, response_format, temperature: The request parameters that make up the key.
+        """
+        if self.mode == "passthrough":
+            return create()
+        key = self.make_request_key(model, messages, response_format, temperature)
+        if key in self._memory:
+            return self._memory[key]
+        record = self.store.get(key)
+        if record is not None:
+            self._memory[key] = record["content"]
+            return record["content"]
+        if self.mode == "replay":
+            raise CompletionCacheMiss(f"No recorded completion for model {model} (key {key[:12]}).")
+        content = create()
+        self.store.put(key, {
+            "model": model,
+            "messages": messages,
+            "response_format": response_format,
+            "temperature": temperature,
+            "content": content,
+        })
+        self._memory[key] = content
+        return content
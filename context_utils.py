@@ -0,0 +1,117 @@
+import json
+from openai_utils import chat_completion, count_tokens
+
+SUMMARY_MODEL = "gpt-3.5-turbo"
+
+SCRIPT_SUMMARY_SYSTEM_MESSAGE = """You keep a running summary of a YouTube video script that is being written section by section.
+You will be given the current summary and the next part of the script.
+Respond with an updated summary that covers both, in at most {max_words} words.
+Keep the topics covered, facts already stated, recurring themes and the tone, so later sections do not repeat them."""
+
+
+def update_running_summary(summary: str, label: str, items: list, system_message: str, token_budget: int,
+                           model: str = SUMMARY_MODEL) -> str:
+    """
+    Fold the next items of a script or conversation into its running summary.
+
+    Args:
+        summary (str): The current summary, or "" if there is none yet.
+        label (str): What the items are, e.g. "Next turns".
+        items (list): The JSON-serialisable items to fold in.
+        system_message (str): Summary instructions with a {max_words} placeholder.
+        token_budget (int): Token budget of the context the summary is part of. The summary gets a quarter of it.
+        model (str): Model used to update the summary.
+
+    Returns:
+        str: The updated summary.
+    """
+    max_words = max(50, token_budget // 4 * 3 // 4)
+    return chat_completion(
+        model=model,
+        messages=[
+            {
+                "role": "system",
+                "content": system_message.format(max_words=max_words),
+            },
+            {
+                "role": "user",
+                "content": f"Current summary: {summary or '(none yet)'}\n\n{label}: {json.dumps(items, ensure_ascii=False)}",
+            },
+        ],
+    )
+
+
+class FullScriptContext:
+    def __init__(self):
+        """
+        Sends the whole script so far with every section request. Prompt size grows with every section.
+        """
+        self.script = []
+
+    def add(self, segments: list) -> None:
+        self.script.extend(segments)
+
+    def render(self) -> str:
+        return json.dumps(self.script, ensure_ascii=False)
+
+    def get_state(self) -> dict:
+        return {"script": self.script}
+
+    def set_state(self, state: dict) -> None:
+        self.script = list(state["script"])
+
+
+class RollingSummaryContext:
+    def __init__(self, token_budget: int = 2000, recent_segments: int = 6, summary_model: str = SUMMARY_MODEL):
+        """
+        Keeps a rolling summary of older segments plus the last few segments verbatim, within a token budget.
+
+        Only the voiceover of each segment is kept, since image descriptions don't help the next section's writer.
+        Once the recent segments exceed recent_segments or their share of the budget, the oldest ones are folded
+        into the summary.
+
+        Args:
+            token_budget (int): Token budget for the rendered context.
+            recent_segments (int): Maximum number of segments kept verbatim.
+            summary_model (str): Model used to update the summary.
+        """
+        self.token_budget = token_budget
+        self.recent_segments = recent_segments
+        self.summary_model = summary_model
+        self.summary = ""
+        self.recent = []
+
+    def add(self, segments: list) -> None:
+        self.recent.extend(segment.get("voiceover", "") for segment in segments if isinstance(segment, dict))
+        overflow = []
+        # The summary gets a quarter of the budget, the recent segments the rest
+        while self.recent and (len(self.recent) > self.recent_segments
+                               or count_tokens(self.recent) > self.token_budget * 3 // 4):
+            overflow.append(self.recent.pop(0))
+        if overflow:
+            self.summary = self._summarize(overflow)
+
+    def _summarize(self, voiceovers: list) -> str:
+        return update_running_summary(self.summary, "Next part of the script", voiceovers,
+                                      SCRIPT_SUMMARY_SYSTEM_MESSAGE, self.token_budget, self.summary_model)
+
+    def render(self) -> str:
+        return json.dumps({"summary_of_earlier_sections": self.summary, "most_recent_voiceovers": self.recent},
+                          ensure_ascii=False)
+
+    def get_state(self) -> dict:
+        """
+        The summary and recent segments as a JSON-serialisable dict, so a resumed run can restore them with
+        set_state instead of summarising the script again.
+        """
+        return {"summary": self.summary, "recent": self.recent}
+
+    def set_state(self, state: dict) -> None:
+        self.summary = state["summary"]
+        self.recent = list(state["recent"])
+
+
+CONTEXT_STRATEGIES = {
+    "full": FullScriptContext,
+    "rolling": RollingSummaryContext,
+}
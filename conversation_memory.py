@@ -0,0 +1,81 @@
+import json
+from openai_utils import count_tokens
+from context_utils import SUMMARY_MODEL, update_running_summary
+
+CONVERSATION_SUMMARY_SYSTEM_MESSAGE = """You keep a running summary of a discussion between several speakers.
+You will be given the current summary and the next turns of the discussion.
+Respond with an updated summary that covers both, in at most {max_words} words.
+Keep who said what, the positions each speaker has taken, questions still open and points already made."""
+
+
+class ConversationMemory:
+    def __init__(self, token_budget: int = 3000, keep_fields=("speaker", "content"), summary_model: str = SUMMARY_MODEL):
+        """
+        Shared memory for multi-speaker conversations such as debates and roundtables.
+
+        Turns are reduced to the fields the next speaker needs. Once the verbatim turns exceed the token budget,
+        the oldest ones are folded into a running summary, down to half the budget, so the summary changes
+        rarely. Prompts are built as the system message, then the summary, then one message per turn and finally
+        the instruction, so consecutive prompts share a stable prefix that provider-side prompt caching can reuse.
+
+        Args:
+            token_budget (int): Token budget for the summary plus the verbatim turns.
+            keep_fields: Fields of each turn that are passed on to the next speaker.
+            summary_model (str): Model used to update the summary.
+        """
+        self.token_budget = token_budget
+        self.keep_fields = keep_fields
+        self.summary_model = summary_model
+        self.summary = ""
+        self.summarized_turns = 0
+
+    def strip_turn(self, turn: dict) -> dict:
+        return {field: turn[field] for field in self.keep_fields if field in turn}
+
+    def _turn_message(self, turn: dict) -> dict:
+        return {"role": "user", "content": json.dumps(self.strip_turn(turn), ensure_ascii=False)}
+
+    def _fold(self, transcript: list) -> None:
+        """
+        Fold the oldest verbatim turns into the summary if they no longer fit the budget.
+        """
+        turn_tokens = [count_tokens(self._turn_message(turn)["content"]) for turn in transcript[self.summarized_turns:]]
+        if sum(turn_tokens) + count_tokens(self.summary) <= self.token_budget:
+            return
+        folded = 0
+        remaining = sum(turn_tokens)
+        while folded < len(turn_tokens) - 1 and remaining > self.token_budget // 2:
+            remaining -= turn_tokens[folded]
+            folded += 1
+        turns = [self.strip_turn(turn) for turn in transcript[self.summarized_turns:self.summarized_turns + folded]]
+        self.summary = update_running_summary(self.summary, "Next turns", turns, CONVERSATION_SUMMARY_SYSTEM_MESSAGE,
+                                              self.token_budget, self.summary_model)
+        self.summarized_turns += folded
+        print(f"Summarized {folded} older turns ({self.summarized_turns} in total)")
+
+    def build_messages(self, system_message: str, transcript: list, instruction: str = "", speaker: str = "") -> list:
+        """
+        Build the chat messages for the next speaker.
+
+        Args:
+            system_message (str): The speaker's system message.
+            transcript (list): Every turn of the conversation so far.
+            instruction (str): Instruction for this turn.
+            speaker (str): Name of the speaker, used in the token report.
+
+        Returns:
+            list: Chat messages for chat_completion.
+        """
+        self._fold(transcript)
+        messages = [{"role": "system", "content": system_message}]
+        if self.summary:
+            messages.append({"role": "user", "content": f"Summary of the discussion so far: {self.summary}"})
+        messages.extend(self._turn_message(turn) for turn in transcript[self.summarized_turns:])
+        messages.append({"role": "user", "content": instruction})
+
+        prompt_tokens = sum(count_tokens(message["content"]) for message in messages)
+        full_tokens = count_tokens(system_message) + count_tokens(json.dumps(transcript, ensure_ascii=False)) + count_tokens(instruction)
+        print(f"{speaker or 'Next turn'} prompt: {prompt_tokens} tokens "
+              f"({len(transcript) - self.summarized_turns} verbatim turns, {self.summarized_turns} summarized, "
+              f"{full_tokens - prompt_tokens} saved vs. the full transcript)")
+        return messages
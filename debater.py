@@ -1,67 +1,63 @@
-from openai import OpenAI
 from pathlib import Path
 import os
 import sys
 import json
+import argparse
 import dotenv
 import slugify
 import requests
 import uuid
 import pathlib
 from video_utils import create_video_from_clips
+from openai_utils import chat_completion
+from asset_utils import AssetGenerator
+from folder_utils import OutputFolder
+import metrics_utils
+import profile_utils
+from conversation_memory import ConversationMemory
 from abc import ABC
 
 # Load environment variables
 dotenv.load_dotenv()
 
-# set up the openai client
-
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-
 image_size = "1024x1024"
 
 class DebateParticipant(ABC):
-    def __init__(self, model, name, role, topic, temperature="1.0"):
+    def __init__(self, model, name, role, topic, temperature="1.0", memory=None):
         self.name = name
         self.model = model
         self.role = role
         self.topic = topic
         self.temperature = temperature
+        self.memory = memory or ConversationMemory()
 
     def get_system_message(self):
         return f"You are {self.name}. You are debating as a {self.role} of {self.topic}. Your response should be a json object with the keys 'speaker', 'content', and 'image_description'. The speaker should be your name. The content should be your response. The image_description should be a description of an image to accompany your statement. The image should be related to the topic of the debate. Avoid using images of the debate setting or the debaters. Avoid using images of celebrities or public figures. Our text to image system uses a content filter, so avoid anything inappropriate. Avoid anything offensive. Avoid directly mentioning anything that is copyrighted in image_description. Do not use the names of any copyrighted works in image_description."
 
     def get_response(self, debate_messages, instruction=""):
-        response = openai_client.chat.completions.create(
+        response = chat_completion(
             model=self.model,
             response_format={"type": "json_object"},
-            messages=[
-                {
-                    "role": "system",
-                    "content": self.get_system_message(),
-                },
-                {
-                    "role": "user",
-                    "content": json.dumps(debate_messages, ensure_ascii=False),
-                },
-                {
-                    "role": "user",
-                    "content": instruction,
-                },
-            ],
+            messages=self.memory.build_messages(self.get_system_message(), debate_messages, instruction, self.name),
         )
 
-        response = json.loads(response.choices[0].message.content)
+        response = json.loads(response)
 
         debate_messages.append(response)
 
         return response
 
 class DebateManager:
-    def __init__(self, debate_config):
+    def __init__(self, debate_config, on_message=None):
+        """
+        :param debate_config: The debate configuration, see debate_config.json.
+        :param on_message: Optional callback called with (index, message) as soon as each turn is appended.
+        """
         self.debate_config = debate_config
+        self.on_message = on_message
         self.topic = debate_config["topic"]
+        # One memory shared by every participant, so older turns are only summarized once
+        self.memory = ConversationMemory()
         self.participants = self.initialize_participants(debate_config["participants"])
         self.debate_messages = []
 
@@ -73,7 +69,8 @@ class DebateManager:
                                                 participant["name"],
                                                 role,
                                                 self.topic,
-                                                participant.get("temperature", "1.0"))
+                                                participant.get("temperature", "1.0"),
+                                                self.memory)
             participants[role] = participant_obj
         return participants
 
@@ -88,6 +85,8 @@ class DebateManager:
                     instruction = ""
                 participant = self.participants[role.lower()]
                 response = participant.get_response(self.debate_messages, instruction)
+                if self.on_message:
+                    self.on_message(len(self.debate_messages) - 1, response)
                 print(f"{response['speaker']}: {response['content']}\n\nimage_description: {response['image_description']}\n\n\n")
         return self.debate_messages
 
@@ -96,94 +95,95 @@ def load_debate_config(file_path):
         debate_config = json.load(file)
     return debate_config
 
-debate_config = load_debate_config("debate_config.json")
-
-# input the debate topic
-
-topic = input("What is the topic of the debate? ")
+@metrics_utils.record_run
+def make_debate(topic, debate_config):
+    """
+    Conduct a debate on a topic, generate the voice clips and images, and render the video.
+
+    :param topic: The topic of the debate.
+    :param debate_config: The debate configuration, see debate_config.json.
+    :return: The path of the output folder.
+    """
+    debate_config = {**debate_config, "topic": topic}
+
+    # create a unique folder for the debate
+    output_folder = OutputFolder("debates", topic)
+    debate_folder = output_folder.path
+
+    # get the names of the speakers
+
+    proponent_name = opponent_name = None
+    for participant in debate_config["participants"]:
+        if participant["role"] == "proponent":
+            proponent_name = participant["name"]
+        elif participant["role"] == "opponent":
+            opponent_name = participant["name"]
+
+    # valid voice names are alloy, echo, fable, onyx, nova, and shimmer
+    def get_voice(speaker):
+        if speaker == "moderator":
+            return "alloy"
+        elif speaker == proponent_name:
+            return "echo"
+        elif speaker == opponent_name:
+            return "fable"
+        return "alloy"
+
+    # Each turn is final as soon as it is appended, so start its voice clip and image
+    # in the background while the rest of the debate is still being written
+    asset_generator = AssetGenerator(debate_folder, image_size=image_size, image_style="vivid",
+                                     manifest=output_folder.manifest)
+
+    def queue_assets(i, message):
+        asset_generator.submit(i, {
+            "voiceover": message["content"],
+            "image_description": message.get("image_description"),
+            "voice": get_voice(message["speaker"]),
+        })
 
+    try:
+        # Instantiate DebateManager
+        debate_manager = DebateManager(debate_config, on_message=queue_assets)
 
-debate_config["topic"] = topic
-
-# Instantiate DebateManager
-debate_manager = DebateManager(debate_config)
+        # Conduct the debate
+        with metrics_utils.stage("script"):
+            debate_messages = debate_manager.conduct_debate()
 
-# Conduct the debate
-debate_messages = debate_manager.conduct_debate()
+        # Define the file path for the transcript
+        transcript_file_path = os.path.join(debate_folder, "transcript.json")
 
-# create a unique name for the debate
-topic_slug = slugify.slugify(topic)
-debate_id = str(uuid.uuid4())
-debate_folder = f"debates/{topic_slug}-{debate_id}"
+        # Save the transcript
+        with open(transcript_file_path, "w") as file:
+            json.dump(debate_messages, file, indent=4, ensure_ascii=False)
+        output_folder.manifest.complete_stage("transcript", debate_messages)
 
-# create the debates folder if it doesn't exist
-if not os.path.exists("debates"):
-    os.makedirs("debates")
+        print(f"Transcript saved to {transcript_file_path}")
 
-# create the debate folder if it doesn't exist
-if not os.path.exists(f"{debate_folder}"):
-    os.makedirs(f"{debate_folder}")
+        # wait for the remaining voice clips and images
+        asset_generator.wait()
+    finally:
+        # Stops the workers when the debate fails part way. Finished assets are already in the manifest
+        asset_generator.shutdown()
 
+    # start creating a video from the images and audio files
 
-# Define the file path for the transcript
-transcript_file_path = os.path.join(debate_folder, "transcript.json")
+    output_video_path = f"{debate_folder}/final_video.mp4"
+    create_video_from_clips(debate_folder, output_video_path)
+    output_folder.manifest.complete_stage("video", output_video_path)
+    return debate_folder
 
-# Save the transcript
-with open(transcript_file_path, "w") as file:
-    json.dump(debate_messages, file, indent=4, ensure_ascii=False)
 
-print(f"Transcript saved to {transcript_file_path}")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a debate video.")
+    profile_utils.add_profile_argument(parser)
+    args = parser.parse_args()
+    if args.profile:
+        profile_utils.enable()
 
-# get the names of the speakers
+    debate_config = load_debate_config("debate_config.json")
 
-for participant in debate_config["participants"]:
-    if participant["role"] == "proponent":
-        proponent_name = participant["name"]
-    elif participant["role"] == "opponent":
-        opponent_name = participant["name"]
+    # input the debate topic
 
-for i, message in enumerate(debate_messages):
-   # valid voice names are alloy, echo, fable, onyx, nova, and shimmer
-   if message["speaker"] == "moderator":
-       voice = "alloy"
-   elif message["speaker"] == proponent_name:
-       voice = "echo"
-   elif message["speaker"] == opponent_name:
-       voice = "fable"
-   else:
-       voice = "alloy"
-   response = openai_client.audio.speech.create(
-       model="tts-1",
-       voice=voice,
-       input=message["content"],
-   )
-   # save the audio to a file in the debate folder
-   speech_file_path = Path(f"{debate_folder}/{i:03}.mp3")
-   response.stream_to_file(speech_file_path)
-#
-## iterate through the conversation and create an image for each message.
+    topic = input("What is the topic of the debate? ")
 
-for i, message in enumerate(debate_messages):
-    image_description = message["image_description"]
-    print(image_description)
-    try:
-        response = openai_client.images.generate(
-            model="dall-e-3",
-            prompt=f"{image_description}",
-            size=image_size,
-            quality="standard",
-            style="vivid",
-            n=1,
-        )
-    except:
-        print("Image generation failed.")
-        continue
-    image_url = response.data[0].url
-    image = requests.get(image_url)
-    with open(f"{debate_folder}/{i:03}.png", "wb") as f:
-        f.write(image.content)
-
-# start creating a video from the images and audio files
-
-output_video_path = f"{debate_folder}/final_video.mp4"
-create_video_from_clips(debate_folder, output_video_path)
+    make_debate(topic, debate_config)
@@ -1,123 +1,102 @@
-from openai import OpenAI
 from pathlib import Path
 import os
 import sys
 import json
+import argparse
 import dotenv
-import slugify
-import requests
-import uuid
 import random
-import pathlib
 from video_utils import create_video_from_clips
-
+from openai_utils import chat_completion
+from asset_utils import generate_assets
+from folder_utils import OutputFolder
+import metrics_utils
+import profile_utils
 
 # load environment variables
 dotenv.load_dotenv()
 
-# set up the openai client
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-
-# We're going to use OpenAI Chat Completions API to make a explainer video.
-
-# Prompt the user for the topic
-
-topic = input("What topic should the AI make a explainer about?")
-
-# prompt the AI for explainer script in json format
-
-response = openai_client.chat.completions.create(
-    model="gpt-4-turbo-preview",
-    response_format={"type": "json_object"},
-    messages=[
-        {
-            "role": "system",
-            "content": f"Your task is to write a script for an explainer video. Represent the script for an explainer video in json format. The video will be a slideshow with AI generated images, and TTS voiceover. Be sure to include interesting facts throughout the video. Be as thorough as possible. Use the keys title and script. script is a list of objects, each with the key 'image_description' and 'voiceover'. Each voiceover section should be about 150 words in length. The goal is to accompany each section of voiceover with a unique image related to the voiceover. The video should be suitable for audiences of all ages. Close out the video by thanking the viewer for watching, asking them to like the video, and asking them to subscribe to our channel.",
-        },
-        {
-            "role": "user",
-            "content": f"Write an explainer video about {topic}.",
-        },
-    ],
-)
-
-script = response.choices[0].message.content
-
-script = json.loads(script)
-
-# print the explainer script
-
-# print(json.dumps(script, indent=4))
+# We're going to use OpenAI Chat Completions API to make an explainer video.
+
+SYSTEM_MESSAGE = "Your task is to write a script for an explainer video. Represent the script for an explainer video in json format. The video will be a slideshow with AI generated images, and TTS voiceover. Be sure to include interesting facts throughout the video. Be as thorough as possible. Use the keys title and script. script is a list of objects, each with the key 'image_description' and 'voiceover'. Each voiceover section should be about 150 words in length. The goal is to accompany each section of voiceover with a unique image related to the voiceover. The video should be suitable for audiences of all ages. Close out the video by thanking the viewer for watching, asking them to like the video, and asking them to subscribe to our channel."
+
+
+def get_explainer_script(topic):
+    # prompt the AI for explainer script in json format
+    script = chat_completion(
+        model="gpt-4-turbo-preview",
+        response_format={"type": "json_object"},
+        messages=[
+            {
+                "role": "system",
+                "content": SYSTEM_MESSAGE,
+            },
+            {
+                "role": "user",
+                "content": f"Write an explainer video about {topic}.",
+            },
+        ],
+    )
+    return json.loads(script)
 
-title = script["title"]
 
-print(f"Title: {title}")
+@metrics_utils.record_run
+def make_explainer(topic):
+    """
+    Write an explainer script about a topic, generate its voiceovers and images, and render the video.
 
-title_slug = slugify.slugify(title)
+    :param topic: The topic of the explainer.
+    :return: The path of the output folder.
+    """
+    with metrics_utils.stage("script"):
+        script = get_explainer_script(topic)
 
-# create the explainers folder if it doesn't exist
+    # print the explainer script
 
-if not os.path.exists("explainers"):
-    os.makedirs("explainers")
+    # print(json.dumps(script, indent=4))
 
-# create a folder for thisexplainer 
+    title = script["title"]
 
-explainer_dir = f"explainers/{title_slug}-{uuid.uuid4()}"
-os.makedirs(explainer_dir)
+    print(f"Title: {title}")
 
-# save the explainer script to a file
+    # create a folder for this explainer
 
-with open(f"{explainer_dir}/script.json", "w") as f:
-    json.dump(script, f, indent=4)
+    output_folder = OutputFolder("explainers", title)
+    explainer_dir = output_folder.path
 
-script = script["script"]
+    # save the explainer script to a file
 
-# get list of voiceovers
+    with open(f"{explainer_dir}/script.json", "w") as f:
+        json.dump(script, f, indent=4)
 
-voiceovers = [item["voiceover"] for item in script]
+    script = script["script"]
 
-for i, voiceover in enumerate(voiceovers):
-    # print status message
-    print(f"Processing voiceover {i} of {len(voiceovers)}")
-    # print the voiceover
-    print(voiceover)
+    # generate the voiceovers and images for every section concurrently
     # valid voice names are alloy, echo, fable, onyx, nova, and shimmer
-    # choose a random voice
-    voice = random.choice(["alloy", "echo", "fable", "onyx", "nova", "shimmer"])
-    response = openai_client.audio.speech.create(
-        model="tts-1",
-        voice=voice,
-        input=voiceover,
-    )
-    voiceover_path = Path(f"{explainer_dir}/{i:03}.mp3")
-    response.stream_to_file(voiceover_path)
+    # choose a random voice for each section
 
+    sections = [
+        {**item, "voice": random.choice(["alloy", "echo", "fable", "onyx", "nova", "shimmer"])}
+        for item in script
+    ]
+    generate_assets(sections, explainer_dir, manifest=output_folder.manifest)
 
-# get list of image descriptions
+    # start creating a video from the images and audio files
 
-image_descriptions = [item["image_description"] for item in script]
+    output_video_path = f"{explainer_dir}/final_video.mp4"
+    create_video_from_clips(explainer_dir, output_video_path)
+    output_folder.manifest.complete_stage("video", output_video_path)
+    return explainer_dir
 
-for i, image_description in enumerate(image_descriptions):
-    # print status message
-    print(f"Processing image {i} of {len(image_descriptions)}")
-    # print the image description
-    print(image_description)
-    response = openai_client.images.generate(
-        model="dall-e-3",
-        prompt=image_description,
-        size="1024x1024",
-        quality="standard",
-        n=1,
-    )
 
-    image_url = response.data[0].url
-    image = requests.get(image_url).content
-    # save the image to a file
-    with open(f"{explainer_dir}/{i:03}.png", "wb") as handler:
-        handler.write(image)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate an explainer video.")
+    profile_utils.add_profile_argument(parser)
+    args = parser.parse_args()
+    if args.profile:
+        profile_utils.enable()
+
+    # Prompt the user for the topic
 
-# start creating a video from the images and audio files
+    topic = input("What topic should the AI make a explainer about?")
 
-output_video_path = f"{explainer_dir}/final_video.mp4"
-create_video_from_clips(explainer_dir, output_video_path)
\ No newline at end of file
+    make_explainer(topic)
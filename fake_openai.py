@@ -0,0 +1,362 @@
+import argparse
+import base64
+import io
+import json
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from PIL import Image
+import ffmpeg_utils
+
+# Local stand-in for the chat, speech and images endpoints of the OpenAI API, for benchmarks and
+# development without a key. Point the pipeline at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+
+POLICY_ERROR = {
+    "code": "content_policy_violation",
+    "message": "Your request was rejected as a result of our safety system.",
+    "type": "invalid_request_error",
+}
+
+# Speech response format -> (file extension, ffmpeg output arguments, content type).
+SPEECH_FORMATS = {
+    "mp3": (".mp3", ["-c:a", "libmp3lame"], "audio/mpeg"),
+    "aac": (".aac", ["-c:a", "aac"], "audio/aac"),
+    "opus": (".opus", ["-c:a", "libopus"], "audio/ogg"),
+    "flac": (".flac", ["-c:a", "flac"], "audio/flac"),
+    "wav": (".wav", ["-c:a", "pcm_s16le"], "audio/wav"),
+    "pcm": (".raw", ["-c:a", "pcm_s16le", "-f", "s16le"], "audio/pcm"),
+}
+
+
+def parse_latency(spec):
+    """
+    Parse a latency distribution in seconds.
+
+    :param spec: "fixed:S", "uniform:LOW,HIGH", "normal:MEAN,STDDEV" or "lognormal:MEDIAN,SIGMA".
+                 A plain number is taken as fixed.
+    :return: A function returning one latency sample.
+    """
+    kind, _, params = spec.partition(":")
+    if not params:
+        kind, params = "fixed", kind
+    values = [float(value) for value in params.split(",")]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda: median * random.lognormvariate(0, sigma)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class FakeOpenAIConfig:
+    def __init__(self, chat_latency="fixed:0.05", speech_latency="fixed:0.05", image_latency="fixed:0.1",
+                 rate_limit_rate=0.0, server_error_rate=0.0, policy_error_rate=0.0, retry_after=1.0,
+                 requests_per_minute=10000, script_sections=5, outline_sections=3, turns=6, audio_seconds=2.0):
+        """
+        Behaviour of the fake server.
+
+        Args:
+            chat_latency, speech_latency, image_latency (str): Latency distributions, see parse_latency.
+            rate_limit_rate (float): Share of requests answered with a 429.
+            server_error_rate (float): Share of requests answered with a 500 or 503.
+            policy_error_rate (float): Share of image requests rejected by the content policy.
+            retry_after (float): Retry-After of the injected 429s, in seconds.
+            requests_per_minute (int): Limit reported in the x-ratelimit-* headers.
+            script_sections (int): Sections in each generated script.
+            outline_sections (int): Sections in each generated long video outline.
+            turns (int): Turns after which a roundtable discussion is ended.
+            audio_seconds (float): Duration of each generated voice clip.
+        """
+        self.latency = {
+            "chat": parse_latency(chat_latency),
+            "speech": parse_latency(speech_latency),
+            "images": parse_latency(image_latency),
+        }
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.policy_error_rate = policy_error_rate
+        self.retry_after = retry_after
+        self.requests_per_minute = requests_per_minute
+        self.script_sections = script_sections
+        self.outline_sections = outline_sections
+        self.turns = turns
+        self.audio_seconds = audio_seconds
+
+
+def make_chat_content(messages, config):
+    """
+    Build a json answer that satisfies every prompt in the pipeline.
+
+    The callers each read their own keys, so one object carries all of them: a listicle or explainer script,
+    a long video outline and section, smoothing edits and a debate or roundtable turn.
+    """
+    system_message = next((m["content"] for m in messages if m["role"] == "system"), "")
+    speaker = re.match(r"You are ([^.]+)\.", system_message)
+    speaker = speaker.group(1) if speaker else "Moderator"
+    request_id = uuid.uuid4().hex[:8]
+    script = [
+        {
+            "voiceover": f"This is part {i + 1} of a generated script ({request_id}). " * 3,
+            "image_description": f"A colourful abstract illustration number {i + 1} ({request_id}).",
+        }
+        for i in range(config.script_sections)
+    ]
+    # Every verbatim turn is one message, the system message and instruction are the others
+    turns = sum(1 for m in messages if m["role"] == "user" and '"speaker"' in m["content"])
+    return json.dumps({
+        "title": f"Generated video {request_id}",
+        "script": script,
+        "section": script,
+        "sections": [
+            {"title": f"Section {i + 1}", "writing_prompt": f"Write section {i + 1}."}
+            for i in range(config.outline_sections)
+        ],
+        "edits": [],
+        "speaker": speaker,
+        "content": f"{speaker} makes point number {turns + 1} ({request_id}).",
+        "image_description": f"An illustration of point number {turns + 1} ({request_id}).",
+        "next_speaker": "End" if turns + 1 >= config.turns else "Moderator",
+        "names": ["Alex", "Jordan", "Sam", "Riley"],
+        "roles": ["Expert", "Skeptic", "Enthusiast", "Historian"],
+    })
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), config=None):
+        """
+        Threaded HTTP server answering /v1/chat/completions, /v1/audio/speech and /v1/images/generations.
+
+        Args:
+            address: (host, port) to listen on. Port 0 picks a free port.
+            config (FakeOpenAIConfig): Latencies, injected errors and response sizes.
+        """
+        super().__init__(address, FakeOpenAIHandler)
+        self.config = config or FakeOpenAIConfig()
+        self.lock = threading.Lock()
+        self.recent_requests = {}
+        self.counts = {}
+        self.images = {}
+        self.image_urls = {}
+        self.work_dir = Path(tempfile.mkdtemp(prefix="fake-openai-"))
+        self.audio = {}
+
+    def shutdown(self) -> None:
+        """
+        Stop serving, close the socket and remove the work directory of the generated audio.
+        """
+        super().shutdown()
+        self.server_close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def make_audio(self, response_format) -> bytes:
+        """
+        A sine tone in a TTS response format, 24kHz mono like the real voices, cached per format.
+        """
+        with self.lock:
+            if response_format not in self.audio:
+                extension, args = SPEECH_FORMATS[response_format][:2]
+                path = self.work_dir / f"clip.{response_format}{extension}"
+                ffmpeg_utils.run_ffmpeg([
+                    "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=24000",
+                    "-t", self.config.audio_seconds, "-ac", "1", *args, path,
+                ])
+                self.audio[response_format] = path.read_bytes()
+            return self.audio[response_format]
+
+    def make_image(self, size, prompt) -> bytes:
+        """
+        A solid PNG in a colour derived from the prompt, cached per size and colour.
+        """
+        width, height = (int(n) for n in size.split("x"))
+        rng = random.Random(prompt)
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        with self.lock:
+            if (size, colour) not in self.images:
+                buffer = io.BytesIO()
+                Image.new("RGB", (width, height), colour).save(buffer, "PNG")
+                self.images[size, colour] = buffer.getvalue()
+            return self.images[size, colour]
+
+    def track(self, endpoint) -> int:
+        """
+        Count a request and return how many of the per-minute limit are left.
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+            recent = self.recent_requests.setdefault(endpoint, deque())
+            recent.append(now)
+            while recent and recent[0] < now - 60:
+                recent.popleft()
+            return max(0, self.config.requests_per_minute - len(recent))
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_body(self, status, error, headers=None):
+        self.send_body(status, {"error": error}, headers=headers)
+
+    def do_GET(self):
+        match = re.fullmatch(r"/files/(\w+)\.png", self.path)
+        image = self.server.image_urls.get(match.group(1)) if match else None
+        if image is None:
+            self.send_error_body(404, {"message": "Not found", "type": "invalid_request_error"})
+            return
+        self.send_body(200, image, "image/png")
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        endpoint = {
+            "/v1/chat/completions": "chat",
+            "/v1/audio/speech": "speech",
+            "/v1/images/generations": "images",
+        }.get(self.path.split("?")[0])
+        if endpoint is None:
+            self.send_error_body(404, {"message": f"Unknown path {self.path}", "type": "invalid_request_error"})
+            return
+
+        config = self.server.config
+        remaining = self.server.track(endpoint)
+        time.sleep(config.latency[endpoint]())
+        rate_headers = {
+            "x-ratelimit-limit-requests": config.requests_per_minute,
+            "x-ratelimit-remaining-requests": remaining,
+            "x-ratelimit-reset-requests": "1s",
+        }
+
+        roll = random.random()
+        if roll < config.rate_limit_rate:
+            self.send_error_body(429, {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"},
+                                 {**rate_headers, "retry-after": config.retry_after})
+            return
+        if roll < config.rate_limit_rate + config.server_error_rate:
+            self.send_error_body(random.choice([500, 503]), {"message": "The server had an error", "type": "server_error"})
+            return
+        if endpoint == "images" and random.random() < config.policy_error_rate:
+            self.send_error_body(400, POLICY_ERROR)
+            return
+
+        if endpoint == "chat":
+            content = make_chat_content(body.get("messages", []), config)
+            prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+            self.send_body(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                          "total_tokens": prompt_tokens + len(content) // 4},
+            }, headers=rate_headers)
+        elif endpoint == "speech":
+            response_format = body.get("response_format", "mp3")
+            if response_format not in SPEECH_FORMATS:
+                self.send_error_body(400, {"message": f"Invalid response_format '{response_format}'",
+                                           "type": "invalid_request_error"})
+                return
+            self.send_body(200, self.server.make_audio(response_format), SPEECH_FORMATS[response_format][2],
+                           rate_headers)
+        else:
+            size = body.get("size", "1024x1024")
+            image = self.server.make_image(size, body.get("prompt", ""))
+            item = {"revised_prompt": body.get("prompt")}
+            if body.get("response_format") == "url":
+                file_id = uuid.uuid4().hex
+                with self.server.lock:
+                    self.server.image_urls[file_id] = image
+                host, port = self.server.server_address[:2]
+                item["url"] = f"http://{host}:{port}/files/{file_id}.png"
+            else:
+                item["b64_json"] = base64.b64encode(image).decode()
+            self.send_body(200, {"created": int(time.time()), "data": [item]}, headers=rate_headers)
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """
+    Start a fake server on a background thread.
+
+    :param config: Optional FakeOpenAIConfig.
+    :return: The running FakeOpenAIServer. Call shutdown() to stop it.
+    """
+    server = FakeOpenAIServer((host, port), config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--chat-latency", default="fixed:0.05", help="e.g. fixed:0.5, uniform:0.2,2 or lognormal:1.5,0.5")
+    parser.add_argument("--speech-latency", default="fixed:0.05")
+    parser.add_argument("--image-latency", default="fixed:0.1")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests answered with a 429.")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="Share of requests answered with a 5xx.")
+    parser.add_argument("--policy-error-rate", type=float, default=0.0, help="Share of images rejected by policy.")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--rpm", type=int, default=10000, help="Requests/min reported in the rate limit headers.")
+    parser.add_argument("--script-sections", type=int, default=5)
+    parser.add_argument("--outline-sections", type=int, default=3)
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--audio-seconds", type=float, default=2.0)
+
+
+def config_from_args(args):
+    return FakeOpenAIConfig(args.chat_latency, args.speech_latency, args.image_latency, args.rate_limit_rate,
+                            args.server_error_rate, args.policy_error_rate, args.retry_after, args.rpm,
+                            args.script_sections, args.outline_sections, args.turns, args.audio_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the OpenAI chat, speech and images API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer((args.host, args.port), config_from_args(args))
+    print(f"Serving a fake OpenAI API. Run the pipeline with OPENAI_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
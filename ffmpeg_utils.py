@@ -0,0 +1,453 @@
+import os
+import re
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from moviepy.config import get_setting
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+from PIL import Image, ImageOps
+from cache_utils import make_key
+from folder_utils import file_checksum
+
+# Use the same ffmpeg binary moviepy is configured with.
+FFMPEG_BINARY = get_setting("FFMPEG_BINARY")
+
+# Encoder settings matching the MP4 layout moviepy writes: H.264 video in yuv420p with MP3 audio.
+# The audio codec is only used for clips that can't be copied as they are, see can_copy_audio.
+VIDEO_CODEC = "libx264"
+AUDIO_CODEC = "libmp3lame"
+AUDIO_SAMPLE_RATE = 44100
+DEFAULT_PRESET = "medium"
+DEFAULT_TUNE = "stillimage"
+
+# Audio codecs an MP4 can hold as they are. Clips in one of these are copied into the video instead of re-encoded.
+MP4_AUDIO_CODECS = ("mp3", "aac", "opus")
+
+
+def run_ffmpeg(args):
+    """
+    Run ffmpeg with the given arguments, raising CalledProcessError with its stderr on failure.
+
+    :param args: List of ffmpeg arguments, excluding the binary itself.
+    """
+    command = [FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error", *[str(arg) for arg in args]]
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, command, stderr=result.stderr.decode(errors="replace"))
+
+
+def probe_duration(path) -> float:
+    """
+    Get the duration of a media file in seconds without keeping a reader open.
+    """
+    return ffmpeg_parse_infos(str(path))["duration"]
+
+
+def probe_audio(path):
+    """
+    Get the codec, sample rate and channel layout of a file's audio stream from ffmpeg's stream info.
+
+    :return: (codec, sample_rate, channels) tuple, e.g. ("mp3", 24000, "mono"), or None without an audio stream.
+    """
+    result = subprocess.run([FFMPEG_BINARY, "-hide_banner", "-i", str(path)], stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE)
+    match = re.search(r"Stream #.*?: Audio: (\w+)[^,\n]*, (\d+) Hz, ([^,\n]+)", result.stderr.decode(errors="replace"))
+    if match is None:
+        return None
+    return match.group(1), int(match.group(2)), match.group(3)
+
+
+def probe_audio_formats(audio_files) -> set:
+    """
+    Get the distinct probe_audio formats of audio clips.
+    """
+    with ThreadPoolExecutor() as executor:
+        return set(executor.map(probe_audio, audio_files))
+
+
+def can_copy_audio(audio_files, formats=None) -> bool:
+    """
+    Whether audio clips can be joined into an MP4 by stream copy: they must all have the same codec, sample rate
+    and channels, with a codec MP4 can hold. Clips from one run's TTS requests always do.
+
+    :param formats: The clips' probe_audio_formats, if already known.
+    """
+    formats = set(formats if formats is not None else probe_audio_formats(audio_files))
+    if len(formats) != 1:
+        return False
+    audio_format = formats.pop()
+    return audio_format is not None and audio_format[0] in MP4_AUDIO_CODECS
+
+
+def get_canvas_size(image_files) -> tuple:
+    """
+    Get the output frame size for a list of images: the widest width and tallest height, rounded up to even
+    numbers for yuv420p. Only the image headers are read.
+    """
+    sizes = []
+    for image_file in image_files:
+        with Image.open(image_file) as image:
+            sizes.append(image.size)
+    width = max(w for w, _ in sizes)
+    height = max(h for _, h in sizes)
+    return width + width % 2, height + height % 2
+
+
+def still_image_filter(size, duration, fps) -> str:
+    """
+    Build the filter chain that turns a single decoded image into a still video of the given duration.
+
+    The image is fitted and centred on the canvas, then the one decoded frame is cloned for the rest of the
+    duration, so the image is decoded only once.
+    """
+    width, height = size
+    return (
+        f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,format=yuv420p,"
+        f"tpad=stop_mode=clone:stop_duration={duration:.6f},"
+        f"trim=duration={duration:.6f},setpts=PTS-STARTPTS,fps={fps}"
+    )
+
+
+def audio_filter(duration) -> str:
+    """
+    Build the filter chain that normalises an audio clip to the output sample rate and channel layout.
+    """
+    return f"aresample={AUDIO_SAMPLE_RATE},aformat=channel_layouts=stereo,apad,atrim=duration={duration:.6f}"
+
+
+def video_encoder_args(fps, preset=DEFAULT_PRESET, tune=DEFAULT_TUNE, crf=None, threads=None,
+                       copy_audio=False) -> list:
+    """
+    Output arguments for the video and audio encoders. With copy_audio the audio is copied as it is.
+    """
+    args = ["-r", fps, "-c:v", VIDEO_CODEC, "-preset", preset, "-pix_fmt", "yuv420p"]
+    if tune:
+        args += ["-tune", tune]
+    if crf is not None:
+        args += ["-crf", crf]
+    if threads is not None:
+        args += ["-threads", threads]
+    args += ["-c:a", "copy"] if copy_audio else ["-c:a", AUDIO_CODEC, "-ar", AUDIO_SAMPLE_RATE]
+    return args
+
+
+def write_concat_list(files) -> str:
+    """
+    Write a concat demuxer list of files to a temporary file. The caller removes it.
+
+    :return: Path of the list file.
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        f.write("ffconcat version 1.0\n")
+        for file in files:
+            escaped = str(Path(file).resolve()).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+        return f.name
+
+
+def render_slideshow(pairs, output_file, fps=24, preset=DEFAULT_PRESET, tune=DEFAULT_TUNE, crf=None,
+                     copy_audio=None):
+    """
+    Render a slideshow of still images with their audio clips in a single ffmpeg pass.
+
+    Each image is shown for the duration of its audio clip. When the clips can be copied into the MP4, they are
+    joined with the concat demuxer and copied instead of being decoded and re-encoded.
+
+    :param pairs: List of (image_file, audio_file) tuples in playback order.
+    :param output_file: Path for the output video file.
+    :param fps: Frames per second for the output video.
+    :param preset: x264 preset.
+    :param tune: x264 tune, "stillimage" by default. Pass None to disable.
+    :param crf: Optional x264 constant rate factor.
+    :param copy_audio: Copy the audio instead of re-encoding it. Defaults to can_copy_audio of the clips.
+    :return: output_file
+    """
+    size = get_canvas_size([image_file for image_file, _ in pairs])
+    audio_files = [audio_file for _, audio_file in pairs]
+    if copy_audio is None:
+        copy_audio = can_copy_audio(audio_files)
+    inputs = []
+    filters = []
+    concat_inputs = ""
+    for i, (image_file, audio_file) in enumerate(pairs):
+        duration = probe_duration(audio_file)
+        if copy_audio:
+            inputs += ["-framerate", fps, "-i", image_file]
+            filters.append(f"[{i}:v]{still_image_filter(size, duration, fps)}[v{i}]")
+            concat_inputs += f"[v{i}]"
+        else:
+            inputs += ["-framerate", fps, "-i", image_file, "-i", audio_file]
+            filters.append(f"[{2 * i}:v]{still_image_filter(size, duration, fps)}[v{i}]")
+            filters.append(f"[{2 * i + 1}:a]{audio_filter(duration)}[a{i}]")
+            concat_inputs += f"[v{i}][a{i}]"
+    if copy_audio:
+        filters.append(f"{concat_inputs}concat=n={len(pairs)}:v=1:a=0[v]")
+    else:
+        filters.append(f"{concat_inputs}concat=n={len(pairs)}:v=1:a=1[v][a]")
+
+    # The graph grows with the number of segments, so pass it as a file rather than on the command line.
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        f.write(";\n".join(filters))
+        filter_script = f.name
+    concat_list = write_concat_list(audio_files) if copy_audio else None
+    try:
+        if copy_audio:
+            # The clips are joined by the concat demuxer as one more input after the images
+            inputs += ["-f", "concat", "-safe", "0", "-i", concat_list]
+            audio_map = f"{len(pairs)}:a"
+        else:
+            audio_map = "[a]"
+        run_ffmpeg([
+            *inputs,
+            "-filter_complex_script", filter_script,
+            "-map", "[v]", "-map", audio_map,
+            *video_encoder_args(fps, preset, tune, crf, copy_audio=copy_audio),
+            output_file,
+        ])
+    finally:
+        Path(filter_script).unlink(missing_ok=True)
+        if concat_list:
+            Path(concat_list).unlink(missing_ok=True)
+    return output_file
+
+
+def encode_segment(image_file, audio_file, output_file, size, fps=24, preset=DEFAULT_PRESET, tune=DEFAULT_TUNE,
+                   crf=None, threads=None, copy_audio=False):
+    """
+    Encode one image and its audio clip into a standalone segment file.
+
+    Every segment is encoded with the same canvas size and encoder arguments, so segments can be joined
+    with concat_segments without re-encoding.
+
+    :param image_file: The still image.
+    :param audio_file: The audio clip. The segment lasts as long as this clip.
+    :param output_file: Path for the segment file.
+    :param size: (width, height) of the output canvas.
+    :param copy_audio: Copy the audio clip as it is instead of re-encoding it. Only join segments encoded
+                       with the same setting, from clips of the same format.
+    :return: output_file
+    """
+    output_file = Path(output_file)
+    # Encode to a temporary name so an interrupted encode never leaves a truncated segment behind.
+    partial_file = output_file.with_name(f"{output_file.stem}.part{output_file.suffix}")
+    duration = probe_duration(audio_file)
+    if copy_audio:
+        filters = [
+            "-filter_complex", f"[0:v]{still_image_filter(size, duration, fps)}[v]",
+            "-map", "[v]", "-map", "1:a",
+        ]
+    else:
+        filters = [
+            "-filter_complex", f"[0:v]{still_image_filter(size, duration, fps)}[v];[1:a]{audio_filter(duration)}[a]",
+            "-map", "[v]", "-map", "[a]",
+        ]
+    run_ffmpeg([
+        "-framerate", fps, "-i", image_file,
+        "-i", audio_file,
+        *filters,
+        *video_encoder_args(fps, preset, tune, crf, threads, copy_audio),
+        partial_file,
+    ])
+    os.replace(partial_file, output_file)
+    return output_file
+
+
+def segment_key(image_file, audio_file, size, fps, preset, tune, crf, copy_audio=False) -> str:
+    """
+    Key a segment by the content of its inputs and every parameter that affects its encoding.
+    """
+    audio_args = ("copy",) if copy_audio else (AUDIO_CODEC, AUDIO_SAMPLE_RATE)
+    return make_key(file_checksum(image_file), file_checksum(audio_file), size, fps, preset, tune, crf,
+                    VIDEO_CODEC, *audio_args)
+
+
+def concat_files(files, output_file, extra_args=()):
+    """
+    Join media files with the concat demuxer, copying the streams without re-encoding.
+
+    :param files: Files in playback order, all encoded with the same codecs and parameters.
+    :param output_file: Path for the joined file. The container follows its extension.
+    :param extra_args: Extra output arguments, e.g. muxer flags.
+    :return: output_file
+    """
+    concat_list = write_concat_list(files)
+    try:
+        run_ffmpeg([
+            "-f", "concat", "-safe", "0", "-i", concat_list,
+            "-map", "0", "-c", "copy", *extra_args,
+            output_file,
+        ])
+    finally:
+        Path(concat_list).unlink(missing_ok=True)
+    return output_file
+
+
+def mux_audio(video_file, audio_files, output_file):
+    """
+    Add audio clips, joined in order, to a video without audio, copying both without re-encoding.
+
+    :param video_file: The video without audio.
+    :param audio_files: Audio clips in playback order, see can_copy_audio.
+    :param output_file: Path for the video with audio.
+    :return: output_file
+    """
+    concat_list = write_concat_list(audio_files)
+    try:
+        run_ffmpeg([
+            "-i", video_file,
+            "-f", "concat", "-safe", "0", "-i", concat_list,
+            "-map", "0:v", "-map", "1:a", "-c", "copy", "-movflags", "+faststart",
+            output_file,
+        ])
+    finally:
+        Path(concat_list).unlink(missing_ok=True)
+    return output_file
+
+
+def fit_frame(image_file, size) -> bytes:
+    """
+    Decode an image and fit it centred on a black canvas, the way still_image_filter does.
+
+    :return: The canvas as raw rgb24 frame bytes.
+    """
+    with Image.open(image_file) as image:
+        image = ImageOps.contain(image.convert("RGB"), size)
+    canvas = Image.new("RGB", size)
+    canvas.paste(image, ((size[0] - image.width) // 2, (size[1] - image.height) // 2))
+    return canvas.tobytes()
+
+
+def render_stream(pairs, output_file, fps=24, preset=DEFAULT_PRESET, tune=DEFAULT_TUNE, crf=None, copy_audio=None):
+    """
+    Render a slideshow with a single encoder that is fed the frames of one image at a time.
+
+    Memory use and open processes stay the same however many segments there are. Each image is decoded only
+    when its turn comes and released once its frames are written. The audio clips are read one after another by
+    the concat demuxer, and copied when they can be, see can_copy_audio.
+
+    :param pairs: List of (image_file, audio_file) tuples in playback order.
+    :param output_file: Path for the output video file.
+    :param fps: Frames per second for the output video.
+    :param preset: x264 preset.
+    :param tune: x264 tune, "stillimage" by default. Pass None to disable.
+    :param crf: Optional x264 constant rate factor.
+    :param copy_audio: Copy the audio instead of re-encoding it. Defaults to can_copy_audio of the clips.
+    :return: output_file
+    """
+    size = get_canvas_size([image_file for image_file, _ in pairs])
+    audio_files = [audio_file for _, audio_file in pairs]
+    formats = probe_audio_formats(audio_files)
+    if copy_audio is None:
+        copy_audio = can_copy_audio(audio_files, formats)
+
+    with tempfile.TemporaryDirectory(dir=Path(output_file).parent) as tmp_dir, \
+            tempfile.TemporaryFile() as stderr_file:
+        if not copy_audio and len(formats) != 1:
+            # The concat demuxer can only decode clips of one format, so convert mixed clips to WAV one at a time
+            audio_files = [Path(tmp_dir) / f"{i:05}.wav" for i in range(len(pairs))]
+            for (_, audio_file), wav_file in zip(pairs, audio_files):
+                run_ffmpeg(["-i", audio_file, "-ar", AUDIO_SAMPLE_RATE, "-ac", 2, "-c:a", "pcm_s16le", wav_file])
+        concat_list = write_concat_list(audio_files)
+        audio_args = [] if copy_audio else ["-af", f"aresample={AUDIO_SAMPLE_RATE},aformat=channel_layouts=stereo"]
+        command = [
+            FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{size[0]}x{size[1]}", "-framerate", str(fps), "-i", "-",
+            "-f", "concat", "-safe", "0", "-i", concat_list,
+            "-map", "0:v", "-map", "1:a", *audio_args,
+            *[str(arg) for arg in video_encoder_args(fps, preset, tune, crf, copy_audio=copy_audio)],
+            "-movflags", "+faststart",
+            str(output_file),
+        ]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr_file)
+        try:
+            elapsed = 0.0
+            frames_written = 0
+            for image_file, audio_file in pairs:
+                # Frames are counted from the start of the video, so rounding never drifts from the audio
+                elapsed += probe_duration(audio_file)
+                frame_count = round(elapsed * fps) - frames_written
+                frame = fit_frame(image_file, size)
+                for _ in range(frame_count):
+                    process.stdin.write(frame)
+                frames_written += frame_count
+            process.stdin.close()
+        except BrokenPipeError:
+            pass  # ffmpeg exited early, its error is raised below
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            process.wait()
+            Path(concat_list).unlink(missing_ok=True)
+        if process.returncode != 0:
+            stderr_file.seek(0)
+            raise subprocess.CalledProcessError(process.returncode, command,
+                                                stderr=stderr_file.read().decode(errors="replace"))
+    return output_file
+
+
+def concat_segments(segment_files, output_file):
+    """
+    Join segment files into one video with the concat demuxer, copying the streams without re-encoding.
+
+    :param segment_files: Segment files in playback order, all encoded with the same parameters.
+    :param output_file: Path for the joined video.
+    :return: output_file
+    """
+    return concat_files(segment_files, output_file, ["-movflags", "+faststart"])
+
+
+def render_segments(pairs, output_file, fps=24, preset=DEFAULT_PRESET, tune=DEFAULT_TUNE, crf=None, workers=None,
+                    segment_dir=None, copy_audio=None):
+    """
+    Render a slideshow by encoding every image and audio pair as its own segment in parallel,
+    then joining the segments with a stream copy.
+
+    The segments are encoded by ffmpeg subprocesses, so a thread pool is enough to keep every core busy.
+    Each encoder gets an equal share of the cores to avoid oversubscription.
+
+    Segment files are named by a hash of their inputs and encoding parameters. When segment_dir is kept between
+    runs, only segments whose image or audio changed are re-encoded, and segments no longer used are removed.
+
+    :param pairs: List of (image_file, audio_file) tuples in playback order.
+    :param output_file: Path for the output video file.
+    :param workers: Number of segments encoded at once. Defaults to the number of CPUs.
+    :param segment_dir: Directory for the segment files. Defaults to a temporary directory that is removed afterwards.
+    :param copy_audio: Copy the audio clips into the segments instead of re-encoding them.
+                       Defaults to can_copy_audio of the clips.
+    :return: output_file
+    """
+    workers = workers or os.cpu_count() or 1
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    size = get_canvas_size([image_file for image_file, _ in pairs])
+    if copy_audio is None:
+        copy_audio = can_copy_audio([audio_file for _, audio_file in pairs])
+
+    with tempfile.TemporaryDirectory(dir=Path(output_file).parent) as tmp_dir:
+        segment_dir = Path(segment_dir or tmp_dir)
+        segment_dir.mkdir(parents=True, exist_ok=True)
+        segment_files = [
+            segment_dir / f"{segment_key(image_file, audio_file, size, fps, preset, tune, crf, copy_audio)}.mp4"
+            for image_file, audio_file in pairs
+        ]
+        # Identical image and audio pairs share one segment file, so only encode each missing file once
+        pending = {
+            segment_file: pair for pair, segment_file in zip(pairs, segment_files) if not segment_file.exists()
+        }
+        print(f"Encoding {len(pending)} segments, reusing {len(pairs) - len(pending)} of {len(pairs)}")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(encode_segment, image_file, audio_file, segment_file, size, fps, preset, tune, crf,
+                                threads, copy_audio)
+                for segment_file, (image_file, audio_file) in pending.items()
+            ]
+            for future in futures:
+                future.result()
+        concat_segments(segment_files, output_file)
+
+        # Drop segments from earlier versions of the inputs
+        for stale_file in set(segment_dir.glob("*.mp4")) - set(segment_files):
+            stale_file.unlink(missing_ok=True)
+    return output_file
@@ -1,20 +1,138 @@
+import hashlib
+import json
+import os
+import threading
 import uuid
 from slugify import slugify
 from pathlib import Path
+import metrics_utils
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+def file_checksum(path) -> str:
+    """
+    Compute the sha256 checksum of a file.
+
+    Args:
+        path: The file to hash.
+
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RunManifest:
+    def __init__(self, path: Path, title: str = None):
+        """
+        Initialize a RunManifest instance, loading the existing manifest if there is one.
+
+        The manifest records each completed stage of a run (outline, section scripts, transcript turns, ...)
+        and every generated asset with its checksum, so an interrupted run can be resumed.
+
+        Args:
+            path (Path): The manifest file.
+            title (str): The title of the run, stored for resuming.
+        """
+        self.path = Path(path)
+        self._lock = threading.RLock()
+        if self.path.exists():
+            with open(self.path) as f:
+                self.data = json.load(f)
+        else:
+            self.data = {"title": title, "stages": {}, "assets": {}}
+            self.save()
+
+    @property
+    def title(self) -> str:
+        return self.data.get("title")
+
+    def save(self) -> None:
+        """
+        Atomically write the manifest to disk.
+        """
+        with self._lock:
+            tmp = self.path.with_name(f"{self.path.name}.{threading.get_ident()}.tmp")
+            with open(tmp, "w") as f:
+                json.dump(self.data, f, indent=2, ensure_ascii=False)
+            os.replace(tmp, self.path)
+
+    def complete_stage(self, name: str, result=None) -> None:
+        """
+        Record a completed stage and its JSON-serialisable result.
+        """
+        with self._lock:
+            self.data["stages"][name] = {"result": result}
+            self.save()
+
+    def is_stage_complete(self, name: str) -> bool:
+        return name in self.data["stages"]
+
+    def get_stage(self, name: str, default=None):
+        """
+        Return the recorded result of a stage, or default if the stage has not completed.
+        """
+        stage = self.data["stages"].get(name)
+        return default if stage is None else stage["result"]
+
+    def record_asset(self, path) -> None:
+        """
+        Record a finished asset file with its checksum.
+        """
+        path = Path(path)
+        checksum = file_checksum(path)
+        with self._lock:
+            self.data["assets"][path.name] = checksum
+            self.save()
+
+    def has_asset(self, filename: str) -> bool:
+        """
+        Check whether an asset was recorded and is still present and unchanged on disk.
+        """
+        checksum = self.data["assets"].get(filename)
+        path = self.path.parent / filename
+        return checksum is not None and path.exists() and file_checksum(path) == checksum
+
 
 class OutputFolder:
-    def __init__(self, parent_folder: str, title: str):
+    def __init__(self, parent_folder: str, title: str, path=None):
         """
         Initialize an OutputFolder instance.
 
         Args:
             parent_folder (str): The parent folder where the output folder will be created.
             title (str): The title used to generate the output folder name.
+            path: An existing output folder to reuse instead of creating a new one.
         """
         self.parent = parent_folder
         self.title = title
         self.title_slug = slugify(title)
-        self.path = self._create_folder()
+        self.path = Path(path) if path else self._create_folder()
+        self.manifest = RunManifest(self.path / MANIFEST_FILENAME, title)
+        metrics_utils.set_output_folder(self.path)
+
+    @classmethod
+    def resume(cls, path) -> "OutputFolder":
+        """
+        Reopen the output folder of a previous run, using the title stored in its manifest.
+
+        Args:
+            path: The existing output folder.
+
+        Returns:
+            OutputFolder: The reopened folder.
+        """
+        path = Path(path)
+        manifest_path = path / MANIFEST_FILENAME
+        if not manifest_path.exists():
+            raise FileNotFoundError(f"No {MANIFEST_FILENAME} in {path}, cannot resume.")
+        title = RunManifest(manifest_path).title or path.name
+        return cls(str(path.parent), title, path=path)
 
     def _create_folder(self) -> Path:
         """
@@ -26,4 +144,4 @@ class OutputFolder:
         folder_name = f"{self.title_slug}-{uuid.uuid4()}"
         path = Path(self.parent) / folder_name
         path.mkdir(parents=True, exist_ok=True)
-        return path
\ No newline at end of file
+        return path
@@ -1,122 +1,102 @@
-from openai import OpenAI
 from pathlib import Path
 import os
 import sys
 import json
+import argparse
 import dotenv
-import slugify
-import requests
-import uuid
 import random
-import pathlib
 from video_utils import create_video_from_clips
+from openai_utils import chat_completion
+from asset_utils import generate_assets
+from folder_utils import OutputFolder
+import metrics_utils
+import profile_utils
 
 # load environment variables
 dotenv.load_dotenv()
 
-# set up the openai client
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-
 # We're going to use OpenAI Chat Completions API to make a listicle video.
 
-# Prompt the user for the topic
-
-topic = input("What topic should the AI make a listicle about?")
-
-# prompt the AI for listicle script in json format
-
-response = openai_client.chat.completions.create(
-    model="gpt-4-turbo-preview",
-    response_format={"type": "json_object"},
-    messages=[
-        {
-            "role": "system",
-            "content": f"Your task is to write a script for a listicle video. Represent the script for a listicle video in json format. The video will be a slideshow with AI generated images, and TTS voiceover. Use the keys title and script. script is a list of objects, each with the key 'image_description' and 'voiceover'. The goal is to accompany each section of voiceover with a unique image related to the voiceover. Close out the video by thanking the viewer for watching, asking them to like the video, and asking them to subscribe to our channel.",
-        },
-        {
-            "role": "user",
-            "content": f"Write a listicle about {topic}.",
-        },
-    ],
-)
-
-listicle_script = response.choices[0].message.content
-
-listicle_script = json.loads(listicle_script)
-
-# print the listicle script
-
-# print(json.dumps(listicle_script, indent=4))
+SYSTEM_MESSAGE = "Your task is to write a script for a listicle video. Represent the script for a listicle video in json format. The video will be a slideshow with AI generated images, and TTS voiceover. Use the keys title and script. script is a list of objects, each with the key 'image_description' and 'voiceover'. The goal is to accompany each section of voiceover with a unique image related to the voiceover. Close out the video by thanking the viewer for watching, asking them to like the video, and asking them to subscribe to our channel."
+
+
+def get_listicle_script(topic):
+    # prompt the AI for listicle script in json format
+    script = chat_completion(
+        model="gpt-4-turbo-preview",
+        response_format={"type": "json_object"},
+        messages=[
+            {
+                "role": "system",
+                "content": SYSTEM_MESSAGE,
+            },
+            {
+                "role": "user",
+                "content": f"Write a listicle about {topic}.",
+            },
+        ],
+    )
+    return json.loads(script)
 
-title = listicle_script["title"]
 
-print(f"Title: {title}")
+@metrics_utils.record_run
+def make_listicle(topic):
+    """
+    Write a listicle script about a topic, generate its voiceovers and images, and render the video.
 
-title_slug = slugify.slugify(title)
+    :param topic: The topic of the listicle.
+    :return: The path of the output folder.
+    """
+    with metrics_utils.stage("script"):
+        listicle_script = get_listicle_script(topic)
 
-# create the listicles folder if it doesn't exist
+    # print the listicle script
 
-if not os.path.exists("listicles"):
-    os.makedirs("listicles")
+    # print(json.dumps(listicle_script, indent=4))
 
-# create a folder for this listicle
+    title = listicle_script["title"]
 
-listicle_dir = f"listicles/{title_slug}-{uuid.uuid4()}"
-os.makedirs(listicle_dir)
+    print(f"Title: {title}")
 
-# save the listicle script to a file
+    # create a folder for this listicle
 
-with open(f"{listicle_dir}/listicle_script.json", "w") as f:
-    json.dump(listicle_script, f, indent=4)
+    output_folder = OutputFolder("listicles", title)
+    listicle_dir = output_folder.path
 
-listicle_script = listicle_script["script"]
+    # save the listicle script to a file
 
-# get list of voiceovers
+    with open(f"{listicle_dir}/listicle_script.json", "w") as f:
+        json.dump(listicle_script, f, indent=4)
 
-voiceovers = [item["voiceover"] for item in listicle_script]
+    listicle_script = listicle_script["script"]
 
-for i, voiceover in enumerate(voiceovers):
-    # print status message
-    print(f"Processing voiceover {i} of {len(voiceovers)}")
-    # print the voiceover
-    print(voiceover)
+    # generate the voiceovers and images for every section concurrently
     # valid voice names are alloy, echo, fable, onyx, nova, and shimmer
-    # choose a random voice
-    voice = random.choice(["alloy", "echo", "fable", "onyx", "nova", "shimmer"])
-    response = openai_client.audio.speech.create(
-        model="tts-1",
-        voice=voice,
-        input=voiceover,
-    )
-    voiceover_path = Path(f"{listicle_dir}/{i:03}.mp3")
-    response.stream_to_file(voiceover_path)
+    # choose a random voice for each section
 
+    sections = [
+        {**item, "voice": random.choice(["alloy", "echo", "fable", "onyx", "nova", "shimmer"])}
+        for item in listicle_script
+    ]
+    generate_assets(sections, listicle_dir, manifest=output_folder.manifest)
 
-# get list of image descriptions
+    # start creating a video from the images and audio files
 
-image_descriptions = [item["image_description"] for item in listicle_script]
+    output_video_path = f"{listicle_dir}/final_video.mp4"
+    create_video_from_clips(listicle_dir, output_video_path)
+    output_folder.manifest.complete_stage("video", output_video_path)
+    return listicle_dir
 
-for i, image_description in enumerate(image_descriptions):
-    # print status message
-    print(f"Processing image {i} of {len(image_descriptions)}")
-    # print the image description
-    print(image_description)
-    response = openai_client.images.generate(
-        model="dall-e-3",
-        prompt=image_description,
-        size="1024x1024",
-        quality="standard",
-        n=1,
-    )
 
-    image_url = response.data[0].url
-    image = requests.get(image_url).content
-    # save the image to a file
-    with open(f"{listicle_dir}/{i:03}.png", "wb") as handler:
-        handler.write(image)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a listicle video.")
+    profile_utils.add_profile_argument(parser)
+    args = parser.parse_args()
+    if args.profile:
+        profile_utils.enable()
+
+    # Prompt the user for the topic
 
-# start creating a video from the images and audio files
+    topic = input("What topic should the AI make a listicle about?")
 
-output_video_path = f"{listicle_dir}/final_video.mp4"
-create_video_from_clips(listicle_dir, output_video_path)
\ No newline at end of file
+    make_listicle(topic)
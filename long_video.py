@@ -1,16 +1,19 @@
-from openai import OpenAI
-import os
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import contextvars
 from dotenv import load_dotenv
 import json
 from folder_utils import OutputFolder
-from openai_utils import generate_image, generate_voice_clip
+from asset_utils import generate_assets
+from openai_utils import chat_completion, count_tokens
+from context_utils import CONTEXT_STRATEGIES, FullScriptContext, RollingSummaryContext
 from video_utils import create_video_from_clips
+from pipeline import run_pipeline
+import metrics_utils
+import profile_utils
 
 load_dotenv()
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-
 OUTLINER_MODEL = "gpt-4-turbo-preview"
 
 OUTLINER_SYSTEM_MESSAGE = """Your job is to write an outline for a YouTube video based on the topic provided by the user..
@@ -35,8 +38,18 @@ Each object in 'section' should have the keys 'voiceover' and 'image_description
 'voiceover' should be the voiceover for the section. 'image_description' should be a description of the image for the section.
 Do not wrap up the video unless the section is titled 'Conclusion' or 'Outro'."""
 
+SMOOTHING_MODEL = "gpt-4-turbo-preview"
+
+SMOOTHING_SYSTEM_MESSAGE = """Your job is to edit a YouTube video script whose sections were written separately.
+The script is a json list of voiceovers, each with its index.
+Fix awkward transitions between sections, repeated introductions, repeated facts and premature wrap-ups.
+Change as little as possible.
+Your response should be a json object with the key 'edits'.
+'edits' is a list of objects with the keys 'index' and 'voiceover', one for each voiceover you changed.
+Leave out voiceovers that need no changes."""
+
 def get_outline(topic: str) -> dict:
-    response = openai_client.chat.completions.create(
+    outline = chat_completion(
         model=OUTLINER_MODEL,
         messages=[
             {
@@ -51,12 +64,13 @@ def get_outline(topic: str) -> dict:
         response_format={"type": "json_object"},
         temperature=1.1,
     )
-    outline = response.choices[0].message.content
     outline = json.loads(outline)
     return outline
 
-def get_section_script(video_title: str, script: list, section: dict) -> list:
-    response = openai_client.chat.completions.create(
+def get_section_script(video_title: str, script: list, section: dict, context: str = None) -> list:
+    if context is None:
+        context = json.dumps(script, ensure_ascii=False)
+    section_script = chat_completion(
         model=SECTION_MODEL,
         messages=[
             {
@@ -64,13 +78,12 @@ def get_section_script(video_title: str, script: list, section: dict) -> list:
                 "content": SECTION_SYSTEM_MESSAGE},
             {
                 "role": "user",
-                "content": f"""Video Title: {video_title}\n\nHere's the script so far: {json.dumps(script,ensure_ascii=False)}\n\nThe next Section to write is: {json.dumps(section,ensure_ascii=False)}""",
+                "content": f"""Video Title: {video_title}\n\nHere's the script so far: {context}\n\nThe next Section to write is: {json.dumps(section,ensure_ascii=False)}""",
             },
         ],
         response_format={"type": "json_object"},
         temperature=0.7,
     )
-    section_script = response.choices[0].message.content
     section_script = json.loads(section_script)
     section_script = section_script["section"]
     return section_script
@@ -87,50 +100,249 @@ def flatten_outline(outline:dict) -> list:
             flat_outline.append(section)
     return flat_outline
 
-def process_outline(outline: dict) -> list:
+def iter_outline(outline: dict, manifest=None, context_strategy=None):
+    """
+    Write the script section by section, yielding each segment as soon as its section is written.
+
+    context_strategy decides what each section request sees of the script so far.
+    It defaults to a RollingSummaryContext, which keeps the prompt within a fixed token budget.
+    Its state is recorded in the manifest after every section, so a resumed run restores it
+    instead of summarising the sections already written again.
+    """
     video_title = outline["title"]
     flat_outline = flatten_outline(outline)
+    context_strategy = context_strategy or RollingSummaryContext()
     script: list = []
-    for section in flat_outline:
-        print(f"title: {section['title']}\nwriting_prompt: {section['writing_prompt']}")
-        section_script = get_section_script(video_title, script, section)
-        print(json.dumps(section_script, indent=2, ensure_ascii=False))
+    for i, section in enumerate(flat_outline):
+        stage = f"section:{i:03}"
+        if manifest and manifest.is_stage_complete(stage):
+            print(f"Skipping section {i}, already written: {section['title']}")
+            section_script = manifest.get_stage(stage)
+        else:
+            print(f"title: {section['title']}\nwriting_prompt: {section['writing_prompt']}")
+            context = context_strategy.render()
+            full_tokens = count_tokens(json.dumps(script, ensure_ascii=False), SECTION_MODEL)
+            context_tokens = count_tokens(context, SECTION_MODEL)
+            print(f"Section {i} context: {context_tokens} tokens ({full_tokens - context_tokens} saved vs. the full script)")
+            section_script = get_section_script(video_title, script, section, context)
+            print(json.dumps(section_script, indent=2, ensure_ascii=False))
+            if manifest:
+                manifest.complete_stage(stage, section_script)
         script.extend(section_script)
-    return script
+        context_stage = f"context:{i:03}"
+        context_state = manifest.get_stage(context_stage) if manifest else None
+        if context_state and context_state["strategy"] == type(context_strategy).__name__:
+            context_strategy.set_state(context_state["state"])
+        else:
+            context_strategy.add(section_script)
+            if manifest:
+                manifest.complete_stage(context_stage, {"strategy": type(context_strategy).__name__,
+                                                        "state": context_strategy.get_state()})
+        yield from section_script
 
-# Prompt the user for a topic
-video_topic = input("What is the topic of your video? ")
+def process_outline(outline: dict, manifest=None, context_strategy=None) -> list:
+    return list(iter_outline(outline, manifest, context_strategy))
 
-# Generate the outline
-outline = get_outline(video_topic)
+def get_outline_context(flat_outline: list, index: int) -> str:
+    """
+    Compact, outline-level context for drafting one section without the rest of the script.
+    """
+    return json.dumps({
+        "note": "The other sections are being written at the same time. This is the outline of the whole video.",
+        "outline": [section["title"] for section in flat_outline],
+        "position": f"section {index + 1} of {len(flat_outline)}",
+        "previous_section": flat_outline[index - 1]["title"] if index > 0 else None,
+        "next_section": flat_outline[index + 1]["title"] if index + 1 < len(flat_outline) else None,
+    }, ensure_ascii=False)
 
-# Print the outline
-print(json.dumps(outline, indent=2, ensure_ascii=False))
+def smooth_transitions(video_title: str, script: list) -> list:
+    """
+    Single consistency pass over a script drafted in parallel. Only the voiceovers the model edits are replaced.
+    """
+    voiceovers = [
+        {"index": i, "voiceover": segment.get("voiceover", "")}
+        for i, segment in enumerate(script) if isinstance(segment, dict)
+    ]
+    edits = chat_completion(
+        model=SMOOTHING_MODEL,
+        messages=[
+            {
+                "role": "system",
+                "content": SMOOTHING_SYSTEM_MESSAGE,
+            },
+            {
+                "role": "user",
+                "content": f"Video Title: {video_title}\n\nScript: {json.dumps(voiceovers, ensure_ascii=False)}",
+            },
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.3,
+    )
+    smoothed = [dict(segment) if isinstance(segment, dict) else segment for segment in script]
+    for edit in json.loads(edits).get("edits", []):
+        index = edit.get("index")
+        if isinstance(index, int) and 0 <= index < len(smoothed) and isinstance(smoothed[index], dict) and edit.get("voiceover"):
+            smoothed[index]["voiceover"] = edit["voiceover"]
+    print(f"Smoothing pass edited {sum(a != b for a, b in zip(script, smoothed))} of {len(script)} voiceovers")
+    return smoothed
 
-# Save the outline
-output_folder = OutputFolder("long_videos", outline["title"])
-with open(output_folder.path / "outline.json", "w") as f:
-    json.dump(outline, f, indent=2, ensure_ascii=False)
+def process_outline_parallel(outline: dict, manifest=None, max_workers=None, smooth=False) -> list:
+    """
+    Draft every section of the outline concurrently from outline-level context,
+    then optionally run one consistency pass over the whole script.
+    """
+    video_title = outline["title"]
+    flat_outline = flatten_outline(outline)
 
-# Process the outline into a script
-script = process_outline(outline)
+    def write_section(i, section):
+        stage = f"section:{i:03}"
+        if manifest and manifest.is_stage_complete(stage):
+            print(f"Skipping section {i}, already written: {section['title']}")
+            return manifest.get_stage(stage)
+        section_script = get_section_script(video_title, [], section, get_outline_context(flat_outline, i))
+        print(f"Wrote section {i}: {section['title']}")
+        if manifest:
+            manifest.complete_stage(stage, section_script)
+        return section_script
 
-# Save the script
-with open(output_folder.path / "script.json", "w") as f:
-    json.dump(script, f, indent=2, ensure_ascii=False)
+    with ThreadPoolExecutor(max_workers=max_workers or len(flat_outline) or 1) as executor:
+        # Each section runs in a copy of the caller's context, so its calls count towards the run metrics
+        futures = [executor.submit(contextvars.copy_context().run, write_section, i, section)
+                   for i, section in enumerate(flat_outline)]
+        section_scripts = [future.result() for future in futures]
+    script = [segment for section_script in section_scripts for segment in section_script]
 
-# Generate the images and voiceovers
-for i, segment in enumerate(script):
-    if isinstance(segment, dict):
-        image_description = segment.get("image_description")
-        if image_description:
-            generate_image(image_description, "1024x1024", output_folder.path, f"{i:03}.png")
-        voiceover = segment.get("voiceover")
-        if voiceover:
-            generate_voice_clip(voiceover, "alloy", output_folder.path, f"{i:03}.mp3")
+    if smooth:
+        if manifest and manifest.is_stage_complete("smoothed"):
+            script = manifest.get_stage("smoothed")
+        else:
+            script = smooth_transitions(video_title, script)
+            if manifest:
+                manifest.complete_stage("smoothed", script)
+    return script
+
+def save_script(output_folder, script):
+    with open(output_folder.path / "script.json", "w") as f:
+        json.dump(script, f, indent=2, ensure_ascii=False)
+    output_folder.manifest.complete_stage("script", script)
+
+@metrics_utils.record_run
+def make_long_video(topic=None, resume=None, pipeline=False, context="rolling", context_tokens=2000,
+                    recent_segments=6, parallel=False, smooth=False, section_workers=None):
+    """
+    Generate a long form video from a topic, or resume an interrupted run.
+
+    :param topic: The topic of the video. Required unless resume is given.
+    :param resume: Output folder of an interrupted run to resume.
+    :param pipeline: Stream each section through script, assets and segment encoding as soon as it is ready.
+    :param context: Context strategy for sequential section writing, "rolling" or "full".
+    :param context_tokens: Token budget of the rolling context.
+    :param recent_segments: Segments the rolling context keeps verbatim.
+    :param parallel: Draft all sections concurrently from the outline.
+    :param smooth: With parallel, run one consistency pass over the script.
+    :param section_workers: With parallel, the number of sections drafted at once.
+    :return: The path of the output folder.
+    """
+    if context == "rolling":
+        context_strategy = RollingSummaryContext(context_tokens, recent_segments)
+    else:
+        context_strategy = FullScriptContext()
+
+    if resume:
+        output_folder = OutputFolder.resume(resume)
+        outline = output_folder.manifest.get_stage("outline")
+        print(f"Resuming {output_folder.path}")
     else:
-        print(f"Warning: segment {i} is not a dictionary! Skipping...")
-# Create the video
-video_path = f"{output_folder.path}/video.mp4"
-create_video_from_clips(output_folder.path, video_path)
-print(f"Video created at {video_path}")
+        # Generate the outline
+        with metrics_utils.stage("script"):
+            outline = get_outline(topic)
+
+        # Print the outline
+        print(json.dumps(outline, indent=2, ensure_ascii=False))
+
+        # Save the outline
+        output_folder = OutputFolder("long_videos", outline["title"])
+        with open(output_folder.path / "outline.json", "w") as f:
+            json.dump(outline, f, indent=2, ensure_ascii=False)
+        output_folder.manifest.complete_stage("outline", outline)
+    manifest = output_folder.manifest
+    video_path = f"{output_folder.path}/video.mp4"
+
+    script = manifest.get_stage("script")
+    if script is None and parallel:
+        with metrics_utils.stage("script"):
+            script = process_outline_parallel(outline, manifest, section_workers, smooth)
+        save_script(output_folder, script)
+
+    if pipeline:
+        # Feed segments to the pipeline as they are written, collecting the script along the way
+        streamed_script = []
+
+        def stream_script():
+            for segment in script if script is not None else iter_outline(outline, manifest, context_strategy):
+                streamed_script.append(segment)
+                yield segment
+
+        with metrics_utils.stage("pipeline"):
+            failures = run_pipeline(stream_script(), output_folder.path, video_path, voice="alloy",
+                                    manifest=manifest)
+        if script is None:
+            save_script(output_folder, streamed_script)
+        if failures:
+            # Leave the video stage open, so a resume regenerates the missing sections and renders again
+            print(f"Video created at {video_path} without sections {sorted(failures)}. "
+                  f"Resume with --resume {output_folder.path} to retry them.")
+            return output_folder.path
+        manifest.complete_stage("video", video_path)
+        print(f"Video created at {video_path}")
+        return output_folder.path
+
+    # Process the outline into a script
+    if script is None:
+        with metrics_utils.stage("script"):
+            script = process_outline(outline, manifest, context_strategy)
+
+        # Save the script
+        save_script(output_folder, script)
+
+    # Generate the images and voiceovers
+    generate_assets(script, output_folder.path, voice="alloy", manifest=manifest)
+    # Create the video
+    # Long videos have hundreds of sections, so render with the backend whose memory use doesn't grow with them
+    create_video_from_clips(output_folder.path, video_path, backend="stream")
+    manifest.complete_stage("video", video_path)
+    print(f"Video created at {video_path}")
+    return output_folder.path
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a long form video from a topic.")
+    parser.add_argument("--resume", metavar="FOLDER", help="Resume an interrupted run from its output folder.")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Stream each section through script, assets and segment encoding as soon as it is ready.")
+    parser.add_argument("--context", choices=CONTEXT_STRATEGIES, default="rolling",
+                        help="What each section request sees of the script so far. 'full' sends the entire script.")
+    parser.add_argument("--context-tokens", type=int, default=2000,
+                        help="Token budget of the rolling context.")
+    parser.add_argument("--recent-segments", type=int, default=6,
+                        help="Segments the rolling context keeps verbatim.")
+    parser.add_argument("--parallel", action="store_true",
+                        help="Draft all sections concurrently from the outline instead of one after another.")
+    parser.add_argument("--smooth", action="store_true",
+                        help="With --parallel, run one consistency pass to smooth transitions between sections.")
+    parser.add_argument("--section-workers", type=int, default=None,
+                        help="With --parallel, the number of sections drafted at once. Defaults to all of them.")
+    profile_utils.add_profile_argument(parser)
+    args = parser.parse_args()
+    if args.profile:
+        profile_utils.enable()
+
+    video_topic = None
+    if not args.resume:
+        # Prompt the user for a topic
+        video_topic = input("What is the topic of your video? ")
+
+    make_long_video(video_topic, args.resume, args.pipeline, args.context, args.context_tokens, args.recent_segments,
+                    args.parallel, args.smooth, args.section_workers)
+
+if __name__ == "__main__":
+    main()
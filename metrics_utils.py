@@ -0,0 +1,247 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+import profile_utils
+
+METRICS_FILENAME = "metrics.json"
+
+# Directory for Prometheus text-format files, e.g. the node exporter's textfile collector directory.
+# Each entry point writes content_mill_<name>.prom there after a run. Unset to skip.
+PROMETHEUS_DIR = os.getenv("METRICS_PROMETHEUS_DIR")
+
+# The metrics of the run in progress. Worker threads see it when their work is submitted with
+# contextvars.copy_context().run, so concurrent runs in one process, such as batch jobs, stay apart.
+current_metrics = contextvars.ContextVar("current_metrics", default=None)
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+
+class RunMetrics:
+    def __init__(self, name: str):
+        """
+        Performance metrics of one run: API calls, retries, tokens, bytes, counters and stage durations.
+
+        Args:
+            name (str): Name of the entry point, e.g. "make_listicle".
+        """
+        self.name = name
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.finished = None
+        self.output_folder = None
+        self.calls = {}
+        self.stages = {}
+        self.counters = {}
+
+    def _call_stats(self, api: str) -> dict:
+        return self.calls.setdefault(api, {
+            "requests": 0, "errors": 0, "retries": 0, "latencies": [],
+            "prompt_tokens": 0, "completion_tokens": 0, "bytes": 0,
+        })
+
+    def record_call(self, api: str, latency: float, attempts: int = 1, error: bool = False) -> None:
+        with self.lock:
+            stats = self._call_stats(api)
+            stats["requests"] += 1
+            stats["retries"] += attempts - 1
+            stats["errors"] += int(error)
+            stats["latencies"].append(latency)
+
+    def record_tokens(self, api: str, prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+        with self.lock:
+            stats = self._call_stats(api)
+            stats["prompt_tokens"] += prompt_tokens or 0
+            stats["completion_tokens"] += completion_tokens or 0
+
+    def record_bytes(self, api: str, size: int) -> None:
+        with self.lock:
+            self._call_stats(api)["bytes"] += size or 0
+
+    def record_stage(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def increment(self, counter: str, amount: int = 1) -> None:
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            calls = {}
+            for api, stats in sorted(self.calls.items()):
+                latencies = stats["latencies"]
+                calls[api] = {
+                    **{key: value for key, value in stats.items() if key != "latencies"},
+                    "latency_seconds": {
+                        "total": round(sum(latencies), 3),
+                        "mean": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                        "p50": round(_percentile(latencies, 0.5), 3),
+                        "p95": round(_percentile(latencies, 0.95), 3),
+                        "max": round(max(latencies, default=0.0), 3),
+                    },
+                }
+            return {
+                "name": self.name,
+                "started_at": self.started,
+                "duration_seconds": round((self.finished or time.time()) - self.started, 3),
+                "stages": {stage: round(seconds, 3) for stage, seconds in self.stages.items()},
+                "api_calls": calls,
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def write(self, folder) -> Path:
+        """
+        Write the metrics to metrics.json in folder.
+
+        The metrics of earlier runs in the same folder, such as the run that generated it before a resume or a
+        re-render with vidgen.py, are kept under "previous_runs", oldest first.
+        """
+        path = Path(folder) / METRICS_FILENAME
+        data = self.to_dict()
+        try:
+            with open(path) as f:
+                previous = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            previous = None
+        if isinstance(previous, dict):
+            data["previous_runs"] = previous.pop("previous_runs", []) + [previous]
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+    def to_prometheus(self) -> str:
+        """
+        Render the metrics in the Prometheus text exposition format.
+        """
+        data = self.to_dict()
+        run = f'run="{self.name}"'
+        lines = [
+            "# TYPE content_mill_run_duration_seconds gauge",
+            f"content_mill_run_duration_seconds{{{run}}} {data['duration_seconds']}",
+            "# TYPE content_mill_stage_duration_seconds gauge",
+            *(f'content_mill_stage_duration_seconds{{{run},stage="{stage}"}} {seconds}'
+              for stage, seconds in data["stages"].items()),
+        ]
+        series = {
+            "api_requests_total": "requests", "api_errors_total": "errors", "api_retries_total": "retries",
+            "api_prompt_tokens_total": "prompt_tokens", "api_completion_tokens_total": "completion_tokens",
+            "api_bytes_total": "bytes",
+        }
+        for metric, key in series.items():
+            lines.append(f"# TYPE content_mill_{metric} counter")
+            for api, stats in data["api_calls"].items():
+                endpoint, _, model = api.partition("/")
+                lines.append(f'content_mill_{metric}{{{run},endpoint="{endpoint}",model="{model}"}} {stats[key]}')
+        lines.append("# TYPE content_mill_api_latency_seconds_sum counter")
+        for api, stats in data["api_calls"].items():
+            endpoint, _, model = api.partition("/")
+            lines.append(f'content_mill_api_latency_seconds_sum{{{run},endpoint="{endpoint}",model="{model}"}} '
+                         f'{stats["latency_seconds"]["total"]}')
+        lines.append("# TYPE content_mill_events_total counter")
+        lines.extend(f'content_mill_events_total{{{run},event="{counter}"}} {value}'
+                     for counter, value in data["counters"].items())
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, directory) -> Path:
+        # Written to a temporary file first, so the collector never reads a partial file
+        path = Path(directory) / f"content_mill_{self.name}.prom"
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(self.to_prometheus())
+        os.replace(tmp_path, path)
+        return path
+
+
+def record_call(api, latency, attempts=1, error=False):
+    """
+    Record one API call, including its retries, in the current run's metrics. A no-op outside a run.
+    """
+    metrics = current_metrics.get()
+    if metrics:
+        metrics.record_call(api, latency, attempts, error)
+
+
+def record_tokens(api, prompt_tokens=0, completion_tokens=0):
+    metrics = current_metrics.get()
+    if metrics:
+        metrics.record_tokens(api, prompt_tokens, completion_tokens)
+
+
+def record_bytes(api, size):
+    metrics = current_metrics.get()
+    if metrics:
+        metrics.record_bytes(api, size)
+
+
+def record_stage(name, seconds):
+    metrics = current_metrics.get()
+    if metrics:
+        metrics.record_stage(name, seconds)
+
+
+def increment(counter, amount=1):
+    metrics = current_metrics.get()
+    if metrics:
+        metrics.increment(counter, amount)
+
+
+def set_output_folder(path):
+    """
+    Tell the current run where to write its metrics.json.
+    """
+    metrics = current_metrics.get()
+    if metrics:
+        metrics.output_folder = Path(path)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a stage of the current run. Repeated stages add up.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def record_run(function):
+    """
+    Decorator for entry points: collect the metrics of everything the function does, then write them to
+    metrics.json in the run's output folder, after the metrics of earlier runs there, and to PROMETHEUS_DIR if it
+    is set. Failed runs are written too.
+    The run is also profiled into the output folder when profiling is enabled, see profile_utils.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        metrics = RunMetrics(function.__name__)
+        token = current_metrics.set(metrics)
+        profiler = profile_utils.start_profiler()
+        try:
+            result = function(*args, **kwargs)
+            if result is not None and metrics.output_folder is None:
+                metrics.output_folder = Path(result)
+            return result
+        except Exception as e:
+            metrics.increment(f"failed:{type(e).__name__}")
+            raise
+        finally:
+            current_metrics.reset(token)
+            metrics.finished = time.time()
+            output_folder = metrics.output_folder if metrics.output_folder and metrics.output_folder.exists() else None
+            profile_utils.stop_profiler(profiler, output_folder, metrics.name)
+            if output_folder:
+                print(f"Metrics written to {metrics.write(output_folder)}")
+            if PROMETHEUS_DIR:
+                metrics.write_prometheus(PROMETHEUS_DIR)
+    return wrapper
@@ -3,12 +3,183 @@ from dotenv import load_dotenv
 from textwrap import dedent
 import os
 import json
+import base64
+import re
+import tempfile
+import threading
+import contextvars
+import wave
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 import requests
+from requests.adapters import HTTPAdapter
 from pathlib import Path
+from cache_utils import DiskCache, CompletionCache, make_key
+import metrics_utils
+from rate_limit_utils import RateLimiter
+from retry_utils import classify_error, retry, CONTENT_POLICY
+import ffmpeg_utils
+try:
+    import tiktoken
+except ImportError:  # token counts fall back to an estimate
+    tiktoken = None
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+
+# Starting limits per endpoint, per model. They follow the x-ratelimit-* headers once responses come in,
+# so these only need to be in the right range for the account tier. Override with the environment variables.
+RATE_LIMITS = {
+    "chat": {
+        "requests_per_minute": float(os.getenv("CHAT_RPM", "500")),
+        "tokens_per_minute": float(os.getenv("CHAT_TPM", "150000")),
+        "max_concurrency": int(os.getenv("CHAT_CONCURRENCY", "16")),
+    },
+    "tts": {
+        "requests_per_minute": float(os.getenv("TTS_RPM", "50")),
+        "max_concurrency": int(os.getenv("TTS_CONCURRENCY", "8")),
+    },
+    "images": {
+        "requests_per_minute": float(os.getenv("IMAGE_RPM", "7")),
+        "max_concurrency": int(os.getenv("IMAGE_CONCURRENCY", "8")),
+    },
+}
+
+# Completion tokens reserved against the tokens/min limit on top of the prompt, since we don't set max_tokens.
+COMPLETION_TOKEN_ESTIMATE = 1000
+
+_client = None
+_rate_limiters = {}
+_client_lock = threading.Lock()
+
+
+def get_openai_client():
+    """
+    Return the OpenAI client shared by every module.
+
+    The SDK's own retries are turned off, since they would bypass the rate limiters. 429s and transient
+    errors are retried by RateLimiter.call instead. Set OPENAI_BASE_URL to point it at another server.
+
+    :return: The shared OpenAI client.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+        return _client
+
+
+def get_rate_limiter(endpoint, model):
+    """
+    Return the rate limiter shared by every call to an endpoint with a model.
+
+    OpenAI limits each model separately, so each (endpoint, model) pair gets its own limiter,
+    starting from the endpoint's RATE_LIMITS.
+
+    :param endpoint: "chat", "tts" or "images".
+    :param model: The model name.
+    :return: The RateLimiter.
+    """
+    with _client_lock:
+        if (endpoint, model) not in _rate_limiters:
+            _rate_limiters[endpoint, model] = RateLimiter(f"{endpoint}/{model}", **RATE_LIMITS[endpoint])
+        return _rate_limiters[endpoint, model]
+
+TTS_MODEL = "tts-1"
+
+# The speech endpoint accepts at most 4096 characters. Longer voiceovers are split on sentence boundaries into
+# chunks of about TTS_CHUNK_CHARS, synthesised concurrently and joined without re-encoding, since speech latency
+# grows with the length of the input. Set TTS_CHUNK_CHARS=4096 to only split what doesn't fit in one request.
+TTS_MAX_INPUT_CHARS = 4096
+TTS_CHUNK_CHARS = min(int(os.getenv("TTS_CHUNK_CHARS", "1000")), TTS_MAX_INPUT_CHARS)
+tts_chunk_executor = ThreadPoolExecutor(max_workers=int(os.getenv("TTS_CHUNK_WORKERS", "8")))
+
+# Audio format of the voice clips, and the file extension each format is saved with.
+# mp3, aac and opus clips are copied into the video as they are, see ffmpeg_utils.can_copy_audio; flac and wav are
+# decoded and re-encoded. "pcm" is raw 24kHz 16-bit mono, saved with a WAV header so it can be read like a file.
+TTS_RESPONSE_FORMAT = os.getenv("TTS_RESPONSE_FORMAT", "mp3")
+TTS_FORMAT_EXTENSIONS = {"mp3": ".mp3", "aac": ".aac", "opus": ".opus", "flac": ".flac", "wav": ".wav", "pcm": ".wav"}
+TTS_PCM_SAMPLE_RATE = 24000
+
+# Voice clips keyed by (model, voice, input, format), one cache per format so entries keep their extension.
+# Each format's cache is capped at TTS_CACHE_MAX_BYTES. Set TTS_CACHE_MAX_BYTES=0 to disable.
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(2 * 1024**3)))
+_tts_caches = {}
+
+# Chat completions cache mode: passthrough (default), record or replay.
+completion_cache = CompletionCache(os.getenv("COMPLETION_CACHE_MODE", "passthrough"))
+
+IMAGE_MODEL = "dall-e-3"
+
+# "b64_json" returns the image inline with the API response, saving a second request per image.
+# "url" downloads it from the returned URL through http_session instead.
+IMAGE_RESPONSE_FORMAT = os.getenv("IMAGE_RESPONSE_FORMAT", "b64_json")
+
+# Shared HTTP session so image downloads reuse pooled connections instead of a new TLS handshake each time.
+DOWNLOAD_TIMEOUT = (10, 120)  # (connect, read) seconds
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+http_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+# Images keyed by (model, prompt, size, quality, style). Set IMAGE_CACHE_MAX_BYTES=0 to disable.
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(5 * 1024**3)))
+image_cache = DiskCache("images", IMAGE_CACHE_MAX_BYTES, ".png") if IMAGE_CACHE_MAX_BYTES > 0 else None
+
+
+def count_tokens(text, model="gpt-4"):
+    """
+    Count the tokens in a piece of text.
+
+    Uses tiktoken when it is installed, otherwise estimates about four characters per token.
+
+    :param text: The text to count. Non-string values are counted as their JSON encoding.
+    :param model: The model whose tokenizer to use.
+    :return: The number of tokens.
+    """
+    if not isinstance(text, str):
+        text = json.dumps(text, ensure_ascii=False)
+    if tiktoken is None:
+        return len(text) // 4 + 1
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return len(encoding.encode(text))
+
+def chat_completion(model, messages, response_format=None, temperature=None):
+    """
+    Create a chat completion and return the content of the first choice.
+
+    Every chat call in the pipeline goes through here so it can be served by completion_cache.
+
+    :param model: The chat model to use.
+    :param messages: The list of chat messages.
+    :param response_format: Optional response format, e.g. {"type": "json_object"}.
+    :param temperature: Optional sampling temperature.
+    :return: The message content as a string.
+    """
+    extra_args = {}
+    if response_format is not None:
+        extra_args["response_format"] = response_format
+    if temperature is not None:
+        extra_args["temperature"] = temperature
+
+    def create():
+        tokens = count_tokens(messages, model) + COMPLETION_TOKEN_ESTIMATE
+        raw_response = get_rate_limiter("chat", model).call(
+            lambda: get_openai_client().chat.completions.with_raw_response.create(
+                model=model,
+                messages=messages,
+                **extra_args
+            ),
+            tokens,
+        )
+        response = raw_response.parse()
+        if response.usage:
+            metrics_utils.record_tokens(f"chat/{model}", response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response.choices[0].message.content
+
+    return completion_cache.get_or_create(create, model, messages, response_format, temperature)
 
 
 def structure_video_script(script):
@@ -22,7 +193,7 @@ def structure_video_script(script):
     - Avoid images of 'The Host', 'The YouTuber', 'The Narrator', or 'The AI'.
     Remember, you are part of a "Text to Video" pipeline.
     Your output will be fed into a text-to-speech generator and a text-to-image generator."""
-    response = openai_client.chat.completions.create(
+    revised_script = chat_completion(
         model="gpt-4-0125-preview",
         response_format={"type": "json_object"},
         messages=[
@@ -36,48 +207,257 @@ def structure_video_script(script):
             },
         ],
     )
-    revised_script = response.choices[0].message.content
     revised_script = json.loads(revised_script)
     return revised_script
 
-def generate_voice_clip(input, voice, output_folder, filename):
-    speech_file_path = output_folder / filename
-    with openai_client.audio.speech.with_streaming_response.create(
-        model="tts-1",
-        voice=voice,
-        input=input
-    ) as response:
-        response.stream_to_file(speech_file_path)
+def split_text(text, max_chars=TTS_CHUNK_CHARS):
+    """
+    Split text into chunks of at most max_chars, breaking between sentences where possible.
+
+    Sentences longer than max_chars are broken between words.
+
+    :param text: The text to split.
+    :param max_chars: Maximum length of a chunk.
+    :return: List of chunks, in order.
+    """
+    pieces = []
+    for sentence in re.split(r"(?<=[.!?…])\s+", text.strip()):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars + 1)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            pieces.append(sentence)
+    chunks = []
+    for piece in pieces:
+        if chunks and len(chunks[-1]) + 1 + len(piece) <= max_chars:
+            chunks[-1] = f"{chunks[-1]} {piece}"
+        else:
+            chunks.append(piece)
+    return chunks
+
+def get_tts_cache(response_format):
+    """
+    Return the voice clip cache for a response format, or None when the cache is disabled.
+    mp3 clips stay in the "tts" cache they were kept in before the format could be chosen.
+    """
+    if TTS_CACHE_MAX_BYTES <= 0:
+        return None
+    with _client_lock:
+        if response_format not in _tts_caches:
+            name = "tts" if response_format == "mp3" else f"tts-{response_format}"
+            _tts_caches[response_format] = DiskCache(name, TTS_CACHE_MAX_BYTES, TTS_FORMAT_EXTENSIONS[response_format])
+        return _tts_caches[response_format]
+
+def voice_clip_filename(name, response_format=None):
+    """
+    File name for a voice clip in a response format, e.g. "003" -> "003.mp3".
+    """
+    return f"{name}{TTS_FORMAT_EXTENSIONS[response_format or TTS_RESPONSE_FORMAT]}"
+
+def write_wav_header(path):
+    """
+    Wrap a raw 24kHz 16-bit mono PCM speech response in a WAV header, in place.
+    """
+    pcm = Path(path).read_bytes()
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(TTS_PCM_SAMPLE_RATE)
+        f.writeframes(pcm)
+
+def synthesize_speech(input, voice, speech_file_path, response_format=None):
+    """
+    Make one speech request and stream the audio to a file.
+    """
+    response_format = response_format or TTS_RESPONSE_FORMAT
+
+    def request():
+        with get_openai_client().audio.speech.with_streaming_response.create(
+            model=TTS_MODEL,
+            voice=voice,
+            input=input,
+            response_format=response_format
+        ) as response:
+            response.stream_to_file(speech_file_path)
+        return response
 
-def generate_image(prompt, size, output_folder, filename, max_retries=3):
+    get_rate_limiter("tts", TTS_MODEL).call(request)
+    metrics_utils.record_bytes(f"tts/{TTS_MODEL}", Path(speech_file_path).stat().st_size)
+    if response_format == "pcm":
+        write_wav_header(speech_file_path)
+    return speech_file_path
+
+def generate_voice_clip(input, voice, output_folder, filename, response_format=None):
+    """
+    Generate the voice clip of a piece of text, from the cache when it was generated before.
+
+    :param input: The text to speak. Text longer than TTS_CHUNK_CHARS is synthesised in concurrent chunks.
+    :param voice: The TTS voice.
+    :param output_folder: The folder to write the clip to.
+    :param filename: The clip's file name, see voice_clip_filename.
+    :param response_format: "mp3", "aac", "opus", "flac", "wav" or "pcm". Defaults to TTS_RESPONSE_FORMAT.
+    :return: Path of the clip.
+    """
+    response_format = response_format or TTS_RESPONSE_FORMAT
+    speech_file_path = Path(output_folder) / filename
+    # mp3 keeps the key of clips cached before the format could be chosen
+    cache_key = make_key(TTS_MODEL, voice, input) if response_format == "mp3" \
+        else make_key(TTS_MODEL, voice, input, response_format)
+    tts_cache = get_tts_cache(response_format)
+    if tts_cache and tts_cache.get(cache_key, speech_file_path):
+        metrics_utils.increment("tts_cache_hits")
+        return speech_file_path
+
+    chunks = split_text(input)
+    if len(chunks) <= 1:
+        synthesize_speech(input, voice, speech_file_path, response_format)
+    else:
+        # The chunks go to a hidden subfolder, so a partial clip is never picked up as one of the folder's clips
+        with tempfile.TemporaryDirectory(prefix=".tts-", dir=output_folder) as chunk_dir:
+            chunk_files = [Path(chunk_dir) / voice_clip_filename(f"{n:03}", response_format)
+                           for n in range(len(chunks))]
+            futures = [
+                tts_chunk_executor.submit(contextvars.copy_context().run, synthesize_speech, chunk, voice, chunk_file,
+                                          response_format)
+                for chunk, chunk_file in zip(chunks, chunk_files)
+            ]
+            # Let every chunk finish before the directory is removed, even when one fails, so no request
+            # still in flight is wasted writing into a deleted folder. Chunks that haven't started are cancelled.
+            _, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in not_done:
+                future.cancel()
+            wait(not_done)
+            for future in futures:
+                if not future.cancelled() and future.exception() is not None:
+                    raise future.exception()
+            joined_file = Path(chunk_dir) / voice_clip_filename("joined", response_format)
+            # FLAC frames are numbered from the start of the stream, so FLAC chunks can't be joined by stream copy.
+            # They are re-encoded instead, which is lossless.
+            ffmpeg_utils.concat_files(chunk_files, joined_file, ["-c:a", "flac"] if response_format == "flac" else ())
+            os.replace(joined_file, speech_file_path)
+        metrics_utils.increment("tts_chunked_clips")
+        metrics_utils.increment("tts_chunks", len(chunks))
+    if tts_cache:
+        # The clip is saved and paid for, so failing to cache it must not fail the clip
+        try:
+            tts_cache.put(cache_key, speech_file_path)
+        except OSError as e:
+            print(f"Failed to cache voice clip {speech_file_path}: {e}")
+    return speech_file_path
+
+def download_file(url, destination, timeout=DOWNLOAD_TIMEOUT, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    Stream a URL to a file in chunks through the pooled http_session.
+
+    The download is written to a temporary file and moved into place once complete,
+    so a failed download never leaves a truncated file behind.
+
+    :param url: The URL to download.
+    :param destination: The file path to write to.
+    :param timeout: (connect, read) timeout in seconds.
+    :param chunk_size: Size of the chunks written to disk.
+    :return: The number of bytes written.
+    """
+    destination = Path(destination)
+    tmp_path = destination.with_name(f"{destination.name}.part")
+    written = 0
+    try:
+        with http_session.get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    written += len(chunk)
+        os.replace(tmp_path, destination)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return written
+
+def save_image_data(image_data, destination):
+    """
+    Write an image returned by the images API to disk.
+
+    :param image_data: One item of the images API response data, holding either b64_json or url.
+    :param destination: The file path to write to.
+    :return: The number of bytes written.
+    """
+    if getattr(image_data, "b64_json", None):
+        image_bytes = base64.b64decode(image_data.b64_json)
+        with open(destination, "wb") as f:
+            f.write(image_bytes)
+        return len(image_bytes)
+    return download_file(image_data.url, destination)
+
+def generate_image(prompt, size, output_folder, filename, max_retries=3, style=None, quality="standard"):
+    image_path = Path(output_folder) / filename
+    # The cache is keyed on the prompt we were asked for, so a prompt that needed adjusting
+    # still hits on the next run without repeating the rewrite.
+    original_prompt = prompt
+    cache_key = make_key(IMAGE_MODEL, original_prompt, size, quality, style)
+    if image_cache and image_cache.get(cache_key, image_path):
+        metrics_utils.increment("image_cache_hits")
+        return image_path
     retries = 0
+    extra_args = {"style": style} if style else {}
     while retries < max_retries:
         try:
-            response = openai_client.images.generate(
-                model="dall-e-3",
-                prompt=prompt,
-                size=size,
-                quality="standard",
-                n=1
+            raw_response = get_rate_limiter("images", IMAGE_MODEL).call(
+                lambda: get_openai_client().images.with_raw_response.generate(
+                    model=IMAGE_MODEL,
+                    prompt=prompt,
+                    size=size,
+                    quality=quality,
+                    n=1,
+                    response_format=IMAGE_RESPONSE_FORMAT,
+                    **extra_args
+                )
             )
-            image_url = response.data[0].url
-            image = requests.get(image_url)
+            response = raw_response.parse()
 
             # save the image
-            with open(output_folder / filename, "wb") as f:
-                f.write(image.content)
-            return  # Exit the function if the image is successfully generated
-        except:
+            image_bytes = retry(lambda: save_image_data(response.data[0], image_path))
+            break  # Exit the loop if the image is successfully generated
+        except Exception as e:
+            # Rate limits and network or server errors were already retried as they are.
+            # Only a content policy rejection is worth rewriting the prompt for.
+            if classify_error(e) != CONTENT_POLICY:
+                print(f"Failed to generate image: {e}. Skipping image generation.")
+                metrics_utils.increment("images_failed")
+                return
             retries += 1
+            metrics_utils.increment("image_prompt_rewrites")
             if retries < max_retries:
+                print(f"Image prompt rejected by the content policy, adjusting it (attempt {retries})")
                 new_prompt = adjust_prompt(prompt)
                 prompt = new_prompt
             else:
                 print(f"Failed to generate image after {max_retries} retries. Skipping image generation.")
+                metrics_utils.increment("images_failed")
                 return  # Exit the function if the maximum number of retries is reached
+    else:
+        return  # max_retries was 0
+
+    metrics_utils.record_bytes(f"images/{IMAGE_MODEL}", image_bytes)
+    if image_cache:
+        # The image is saved and paid for, so failing to cache it must not fail the image
+        try:
+            image_cache.put(cache_key, image_path, metadata={
+                "model": IMAGE_MODEL,
+                "original_prompt": original_prompt,
+                "adjusted_prompt": prompt if prompt != original_prompt else None,
+                "revised_prompt": response.data[0].revised_prompt,
+                "size": size,
+                "quality": quality,
+                "style": style,
+            })
+        except OSError as e:
+            print(f"Failed to cache image {image_path}: {e}")
+    return image_path
 
 def adjust_prompt(prompt):
-    response = openai_client.chat.completions.create(
+    new_prompt = chat_completion(
         model="gpt-4-turbo-preview",
         messages=[
             {
@@ -90,6 +470,5 @@ def adjust_prompt(prompt):
             },
         ],
     )
-    new_prompt = response.choices[0].message.content
     return new_prompt
     
\ No newline at end of file
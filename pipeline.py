@@ -0,0 +1,153 @@
+import contextvars
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import ffmpeg_utils
+import metrics_utils
+from asset_utils import DEFAULT_MAX_WORKERS
+from openai_utils import generate_voice_clip, generate_image, voice_clip_filename, TTS_RESPONSE_FORMAT
+
+# Sentinel telling a stage's workers that no more items are coming.
+_DONE = object()
+
+
+def run_pipeline(sections, output_folder, output_file, voice="alloy", image_size="1024x1024", image_style=None,
+                 asset_workers=None, encode_workers=None, queue_size=None, fps=24, preset=ffmpeg_utils.DEFAULT_PRESET,
+                 tune=ffmpeg_utils.DEFAULT_TUNE, crf=None, manifest=None, audio_format=None):
+    """
+    Stream sections through script -> TTS/image -> segment encode, then stitch the segments.
+
+    Each section moves to the next stage as soon as its inputs exist, with bounded queues between the stages,
+    so writing the script, generating assets and encoding all overlap. The final step only joins the
+    already-encoded segments with a stream copy.
+
+    :param sections: Iterable of section dicts with 'voiceover' and 'image_description' keys. A generator that
+                     yields sections as they are written keeps the script stage overlapped with the rest.
+    :param output_folder: Run folder for the {i:03}.mp3 / {i:03}.png assets and the segments subfolder.
+    :param output_file: Path for the final video.
+    :param voice: The default voice. A section may override it with 'voice'.
+    :param image_size: DALL-E image size. Also used as the video canvas, since it is known before any image exists.
+    :param image_style: Optional DALL-E style.
+    :param asset_workers: Concurrent TTS/image requests. Defaults to asset_utils.DEFAULT_MAX_WORKERS.
+    :param encode_workers: Concurrent segment encoders. Defaults to the number of CPUs.
+    :param queue_size: Bound of each queue between stages. Defaults to twice the number of workers of the next stage.
+    :param manifest: Optional RunManifest. Recorded assets are reused and new ones are recorded.
+    :param audio_format: TTS response format of the voice clips. Defaults to openai_utils.TTS_RESPONSE_FORMAT.
+                         Clips in a format MP4 can hold are copied into the segments instead of re-encoded.
+    :return: Dict mapping section index to an error message for sections left out of the video.
+    :raises RuntimeError: If no section produced a segment.
+    """
+    output_folder = Path(output_folder)
+    segment_dir = output_folder / "segments"
+    segment_dir.mkdir(parents=True, exist_ok=True)
+    asset_workers = asset_workers or DEFAULT_MAX_WORKERS
+    encode_workers = encode_workers or os.cpu_count() or 1
+    threads = max(1, (os.cpu_count() or 1) // encode_workers)
+    width, height = (int(n) for n in image_size.split("x"))
+    size = (width + width % 2, height + height % 2)
+    audio_format = audio_format or TTS_RESPONSE_FORMAT
+    # Every clip comes from the same TTS model and format, so they all share one codec and sample rate
+    copy_audio = audio_format in ffmpeg_utils.MP4_AUDIO_CODECS
+
+    asset_queue = queue.Queue(maxsize=queue_size or 2 * asset_workers)
+    encode_queue = queue.Queue(maxsize=queue_size or 2 * encode_workers)
+    segment_files = {}
+    key_locks = {}
+    failures = {}
+    lock = threading.Lock()
+
+    def make_asset(filename, generate, *args, **kwargs):
+        if manifest and manifest.has_asset(filename):
+            return output_folder / filename
+        path = generate(*args, **kwargs)
+        if path is None:
+            raise RuntimeError(f"no file was produced for {filename}")
+        if manifest:
+            manifest.record_asset(path)
+        return path
+
+    def asset_worker():
+        while (item := asset_queue.get()) is not _DONE:
+            i, section = item
+            try:
+                # The image is generated on its own thread while this one makes the voice clip,
+                # so a section takes as long as the slower of the two rather than both
+                image_future = image_executor.submit(
+                    contextvars.copy_context().run, make_asset, f"{i:03}.png", generate_image,
+                    section["image_description"], image_size, output_folder, f"{i:03}.png", style=image_style,
+                )
+                audio_filename = voice_clip_filename(f"{i:03}", audio_format)
+                try:
+                    audio_file = make_asset(audio_filename, generate_voice_clip, section["voiceover"],
+                                            section.get("voice", voice), output_folder, audio_filename, audio_format)
+                finally:
+                    # Wait for the image even if the clip failed, so it is still recorded for a resume
+                    image_file = image_future.result()
+                encode_queue.put((i, image_file, audio_file))
+            except Exception as e:
+                print(f"Section {i} asset generation failed: {e}")
+                with lock:
+                    failures[i] = str(e)
+
+    def encode_worker():
+        while (item := encode_queue.get()) is not _DONE:
+            i, image_file, audio_file = item
+            try:
+                key = ffmpeg_utils.segment_key(image_file, audio_file, size, fps, preset, tune, crf, copy_audio)
+                segment_file = segment_dir / f"{key}.mp4"
+                # Identical sections share a segment file, so never encode the same key twice at once
+                with lock:
+                    key_lock = key_locks.setdefault(key, threading.Lock())
+                with key_lock:
+                    if not segment_file.exists():
+                        ffmpeg_utils.encode_segment(image_file, audio_file, segment_file, size, fps, preset, tune,
+                                                    crf, threads, copy_audio)
+                print(f"Encoded segment {i}")
+                with lock:
+                    segment_files[i] = segment_file
+            except Exception as e:
+                print(f"Section {i} segment encode failed: {e}")
+                with lock:
+                    failures[i] = str(e)
+
+    image_executor = ThreadPoolExecutor(max_workers=asset_workers)
+    # Each thread runs in a copy of the caller's context, so its API calls count towards the caller's run metrics
+    asset_threads = [threading.Thread(target=contextvars.copy_context().run, args=(asset_worker,), daemon=True)
+                     for _ in range(asset_workers)]
+    encode_threads = [threading.Thread(target=contextvars.copy_context().run, args=(encode_worker,), daemon=True)
+                      for _ in range(encode_workers)]
+    for thread in asset_threads + encode_threads:
+        thread.start()
+
+    try:
+        for i, section in enumerate(sections):
+            if not isinstance(section, dict) or not section.get("voiceover") or not section.get("image_description"):
+                print(f"Warning: section {i} is missing a voiceover or image description! Skipping...")
+                with lock:
+                    failures[i] = "missing voiceover or image_description"
+                continue
+            asset_queue.put((i, section))
+    finally:
+        # Drain the stages in order, even if writing the script failed part way through
+        for _ in asset_threads:
+            asset_queue.put(_DONE)
+        for thread in asset_threads:
+            thread.join()
+        image_executor.shutdown()
+        for _ in encode_threads:
+            encode_queue.put(_DONE)
+        for thread in encode_threads:
+            thread.join()
+
+    if failures:
+        print(f"{len(failures)} sections were left out of the video: {sorted(failures)}")
+    if not segment_files:
+        raise RuntimeError(f"No segments were produced for {output_file}, every section failed: {failures}")
+    # Drop segments from earlier versions of the inputs
+    for stale_file in set(segment_dir.glob("*.mp4")) - set(segment_files.values()):
+        stale_file.unlink(missing_ok=True)
+    with metrics_utils.stage("concat"):
+        ffmpeg_utils.concat_segments([segment_files[i] for i in sorted(segment_files)], output_file)
+    return failures
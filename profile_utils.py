@@ -0,0 +1,228 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+# Sampling profiler for whole runs. Nothing runs unless it is enabled, with --profile or CONTENT_MILL_PROFILE=1,
+# so it costs nothing by default. When enabled, a background thread samples the stack of every thread.
+
+# Named after the profiled entry point, so a re-render with vidgen.py doesn't replace the profile of the run
+# that generated the folder.
+PROFILE_FOLDED_FILENAME = "profile-{name}.folded"
+PROFILE_SUMMARY_FILENAME = "profile-{name}.txt"
+
+# Seconds between samples. 100 Hz keeps the sampling overhead to a few percent.
+DEFAULT_INTERVAL = float(os.getenv("CONTENT_MILL_PROFILE_INTERVAL", "0.01"))
+
+REPO_DIR = str(Path(__file__).resolve().parent)
+
+# Leaf frames that mean the thread is blocked rather than running Python code. A thread blocked in a C call
+# still has its caller as the leaf frame. Any leaf frame in subprocess.py is taken as a wait on a child process.
+WAIT_FUNCTIONS = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+    ("selectors.py", "select"), ("socket.py", "readinto"), ("ssl.py", "read"), ("ssl.py", "recv_into"),
+    ("subprocess.py", "_try_wait"), ("subprocess.py", "_communicate"), ("subprocess.py", "communicate"),
+    ("subprocess.py", "wait"),
+}
+# Leaf frames of idle threads, such as pool workers waiting for work, which are left out.
+IDLE_FUNCTIONS = {("thread.py", "_worker")}
+WAIT_FRAME = "[waiting]"
+CHILD_FRAME = "[child process]"
+
+_enabled = os.getenv("CONTENT_MILL_PROFILE", "") not in ("", "0")
+_interval = DEFAULT_INTERVAL
+_active = None
+_active_lock = threading.Lock()
+
+
+def enable(interval=None):
+    """
+    Profile every run started from now on. Entry points call this for --profile.
+    """
+    global _enabled, _interval
+    _enabled = True
+    _interval = interval or DEFAULT_INTERVAL
+
+
+def add_profile_argument(parser):
+    parser.add_argument("--profile", action="store_true",
+                        help=f"Write a sampled profile of the run to {PROFILE_FOLDED_FILENAME} (flame graph input) "
+                             f"and {PROFILE_SUMMARY_FILENAME} (hottest functions) in the output folder, "
+                             f"where name is the entry point.")
+
+
+def _frame_name(code) -> str:
+    # co_qualname, with the class name, is only there from Python 3.11
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _child_cpu_seconds():
+    """
+    CPU time used by finished child processes, or None where the resource module is missing, e.g. on Windows.
+    It is only imported here, so importing this module works everywhere.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return children.ru_utime + children.ru_stime
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = DEFAULT_INTERVAL):
+        """
+        Samples the Python stack of every thread at a fixed interval and counts the collapsed stacks.
+
+        Stacks blocked on a child process, such as ffmpeg, end in a [child process] frame, and other blocked
+        stacks end in [waiting], so the flame graph shows where the wall time went. Idle threads outside this
+        repo's code, such as parked pool workers, are left out.
+
+        Args:
+            interval (float): Seconds between samples.
+        """
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.started = None
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.child_cpu_seconds = None
+
+    def _sample(self) -> None:
+        own_id = threading.get_ident()
+        names = {thread.ident: re.sub(r"_\d+$", "", thread.name) for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            frames = []
+            in_repo = in_subprocess = False
+            leaf = frame
+            while frame is not None:
+                code = frame.f_code
+                frames.append(_frame_name(code))
+                in_repo = in_repo or code.co_filename.startswith(REPO_DIR)
+                in_subprocess = in_subprocess or os.path.basename(code.co_filename) == "subprocess.py"
+                frame = frame.f_back
+            leaf_function = (os.path.basename(leaf.f_code.co_filename), leaf.f_code.co_name)
+            if leaf_function in IDLE_FUNCTIONS:
+                continue
+            in_child = leaf_function[0] == "subprocess.py"
+            waiting = in_child or leaf_function in WAIT_FUNCTIONS
+            if waiting and not in_repo:
+                continue
+            frames.reverse()
+            if waiting:
+                frames.append(CHILD_FRAME if in_child or in_subprocess else WAIT_FRAME)
+            self.stacks[";".join([names.get(thread_id, "thread"), *frames])] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        self.child_cpu_started = _child_cpu_seconds()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.thread.join()
+        self.wall_seconds = time.perf_counter() - self.started
+        self.cpu_seconds = time.process_time() - self.cpu_started
+        child_cpu_seconds = _child_cpu_seconds()
+        if child_cpu_seconds is not None:
+            self.child_cpu_seconds = child_cpu_seconds - self.child_cpu_started
+
+    def folded(self) -> str:
+        """
+        The samples as collapsed stacks, one "frame;frame;frame count" line per stack, for flamegraph.pl,
+        speedscope or inferno.
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = 30) -> str:
+        """
+        The hottest functions by samples on top of the stack (self) and anywhere in it (total).
+        """
+        self_counts = Counter()
+        total_counts = Counter()
+        waiting = child = 0
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if frames[-1] == CHILD_FRAME:
+                child += count
+            elif frames[-1] == WAIT_FRAME:
+                waiting += count
+            else:
+                self_counts[frames[-1]] += count
+            for frame in set(frames):
+                total_counts[frame] += count
+        stack_samples = sum(self.stacks.values()) or 1
+        child_cpu = f"{self.child_cpu_seconds:.2f}s" if self.child_cpu_seconds is not None else "unavailable"
+        lines = [
+            f"Wall time: {self.wall_seconds:.2f}s, Python CPU time: {self.cpu_seconds:.2f}s, "
+            f"child process CPU time: {child_cpu}",
+            f"{self.samples} samples every {self.interval * 1000:g}ms, {stack_samples} thread stacks: "
+            f"{sum(self_counts.values())} running, {child} waiting on a child process, {waiting} waiting",
+            "",
+            f"Top {top} functions by self samples:",
+            f"{'self':>8} {'self%':>6} {'total':>8} {'total%':>6}  function",
+        ]
+        for frame, count in self_counts.most_common(top):
+            lines.append(f"{count:>8} {count / stack_samples:>6.1%} {total_counts[frame]:>8} "
+                         f"{total_counts[frame] / stack_samples:>6.1%}  {frame}")
+        lines += ["", f"Top {top} functions by total samples:", f"{'total':>8} {'total%':>6}  function"]
+        for frame, count in total_counts.most_common(top):
+            if frame not in (WAIT_FRAME, CHILD_FRAME):
+                lines.append(f"{count:>8} {count / stack_samples:>6.1%}  {frame}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, folder, name="run") -> None:
+        folded_path = Path(folder) / PROFILE_FOLDED_FILENAME.format(name=name)
+        summary_path = Path(folder) / PROFILE_SUMMARY_FILENAME.format(name=name)
+        folded_path.write_text(self.folded())
+        summary_path.write_text(self.summary())
+        print(f"Profile written to {folded_path} and {summary_path}")
+
+
+def start_profiler():
+    """
+    Start profiling a run if profiling is enabled and no other run is being profiled.
+
+    Runs in one process share the sampled threads, so concurrent runs only get one profile.
+
+    :return: The running SamplingProfiler, or None.
+    """
+    global _active
+    if not _enabled:
+        return None
+    with _active_lock:
+        if _active is not None:
+            return None
+        _active = SamplingProfiler(_interval)
+    _active.start()
+    return _active
+
+
+def stop_profiler(profiler, folder=None, name="run"):
+    """
+    Stop a profiler from start_profiler and write its output to folder, named after the entry point name.
+    """
+    global _active
+    if profiler is None:
+        return
+    profiler.stop()
+    with _active_lock:
+        _active = None
+    if folder is not None:
+        profiler.write(folder, name)
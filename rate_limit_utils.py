@@ -0,0 +1,238 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+import metrics_utils
+from retry_utils import classify_error, backoff_delay, RATE_LIMIT, TRANSIENT
+
+# How long to wait after a 429 that carries no Retry-After or reset header.
+DEFAULT_RETRY_AFTER = 1.0
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value):
+    """
+    Parse a rate limit reset duration such as "20ms", "1s" or "6m0s" into seconds.
+
+    :param value: The header value. A plain number is taken as seconds.
+    :return: The duration in seconds, or None if it can't be parsed.
+    """
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def retry_after_seconds(headers):
+    """
+    Read how long the server asked us to wait from the headers of a response.
+
+    :param headers: Response headers.
+    :return: Seconds to wait, or None if the headers don't say.
+    """
+    if headers is None:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    retry_after = parse_duration(headers.get("retry-after"))
+    if retry_after is not None:
+        return retry_after
+    resets = [parse_duration(headers.get(name)) for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        """
+        Token bucket refilled continuously at per_minute / 60 per second, holding at most a minute's worth.
+
+        Callers reserve capacity up front and sleep off any debt outside the lock, so requests are spread
+        evenly over the minute instead of bursting at its start.
+
+        Args:
+            per_minute (float): The limit per minute.
+        """
+        self.lock = threading.Lock()
+        self.capacity = float(per_minute)
+        self.available = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def reserve(self, amount: float = 1) -> float:
+        """
+        Take amount from the bucket, going into debt if needed.
+
+        Returns:
+            float: Seconds the caller has to wait before the reservation is covered.
+        """
+        with self.lock:
+            self._refill()
+            self.available -= min(amount, self.capacity)
+            return max(0.0, -self.available * 60 / self.capacity)
+
+    def set_limit(self, per_minute: float) -> None:
+        with self.lock:
+            self._refill()
+            self.capacity = float(per_minute)
+            self.available = min(self.available, self.capacity)
+
+    def sync(self, remaining: float) -> None:
+        """
+        Never assume more capacity than the server reports is left.
+        """
+        with self.lock:
+            self._refill()
+            self.available = min(self.available, float(remaining))
+
+
+class RateLimiter:
+    def __init__(self, name: str, requests_per_minute: float, tokens_per_minute: float = None,
+                 max_concurrency: int = 16, max_attempts: int = 6):
+        """
+        Client-side limits for one endpoint and model, shared by every thread that calls it.
+
+        Requests pass a requests/min bucket, an optional tokens/min bucket and a concurrency limit.
+        The buckets follow the x-ratelimit-* headers of each response. A 429 pauses every caller until its
+        Retry-After has passed and halves the concurrency, which then grows back by one after each window of
+        successful requests, so throughput settles just under the account limit instead of retrying in a storm.
+
+        Args:
+            name (str): Name used in log messages.
+            requests_per_minute (float): Initial requests/min limit, until the server reports the real one.
+            tokens_per_minute (float): Initial tokens/min limit, or None for endpoints not limited by tokens.
+            max_concurrency (int): Upper bound of requests in flight at once.
+            max_attempts (int): Attempts per call before a 429 or transient error is raised to the caller.
+        """
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.in_flight = 0
+        self.successes = 0
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def slot(self, tokens: int = 0):
+        """
+        Wait for a concurrency slot and bucket capacity for one request, and hold the slot while it runs.
+
+        Args:
+            tokens (int): Estimated tokens used by the request.
+        """
+        with self.condition:
+            while self.in_flight >= self.concurrency:
+                self.condition.wait()
+            self.in_flight += 1
+        try:
+            wait = self.requests.reserve(1)
+            if self.tokens and tokens:
+                wait = max(wait, self.tokens.reserve(tokens))
+            wait = max(wait, self.paused_until - time.monotonic())
+            if wait > 0:
+                time.sleep(wait)
+            yield
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify()
+
+    def update(self, headers) -> None:
+        """
+        Adjust the buckets to the x-ratelimit-* headers of a response.
+        """
+        if headers is None:
+            return
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            if bucket is None:
+                continue
+            try:
+                if headers.get(f"x-ratelimit-limit-{kind}"):
+                    bucket.set_limit(float(headers[f"x-ratelimit-limit-{kind}"]))
+                if headers.get(f"x-ratelimit-remaining-{kind}"):
+                    bucket.sync(float(headers[f"x-ratelimit-remaining-{kind}"]))
+            except ValueError:
+                pass
+
+    def on_success(self, headers=None) -> None:
+        self.update(headers)
+        with self.condition:
+            self.successes += 1
+            if self.concurrency < self.max_concurrency and self.successes >= self.concurrency:
+                self.concurrency += 1
+                self.successes = 0
+                self.condition.notify()
+
+    def on_rate_limited(self, headers=None, attempt: int = 1) -> float:
+        """
+        Back off every caller after a 429.
+
+        Returns:
+            float: Seconds until requests resume.
+        """
+        self.update(headers)
+        retry_after = retry_after_seconds(headers)
+        if retry_after is None:
+            retry_after = DEFAULT_RETRY_AFTER * 2 ** (attempt - 1)
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            self.concurrency = max(1, self.concurrency // 2)
+            self.successes = 0
+        print(f"{self.name}: rate limited, pausing {retry_after:.1f}s at concurrency {self.concurrency}")
+        return retry_after
+
+    def call(self, request, tokens: int = 0):
+        """
+        Run a request within the limits, retrying it after a 429 or a transient error.
+
+        A 429 pauses every caller of this limiter, while a transient network or server error only backs off
+        this call, with jitter. Content policy and fatal errors are raised straight away.
+
+        Args:
+            request: Callable making one API request. It returns a raw response with headers,
+                     e.g. from with_raw_response or with_streaming_response.
+            tokens (int): Estimated tokens used by the request.
+
+        Returns:
+            The raw response returned by request.
+        """
+        attempt = 1
+        started = time.perf_counter()
+        while True:
+            try:
+                with self.slot(tokens):
+                    response = request()
+            except Exception as e:
+                kind = classify_error(e)
+                if kind not in (RATE_LIMIT, TRANSIENT) or attempt >= self.max_attempts:
+                    metrics_utils.record_call(self.name, time.perf_counter() - started, attempt, error=True)
+                    raise
+                if kind == RATE_LIMIT:
+                    self.on_rate_limited(e.response.headers, attempt)
+                else:
+                    delay = backoff_delay(attempt)
+                    print(f"{self.name}: attempt {attempt} failed ({e}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+                attempt += 1
+                continue
+            self.on_success(getattr(response, "headers", None))
+            metrics_utils.record_call(self.name, time.perf_counter() - started, attempt)
+            return response
@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+from PIL import Image
+import ffmpeg_utils
+from video_utils import RENDER_BACKENDS, create_video_from_clips
+
+# Benchmark of create_video_from_clips on synthetic run folders.
+# Each render runs in its own process, so its peak memory is measured on its own.
+
+REPO_DIR = Path(__file__).resolve().parent
+
+
+def parse_size(size):
+    width, height = (int(n) for n in size.split("x"))
+    return width, height
+
+
+def make_image(path, size, rng):
+    """
+    Write a textured image, closer to the encoding cost of a generated image than a flat colour.
+    """
+    width, height = size
+    coarse = rng.integers(0, 256, (max(2, height // 64), max(2, width // 64), 3), dtype=np.uint8)
+    image = Image.fromarray(coarse).resize((width, height), Image.BILINEAR)
+    noise = rng.integers(-12, 13, (height, width, 3))
+    Image.fromarray(np.clip(np.asarray(image, dtype=np.int16) + noise, 0, 255).astype(np.uint8)).save(path)
+
+
+def make_audio(path, duration, frequency):
+    ffmpeg_utils.run_ffmpeg([
+        "-f", "lavfi", "-i", f"sine=frequency={frequency}:sample_rate={ffmpeg_utils.AUDIO_SAMPLE_RATE}",
+        "-t", f"{duration:.3f}", "-ac", "2", "-c:a", ffmpeg_utils.AUDIO_CODEC, path,
+    ])
+
+
+def make_run_folder(folder, segments, size, audio_seconds, mismatched=False, seed=0):
+    """
+    Fill a folder with numbered images and voice clips like a real run.
+
+    :param folder: The folder to fill.
+    :param segments: Number of image and audio pairs.
+    :param size: (width, height) of the images.
+    :param audio_seconds: (min, max) duration of each clip in seconds.
+    :param mismatched: Cycle the images through square, landscape and portrait sizes, like DALL-E 3's
+                       1024x1024, 1792x1024 and 1024x1792.
+    :param seed: Seed for the image content and clip durations.
+    :return: Total duration of the audio in seconds.
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    durations = random.Random(seed)
+    width, height = size
+    sizes = [size, (width * 7 // 4, height), (width, height * 7 // 4)] if mismatched else [size]
+    total = 0.0
+    for i in range(segments):
+        duration = durations.uniform(*audio_seconds)
+        make_image(folder / f"{i:03}.png", sizes[i % len(sizes)], rng)
+        make_audio(folder / f"{i:03}.mp3", duration, 220 + 20 * i)
+        total += duration
+    return total
+
+
+def run_render(backend, folder, output_file, fps, workers=None):
+    """
+    Render a run folder with one backend in this process and measure it.
+    """
+    segment_dir = Path(folder) / "segments"
+    shutil.rmtree(segment_dir, ignore_errors=True)
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    create_video_from_clips(folder, str(output_file), fps=fps, backend=backend, workers=workers,
+                            segment_dir=segment_dir)
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    frames = round(ffmpeg_utils.probe_duration(output_file) * fps)
+    return {
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(cpu, 3),
+        "child_cpu_seconds": round(children.ru_utime + children.ru_stime, 3),
+        "frames": frames,
+        "frames_per_second": round(frames / wall, 2),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "peak_child_rss_bytes": children.ru_maxrss * 1024,
+        "output_bytes": Path(output_file).stat().st_size,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the video render backends on synthetic run folders.")
+    parser.add_argument("--backends", nargs="+", choices=RENDER_BACKENDS, default=list(RENDER_BACKENDS))
+    parser.add_argument("--segments", type=int, nargs="+", default=[10], help="Image and audio pairs per run.")
+    parser.add_argument("--resolutions", nargs="+", default=["1024x1024"], help="Image sizes, e.g. 512x512.")
+    parser.add_argument("--audio-seconds", default="3,6", help="Clip duration, or MIN,MAX for random durations.")
+    parser.add_argument("--mismatched", action="store_true", help="Mix square, landscape and portrait images.")
+    parser.add_argument("--fps", type=int, default=24)
+    parser.add_argument("--workers", type=int, help="Workers of the segments backend.")
+    parser.add_argument("--repeat", type=int, default=1, help="Renders per backend and run folder.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="render_benchmark_results.json", help="Where to write the JSON results.")
+    parser.add_argument("--work-dir", help="Where the run folders are created. Defaults to a temporary folder.")
+    parser.add_argument("--run-backend", choices=RENDER_BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("--folder", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_backend:
+        # Child process: render one folder and write its measurements
+        result = run_render(args.run_backend, args.folder, Path(args.folder) / f"{args.run_backend}.mp4", args.fps,
+                            args.workers)
+        Path(args.output).write_text(json.dumps(result))
+        return
+
+    audio_seconds = [float(n) for n in args.audio_seconds.split(",")]
+    audio_seconds = (audio_seconds[0], audio_seconds[-1])
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="render-benchmark-"))
+    results = []
+    try:
+        for size in args.resolutions:
+            for segments in args.segments:
+                folder = work_dir / f"{segments}x{size}{'-mismatched' if args.mismatched else ''}"
+                print(f"Generating {segments} segments at {size} in {folder}")
+                duration = make_run_folder(folder, segments, parse_size(size), audio_seconds, args.mismatched,
+                                           args.seed)
+                for backend in args.backends:
+                    for run in range(args.repeat):
+                        result_file = folder / f"{backend}-{run}.json"
+                        process = subprocess.run(
+                            [sys.executable, str(REPO_DIR / "render_benchmark.py"), "--run-backend", backend,
+                             "--folder", str(folder), "--fps", str(args.fps), "--output", str(result_file),
+                             *(["--workers", str(args.workers)] if args.workers else [])],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                        )
+                        case = {"backend": backend, "run": run, "segments": segments, "resolution": size,
+                                "mismatched": args.mismatched, "audio_seconds": round(duration, 3), "fps": args.fps}
+                        if process.returncode == 0:
+                            case.update(json.loads(result_file.read_text()))
+                            print(f"{backend}: {case['wall_seconds']:.2f}s wall, {case['frames_per_second']:.0f} fps, "
+                                  f"{case['peak_rss_bytes'] / 1024**2:.0f} MiB peak RSS")
+                        else:
+                            case["error"] = process.stdout[-2000:]
+                            print(f"{backend} failed:\n{process.stdout[-2000:]}")
+                        results.append(case)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    Path(args.output).write_text(json.dumps({
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }, indent=2))
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import random
+import time
+import openai
+import requests
+
+# Error classes, see classify_error.
+CONTENT_POLICY = "content_policy"
+RATE_LIMIT = "rate_limit"
+TRANSIENT = "transient"
+FATAL = "fatal"
+
+# Exponential backoff for transient errors: attempt n waits a random time up to min(cap, base * 2**(n-1)).
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+MAX_ATTEMPTS = 5
+
+# Status codes worth retrying as they are: timeouts, conflicts and server errors.
+TRANSIENT_STATUS_CODES = {408, 409, 500, 502, 503, 504}
+
+
+def classify_error(error):
+    """
+    Classify an exception from an OpenAI or HTTP request.
+
+    :param error: The exception.
+    :return: CONTENT_POLICY if the prompt was rejected and rewriting it may help, RATE_LIMIT for a 429 that
+             waiting will fix, TRANSIENT for network and server errors that may succeed as they are,
+             or FATAL for everything else, which retrying won't fix.
+    """
+    if isinstance(error, openai.RateLimitError):
+        # An exhausted quota won't recover by waiting
+        return FATAL if error.code == "insufficient_quota" else RATE_LIMIT
+    if isinstance(error, openai.BadRequestError):
+        if error.code == "content_policy_violation" or "safety system" in str(error):
+            return CONTENT_POLICY
+        return FATAL
+    if isinstance(error, openai.APIConnectionError):  # includes timeouts
+        return TRANSIENT
+    if isinstance(error, openai.APIStatusError):
+        return TRANSIENT if error.status_code in TRANSIENT_STATUS_CODES or error.status_code >= 500 else FATAL
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)):
+        return TRANSIENT
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status_code = error.response.status_code
+        if status_code == 429:
+            return RATE_LIMIT
+        return TRANSIENT if status_code in TRANSIENT_STATUS_CODES or status_code >= 500 else FATAL
+    return FATAL
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """
+    Full jitter backoff, so callers that failed together don't retry together.
+
+    :param attempt: The number of the attempt that failed, starting at 1.
+    :return: Seconds to wait before the next attempt.
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def retry(request, max_attempts=MAX_ATTEMPTS, retry_on=(TRANSIENT, RATE_LIMIT)):
+    """
+    Call request, retrying with jittered exponential backoff while it fails with a retryable error.
+
+    :param request: Callable making the request.
+    :param max_attempts: Attempts before the last error is raised.
+    :param retry_on: Error classes to retry.
+    :return: What request returns.
+    """
+    attempt = 1
+    while True:
+        try:
+            return request()
+        except Exception as e:
+            kind = classify_error(e)
+            if kind not in retry_on or attempt >= max_attempts:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"Attempt {attempt} failed ({kind}: {e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
@@ -1,5 +1,4 @@
 from typing import Any
-from openai import OpenAI
 from pathlib import Path
 import os
 import sys
@@ -10,25 +9,27 @@ import requests
 import uuid
 import pathlib
 from video_utils import create_video_from_clips
+from openai_utils import chat_completion, voice_clip_filename
+from asset_utils import AssetGenerator
+from conversation_memory import ConversationMemory
 from abc import ABC
 import inquirer
 import random
 from itertools import cycle
+from folder_utils import OutputFolder
+import metrics_utils
+import profile_utils
+import argparse
 
 # Roundtable discussion with AI generated images and TTS voiceover
 
 # Load environment variables
 dotenv.load_dotenv()
 
-# set up the openai client
-
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-
 
 # Define a generic function to get json from GPT-4
 def get_json_list_from_gpt4(prompt, temperature="1.0"):
-    response = openai_client.chat.completions.create(
+    response = chat_completion(
         model="gpt-4-turbo-preview",
         response_format={"type": "json_object"},
         messages=[
@@ -43,7 +44,7 @@ def get_json_list_from_gpt4(prompt, temperature="1.0"):
         ],
     )
 
-    response = json.loads(response.choices[0].message.content)
+    response = json.loads(response)
 
     return response
 
@@ -52,38 +53,26 @@ def get_json_list_from_gpt4(prompt, temperature="1.0"):
 
 
 class RoundtableParticipant:
-    def __init__(self, model, name, role, topic, temperature="1.0"):
+    def __init__(self, model, name, role, topic, temperature="1.0", memory=None):
         self.name = name
         self.model = model
         self.role = role
         self.topic = topic
         self.temperature = temperature
         self.participants=[]
+        self.memory = memory or ConversationMemory(keep_fields=("speaker", "content", "next_speaker"))
 
     def get_system_message(self):
         return f"You are {self.name}. You are participating in a roundtable discussion as a {self.role} on the topic of {self.topic}. Your response should be a json object with the keys 'speaker', 'content', 'next_speaker', and 'image_description'. The speaker should be your name. next_speaker should be the name of the person who should speak next. The content should be your response. The image_description should be a description of an image to accompany your statement. The image should be related to the topic of the roundtable discussion. Avoid using images of the roundtable discussion setting or the participants. Avoid using images of celebrities or public figures. Our text to image system uses a content filter, so avoid anything inappropriate. Avoid anything offensive. Avoid directly mentioning anything that is copyrighted in image_description. Do not use the names of any copyrighted works in image_description."
 
     def get_response(self, messages, instruction=""):
-        response = openai_client.chat.completions.create(
+        response = chat_completion(
             model=self.model,
             response_format={"type": "json_object"},
-            messages=[
-                {
-                    "role": "system",
-                    "content": self.get_system_message(),
-                },
-                {
-                    "role": "user",
-                    "content": json.dumps(messages, ensure_ascii=False),
-                },
-                {
-                    "role": "user",
-                    "content": instruction,
-                },
-            ],
+            messages=self.memory.build_messages(self.get_system_message(), messages, instruction, self.name),
         )
 
-        response = json.loads(response.choices[0].message.content)
+        response = json.loads(response)
         print(json.dumps(response, indent=4, ensure_ascii=False))
         return response
 
@@ -103,17 +92,64 @@ class Moderator(RoundtableParticipant):
 
 
 class RoundtableDiscussion:
-    def __init__(self):
-        self.topic = self.prompt_user_for_topic()
-        self.participants = self.prompt_user_for_participants()
+    def __init__(self, output_folder=None, topic=None, participants=None):
+        """
+        Set up a roundtable discussion.
+
+        Set on_message to a callback taking (index, message) to act on each turn as soon as it is appended.
+
+        :param output_folder: Optional OutputFolder of an interrupted run. When given, the topic, participants
+                              and transcript so far are restored from its manifest instead of prompting the user.
+        :param topic: The topic. The user is prompted for it if not given.
+        :param participants: List of dicts with the keys 'name', 'role', 'model' and optionally 'temperature'.
+                             The user is prompted to pick participants if not given.
+        """
+        self.roundtable_dir = Path("roundtable")
+        self.on_message = None
+        if output_folder is None:
+            self.topic = topic or self.prompt_user_for_topic()
+            if participants is None:
+                self.participants = self.prompt_user_for_participants()
+            else:
+                self.participants = [
+                    RoundtableParticipant(p["model"], p["name"], p["role"], self.topic, p.get("temperature", "1.0"))
+                    for p in participants
+                ]
+            self.messages = []
+            self.output_folder = OutputFolder(str(self.roundtable_dir), self.topic)
+            self.output_folder.manifest.complete_stage("setup", {
+                "topic": self.topic,
+                "participants": [
+                    {"model": p.model, "name": p.name, "role": p.role, "temperature": p.temperature}
+                    for p in self.participants
+                ],
+            })
+        else:
+            self.output_folder = output_folder
+            setup = output_folder.manifest.get_stage("setup")
+            self.topic = setup["topic"]
+            self.participants = [
+                RoundtableParticipant(p["model"], p["name"], p["role"], self.topic, p["temperature"])
+                for p in setup["participants"]
+            ]
+            self.messages = output_folder.manifest.get_stage("transcript", [])
         self.moderator = Moderator(
             topic=self.topic, participants=self.get_participants_list()
         )
-        self.messages = []
-        self.roundtable_dir = Path("roundtable")
-        self.roundtable_discussion_dir = self.roundtable_dir / f"{slugify.slugify(self.topic)}-{uuid.uuid4()}"
-        # Create the roundtable discussion directory if it doesn't exist
-        self.create_directory(self.roundtable_discussion_dir)
+        # One memory shared by everyone at the table, so older turns are only summarized once
+        self.memory = ConversationMemory(keep_fields=("speaker", "content", "next_speaker"))
+        for participant in self.participants + [self.moderator]:
+            participant.memory = self.memory
+        self.roundtable_discussion_dir = self.output_folder.path
+
+    def add_message(self, message):
+        """
+        Append a turn to the transcript and checkpoint it in the manifest.
+        """
+        self.messages.append(message)
+        self.output_folder.manifest.complete_stage("transcript", self.messages)
+        if self.on_message:
+            self.on_message(len(self.messages) - 1, message)
 
     def add_participant(self, participant):
         self.participants.append(participant)
@@ -182,14 +218,14 @@ class RoundtableDiscussion:
         if current_speaker == "Moderator":
             # Handle moderator-specific logic
             message = self.moderator.get_response(messages)
-            self.messages.append(message)
+            self.add_message(message)
             return message["next_speaker"]
 
         # Handle participant logic
         for participant in self.participants:
             if participant.name == current_speaker:
                 message = participant.get_response(messages)
-                self.messages.append(message)
+                self.add_message(message)
                 return message["next_speaker"]
 
         # Fallback in case of unexpected speaker name
@@ -232,6 +268,10 @@ class RoundtableDiscussion:
         next_speaker = "Moderator"
         start_of_discussion = True
         participant_names = self.get_participant_names()
+        if self.messages:
+            # Resuming an interrupted discussion, carry on from the last recorded turn
+            next_speaker = self.messages[-1]["next_speaker"]
+            start_of_discussion = False
 
         while next_speaker != "End":
             if start_of_discussion:
@@ -240,7 +280,7 @@ class RoundtableDiscussion:
                     self.messages,
                     instruction="Introduce the roundtable discussion. Introduce all of the participants. Kick off the conversation by asking a question directed towards one of the participants."
                 )
-                self.messages.append(message)
+                self.add_message(message)
                 next_speaker = message["next_speaker"]
                 start_of_discussion = False
             elif next_speaker in participant_names:
@@ -251,94 +291,84 @@ class RoundtableDiscussion:
         # End of discussion
         # save the transcript
         self.save_transcript(self.messages, self.roundtable_discussion_dir / "transcript.json")
+        self.output_folder.manifest.complete_stage("discussion")
 
 
-def generate_image(openai_client, description, directory, image_number, image_size="1024x1024"):
+@metrics_utils.record_run
+def make_roundtable(topic=None, participants=None, resume=None):
     """
-    Generate an image using the DALL-E model and save it to a specified directory.
-
-    :param openai_client: The OpenAI client object.
-    :param description: The description to generate the image.
-    :param directory: The directory where the image will be saved.
-    :param image_number: The sequential number of the image for file naming.
-    :param image_size: The size of the image. Defaults to "1024x1024".
-    :return: None
-    """
-    try:
-        response = openai_client.images.generate(
-            model="dall-e-3",
-            prompt=description,
-            size=image_size,
-            quality="standard",
-            style="vivid",
-            n=1,
-        )
-        image_url = response.data[0].url
-        image_content = requests.get(image_url).content
-        with open(f"{directory}/{image_number:03}.png", "wb") as f:
-            f.write(image_content)
-    except Exception as e:
-        print(f"Image generation failed: {e}")
-
-def generate_voice_clip(openai_client, speaker, voice, content, output_directory, clip_number):
-    """
-    Generate a voice clip using the specified voice and save it to the specified directory.
-
-    :param openai_client: The OpenAI client object.
-    :param speaker: The name of the speaker.
-    :param voice: The voice to be used for text-to-speech.
-    :param content: The content to be converted into speech.
-    :param output_directory: The directory where the voice clip will be saved.
-    :param clip_number: The sequential number of the clip for file naming.
-    :return: None
-    """
-    try:
-        response = openai_client.audio.speech.create(
-            model="tts-1",
-            voice=voice,
-            input=content,
-        )
-        # Save the audio to a file in the specified directory
-        speech_file_path = Path(output_directory, f"{clip_number:03}_{speaker}.mp3")
-        response.stream_to_file(speech_file_path)
-    except Exception as e:
-        print(f"Voice clip generation failed for {speaker}: {e}")
-
-
-roundtable = RoundtableDiscussion()
-roundtable.conduct_roundtable_discussion()
-roundtable_discussion_dir = roundtable.roundtable_discussion_dir
+    Conduct a roundtable discussion, generate the voice clips and images, and render the video.
 
-# Choose a unique voice for each participant
-# valid voice names are alloy, echo, fable, onyx, nova, and shimmer
-
-participants_list = roundtable.get_participants_list()
-# make a list of participant names
-participant_names = ["Moderator"] + [participant["name"] for participant in participants_list]
+    :param topic: The topic. The user is prompted for it if not given.
+    :param participants: List of participant dicts, see RoundtableDiscussion. The user is prompted if not given.
+    :param resume: Output folder of an interrupted run to resume.
+    :return: The path of the output folder.
+    """
+    if resume:
+        roundtable = RoundtableDiscussion(OutputFolder.resume(resume))
+    else:
+        roundtable = RoundtableDiscussion(topic=topic, participants=participants)
+    manifest = roundtable.output_folder.manifest
+    roundtable_discussion_dir = roundtable.roundtable_discussion_dir
 
-voices = ["alloy", "echo", "fable", "onyx", "nova", "shimmer"]
+    # Choose a unique voice for each participant
+    # valid voice names are alloy, echo, fable, onyx, nova, and shimmer
 
-voice_cycle = cycle(voices)
+    participants_list = roundtable.get_participants_list()
+    # make a list of participant names
+    participant_names = ["Moderator"] + [participant["name"] for participant in participants_list]
 
-# Assign a voice to each participant using the cycling iterator
-participant_voices = {name: next(voice_cycle) for name in participant_names}
+    voices = ["alloy", "echo", "fable", "onyx", "nova", "shimmer"]
 
-# Generate a voice clip for each message
+    voice_cycle = cycle(voices)
 
-for i, message in enumerate(roundtable.messages):
-    speaker = message["speaker"]
-    voice = participant_voices[speaker]
-    content = message["content"]
-    generate_voice_clip(openai_client, speaker, voice, content, roundtable_discussion_dir, i)
+    # Assign a voice to each participant using the cycling iterator
+    participant_voices = {name: next(voice_cycle) for name in participant_names}
 
+    # Each turn is final as soon as it is appended, so generate its voice clip and image
+    # in the background while the rest of the discussion is still being written
 
-# iterate through the conversation and create an image for each message.
+    asset_generator = AssetGenerator(roundtable_discussion_dir, image_style="vivid", manifest=manifest)
 
-for i, message in enumerate(roundtable.messages):
-    image_description = message["image_description"]
-    print(image_description)
-    generate_image(openai_client, image_description, roundtable_discussion_dir, i)
+    def queue_assets(i, message):
+        speaker = message["speaker"]
+        asset_generator.submit(i, {
+            "voiceover": message["content"],
+            "image_description": message.get("image_description"),
+            "voice": participant_voices.get(speaker, "alloy"),
+            "audio_filename": voice_clip_filename(f"{i:03}_{speaker}"),
+        })
 
-# Create a video from the images and audio
-video_output_path = f"{roundtable_discussion_dir}/roundtable.mp4"
-create_video_from_clips(roundtable_discussion_dir, video_output_path)
+    try:
+        # Turns recorded before a resume still need their assets
+        for i, message in enumerate(roundtable.messages):
+            queue_assets(i, message)
+        roundtable.on_message = queue_assets
+
+        if not manifest.is_stage_complete("discussion"):
+            with metrics_utils.stage("script"):
+                roundtable.conduct_roundtable_discussion()
+
+        # Wait for the remaining voice clips and images
+        asset_generator.wait()
+    finally:
+        # Stops the workers when the discussion fails part way. Finished assets are already in the manifest
+        asset_generator.shutdown()
+
+    # Create a video from the images and audio
+    video_output_path = f"{roundtable_discussion_dir}/roundtable.mp4"
+    # A discussion can run to hundreds of turns, so render with the backend whose memory use doesn't grow with them
+    create_video_from_clips(roundtable_discussion_dir, video_output_path, backend="stream")
+    manifest.complete_stage("video", video_output_path)
+    return roundtable_discussion_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a roundtable discussion video.")
+    parser.add_argument("--resume", metavar="FOLDER", help="Resume an interrupted run from its output folder.")
+    profile_utils.add_profile_argument(parser)
+    args = parser.parse_args()
+    if args.profile:
+        profile_utils.enable()
+
+    make_roundtable(resume=args.resume)
@@ -1,85 +1,95 @@
-from openai import OpenAI
 from pathlib import Path
 import os
 import sys
 import json
+import argparse
 import dotenv
-import slugify
-import requests
-import uuid
 import random
-import pathlib
 from video_utils import create_video_from_clips
-from openai_utils import structure_video_script, generate_voice_clip, generate_image
+from openai_utils import structure_video_script
+from asset_utils import generate_assets
 from folder_utils import OutputFolder
+import metrics_utils
+import profile_utils
 
 # load environment variables
 dotenv.load_dotenv()
 
-# set up the openai client
-
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-
 # Steps
 # 1. input a draft script for a video
 # 2. feed the script to the AI, asking for a revised version
 # 3. The revised version should be a json object with the keys voiceover and image_description
 
-# expect the first argument to be the path to the draft script
 
-draft_script_path = sys.argv[1]
+@metrics_utils.record_run
+def make_scripted_video(draft_script, confirm=True):
+    """
+    Turn a draft script into a structured script, generate its voiceovers and images, and render the video.
+
+    :param draft_script: The text of the draft script.
+    :param confirm: Ask the user to confirm the structured script before generating anything.
+    :return: The path of the output folder, or None if the user rejected the script.
+    """
+    # print the draft script
+    print(draft_script)
+
+    # prompt the AI for a revised script
+
+    with metrics_utils.stage("script"):
+        final_script = structure_video_script(draft_script)
+
+    title = final_script["title"]
 
-# read the draft script
+    final_script = final_script["script"]
 
-with open(draft_script_path) as f:
-    draft_script = f.read()
+    # print the title
 
-# print the draft script
-print(draft_script)
+    print(f"Title: {title}")
 
-# prompt the AI for a revised script
+    print(json.dumps(final_script, indent=4, ensure_ascii=False))
 
-final_script = structure_video_script(draft_script)
+    # prompt the user to confirm the script
 
-title = final_script["title"]
+    if confirm:
+        response = input("Does this script look good? (y/n) ")
 
-final_script = final_script["script"]
+        if response != "y":
+            print("Exiting...")
+            return None
 
-# print the title
+    output_folder = OutputFolder("scripted", title)
+    video_dir = output_folder.path
 
-print(f"Title: {title}")
+    # save the script to a file
 
-print(json.dumps(final_script, indent=4, ensure_ascii=False))
+    with open(f"{video_dir}/script.json", "w") as f:
+        json.dump(final_script, f, indent=4, ensure_ascii=False)
 
-# prompt the user to confirm the script
 
-response = input("Does this script look good? (y/n) ")
+    voice = random.choice(["alloy", "echo", "fable", "onyx", "nova", "shimmer"])
 
-if response != "y":
-    print("Exiting...")
-    sys.exit(1)
+    generate_assets(final_script, video_dir, voice=voice, manifest=output_folder.manifest)
 
-output_folder = OutputFolder("scripted", title)
-video_dir = output_folder.path
+    output_video_path = f"{video_dir}/final_video.mp4"
+    create_video_from_clips(video_dir, output_video_path)
+    output_folder.manifest.complete_stage("video", output_video_path)
+    return video_dir
 
-# save the script to a file 
 
-with open(f"{video_dir}/script.json", "w") as f:
-    json.dump(final_script, f, indent=4, ensure_ascii=False)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a video from a draft script.")
+    parser.add_argument("draft_script_path", help="Path to the draft script.")
+    profile_utils.add_profile_argument(parser)
+    args = parser.parse_args()
+    if args.profile:
+        profile_utils.enable()
 
+    draft_script_path = args.draft_script_path
 
-voice = random.choice(["alloy", "echo", "fable", "onyx", "nova", "shimmer"])
+    # read the draft script
 
-for i, section in enumerate(final_script):
-    voiceover = section["voiceover"]
-    print(f"Generating voiceover for section {i}")
-    print(voiceover)
-    generate_voice_clip(voiceover, voice, video_dir, f'{i:03}.mp3')
-    image_description = section["image_description"]
-    print(f"Generating image for section {i}")
-    print(image_description)
-    generate_image(image_description, "1024x1024", video_dir, f'{i:03}.png')
+    with open(draft_script_path) as f:
+        draft_script = f.read()
 
-output_video_path = f"{video_dir}/final_video.mp4"
-create_video_from_clips(video_dir, output_video_path)
\ No newline at end of file
+    if make_scripted_video(draft_script) is None:
+        sys.exit(1)
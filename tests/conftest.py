@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# The modules live at the top of the repository and read their settings from the environment on import,
+# so both are set up before any test imports them. The caches go to a throwaway folder.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ["CONTENT_MILL_CACHE_DIR"] = tempfile.mkdtemp(prefix="content-mill-tests-")
+os.environ.setdefault("OPENAI_API_KEY", "test")
@@ -0,0 +1,94 @@
+import functools
+import pytest
+import ffmpeg_utils
+import openai_utils
+from fake_openai import FakeOpenAIConfig, start_server
+from openai_utils import generate_image, generate_voice_clip, voice_clip_filename
+from PIL import Image
+
+# End-to-end checks of the API helpers against the fake server, with a fresh cache for every test.
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = start_server(FakeOpenAIConfig(chat_latency="fixed:0", speech_latency="fixed:0", image_latency="fixed:0",
+                                           audio_seconds=1.0))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        monkeypatch.setattr(openai_utils, "_client", None)
+        yield server
+        server.shutdown()
+        openai_utils._client = None
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr("cache_utils.CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(openai_utils, "_tts_caches", {})
+    monkeypatch.setattr(openai_utils, "image_cache", openai_utils.DiskCache("images", 1024**2, ".png"))
+
+
+@pytest.fixture
+def run_folder(tmp_path):
+    folder = tmp_path / "run"
+    folder.mkdir()
+    return folder
+
+
+@pytest.mark.parametrize("response_format", ["mp3", "aac", "wav"])
+def test_voice_clip_is_cached(server, run_folder, response_format):
+    filename = voice_clip_filename("000", response_format)
+    requests = server.counts.get("speech", 0)
+    clip = generate_voice_clip("Hello there.", "alloy", run_folder, filename, response_format)
+    assert clip == run_folder / filename
+    assert ffmpeg_utils.probe_duration(clip) == pytest.approx(1.0, abs=0.1)
+
+    clip.unlink()
+    assert generate_voice_clip("Hello there.", "alloy", run_folder, filename, response_format) == clip
+    assert clip.exists()
+    assert server.counts["speech"] == requests + 1
+
+
+@pytest.mark.parametrize("response_format", ["mp3", "flac"])
+def test_long_voice_clip_is_joined_from_chunks(server, run_folder, monkeypatch, response_format):
+    monkeypatch.setattr(openai_utils, "split_text", functools.partial(openai_utils.split_text, max_chars=20))
+    requests = server.counts.get("speech", 0)
+    text = "The first sentence. The second sentence. The third sentence."
+    clip = generate_voice_clip(text, "alloy", run_folder, voice_clip_filename("000", response_format),
+                               response_format)
+    assert server.counts["speech"] == requests + 3
+    assert ffmpeg_utils.probe_duration(clip) == pytest.approx(3.0, abs=0.2)
+    # The chunks are gone, only the clip is left
+    assert list(run_folder.iterdir()) == [clip]
+
+
+@pytest.mark.parametrize("image_response_format", ["b64_json", "url"])
+def test_image_is_saved_and_cached(server, run_folder, monkeypatch, image_response_format):
+    monkeypatch.setattr(openai_utils, "IMAGE_RESPONSE_FORMAT", image_response_format)
+    requests = server.counts.get("images", 0)
+    image_path = generate_image("A lighthouse at dusk", "1024x1024", run_folder, "000.png")
+    with Image.open(image_path) as image:
+        assert image.size == (1024, 1024)
+    assert list(run_folder.iterdir()) == [image_path]
+
+    image_path.unlink()
+    assert generate_image("A lighthouse at dusk", "1024x1024", run_folder, "000.png") == image_path
+    assert image_path.exists()
+    assert server.counts["images"] == requests + 1
+
+
+def test_server_removes_its_work_directory():
+    server = start_server()
+    server.make_audio("mp3")
+    assert any(server.work_dir.iterdir())
+    server.shutdown()
+    assert not server.work_dir.exists()
+
+
+def test_voice_clip_survives_a_cache_failure(server, run_folder, monkeypatch):
+    def put(self, key, path, metadata=None):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(openai_utils.DiskCache, "put", put)
+    clip = generate_voice_clip("Hello there.", "alloy", run_folder, "000.mp3", "mp3")
+    assert clip.exists()
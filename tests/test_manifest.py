@@ -0,0 +1,92 @@
+import pytest
+import long_video
+from context_utils import RollingSummaryContext
+from folder_utils import MANIFEST_FILENAME, OutputFolder, RunManifest
+
+OUTLINE = {"title": "Tides", "sections": [
+    {"title": f"Part {i}", "writing_prompt": f"Write part {i}"} for i in range(4)
+]}
+
+
+def test_stages_survive_a_reload(tmp_path):
+    manifest = RunManifest(tmp_path / MANIFEST_FILENAME, "Tides")
+    manifest.complete_stage("outline", OUTLINE)
+    manifest.complete_stage("video", None)
+
+    reloaded = RunManifest(tmp_path / MANIFEST_FILENAME)
+    assert reloaded.title == "Tides"
+    assert reloaded.get_stage("outline") == OUTLINE
+    # A stage can complete with no result
+    assert reloaded.is_stage_complete("video")
+    assert reloaded.get_stage("video", "missing") is None
+    assert not reloaded.is_stage_complete("script")
+    assert reloaded.get_stage("script", "missing") == "missing"
+    assert list(tmp_path.iterdir()) == [tmp_path / MANIFEST_FILENAME]
+
+
+def test_asset_is_redone_when_missing_or_changed(tmp_path):
+    manifest = RunManifest(tmp_path / MANIFEST_FILENAME)
+    clip = tmp_path / "000.mp3"
+    clip.write_bytes(b"clip")
+    manifest.record_asset(clip)
+    assert RunManifest(tmp_path / MANIFEST_FILENAME).has_asset("000.mp3")
+    assert not manifest.has_asset("001.mp3")
+
+    clip.write_bytes(b"truncated")
+    assert not manifest.has_asset("000.mp3")
+    clip.unlink()
+    assert not manifest.has_asset("000.mp3")
+
+
+def test_resume_reopens_the_folder_with_its_title(tmp_path):
+    folder = OutputFolder(str(tmp_path), "Tides of the Moon")
+    folder.manifest.complete_stage("outline", OUTLINE)
+
+    resumed = OutputFolder.resume(folder.path)
+    assert resumed.path == folder.path
+    assert resumed.title == "Tides of the Moon"
+    assert resumed.manifest.get_stage("outline") == OUTLINE
+    assert [path.name for path in tmp_path.iterdir()] == [folder.path.name]
+
+
+def test_resume_needs_a_manifest(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        OutputFolder.resume(tmp_path)
+
+
+@pytest.fixture
+def fake_writer(monkeypatch):
+    """
+    Write sections and summaries without the API, counting the requests.
+    """
+    calls = {"sections": [], "summaries": 0}
+
+    def get_section_script(video_title, script, section, context):
+        calls["sections"].append(section["title"])
+        return [{"voiceover": f"{section['title']} voiceover.", "image_description": section["title"]}]
+
+    def summarize(self, voiceovers):
+        calls["summaries"] += 1
+        return f"summary of {len(voiceovers)} more"
+
+    monkeypatch.setattr(long_video, "get_section_script", get_section_script)
+    monkeypatch.setattr(RollingSummaryContext, "_summarize", summarize)
+    return calls
+
+
+def test_resumed_outline_skips_written_sections_and_restores_the_summary(tmp_path, fake_writer):
+    manifest = RunManifest(tmp_path / MANIFEST_FILENAME)
+    interrupted = long_video.iter_outline(OUTLINE, manifest, RollingSummaryContext(recent_segments=1))
+    for _ in range(3):
+        next(interrupted)
+    interrupted.close()
+    assert fake_writer == {"sections": ["Part 0", "Part 1", "Part 2"], "summaries": 2}
+
+    fake_writer["sections"].clear()
+    fake_writer["summaries"] = 0
+    context = RollingSummaryContext(recent_segments=1)
+    script = long_video.process_outline(OUTLINE, RunManifest(tmp_path / MANIFEST_FILENAME), context)
+    assert [segment["image_description"] for segment in script] == ["Part 0", "Part 1", "Part 2", "Part 3"]
+    # Only the new section is written and summarised
+    assert fake_writer == {"sections": ["Part 3"], "summaries": 1}
+    assert context.get_state()["recent"] == [script[-1]["voiceover"]]
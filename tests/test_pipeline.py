@@ -0,0 +1,52 @@
+import shutil
+import pytest
+import pipeline
+from pipeline import run_pipeline
+from render_benchmark import make_run_folder
+
+
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+    """
+    Serve the voice clips and images from a synthetic run folder instead of the API.
+    The image description names the image to use, so a section's image can be changed between runs.
+    """
+    folder = tmp_path / "sources"
+    make_run_folder(folder, 3, (64, 64), (0.3, 0.3))
+
+    def generate_voice_clip(input, voice, output_folder, filename, response_format=None):
+        return shutil.copyfile(folder / f"{input}.mp3", output_folder / filename)
+
+    def generate_image(prompt, size, output_folder, filename, style=None):
+        return shutil.copyfile(folder / f"{prompt}.png", output_folder / filename)
+
+    monkeypatch.setattr(pipeline, "generate_voice_clip", generate_voice_clip)
+    monkeypatch.setattr(pipeline, "generate_image", generate_image)
+    return folder
+
+
+def run(sections, folder):
+    return run_pipeline(sections, folder, folder / "video.mp4", image_size="64x64", asset_workers=2,
+                        encode_workers=2, audio_format="mp3")
+
+
+def test_rerun_removes_stale_segments(tmp_path, sources):
+    folder = tmp_path / "run"
+    folder.mkdir()
+    assert run([{"voiceover": f"{i:03}", "image_description": f"{i:03}"} for i in range(2)], folder) == {}
+    first_segments = set((folder / "segments").glob("*.mp4"))
+    assert len(first_segments) == 2
+
+    failures = run([{"voiceover": "000", "image_description": "002"}, {"voiceover": "001"}], folder)
+    assert list(failures) == [1]
+    second_segments = set((folder / "segments").glob("*.mp4"))
+    assert len(second_segments) == 1
+    assert not second_segments & first_segments
+
+
+def test_no_segments_is_an_error(tmp_path, sources):
+    folder = tmp_path / "run"
+    folder.mkdir()
+    with pytest.raises(RuntimeError, match="No segments were produced"):
+        run([{"voiceover": "000"}, {"voiceover": "missing", "image_description": "000"}], folder)
+    assert not (folder / "video.mp4").exists()
@@ -0,0 +1,33 @@
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from profile_utils import CHILD_FRAME, SamplingProfiler
+
+
+def leaf_frames(profiler):
+    return [stack.split(";")[-1] for stack in profiler.stacks.elements()]
+
+
+def test_blocked_on_a_child_process_is_not_running():
+    profiler = SamplingProfiler(0.005)
+    profiler.start()
+    # Like run_ffmpeg: with a single pipe, communicate reads it in a C call, leaving communicate as the leaf frame
+    subprocess.run([sys.executable, "-c", "import time; time.sleep(0.3)"], stdout=subprocess.DEVNULL,
+                   stderr=subprocess.PIPE, check=True)
+    profiler.stop()
+    leaves = leaf_frames(profiler)
+    assert leaves.count(CHILD_FRAME) >= len(leaves) * 0.8
+    assert not any("subprocess.py" in leaf for leaf in leaves)
+    assert f"{leaves.count(CHILD_FRAME)} waiting on a child process" in profiler.summary()
+
+
+def test_idle_pool_workers_are_left_out():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        executor.submit(lambda: None).result()
+        profiler = SamplingProfiler(0.005)
+        profiler.start()
+        time.sleep(0.1)
+        profiler.stop()
+    assert profiler.stacks
+    assert not any("_worker (thread.py" in stack for stack in profiler.stacks)
@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+import pytest
+import rate_limit_utils
+from rate_limit_utils import RateLimiter, TokenBucket, parse_duration, retry_after_seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Replace the clock of rate_limit_utils with one the test moves forward, and record the sleeps.
+    """
+    clock = SimpleNamespace(now=1000.0, sleeps=[])
+
+    def sleep(seconds):
+        clock.sleeps.append(seconds)
+        clock.now += seconds
+
+    monkeypatch.setattr(rate_limit_utils, "time", SimpleNamespace(monotonic=lambda: clock.now, sleep=sleep))
+    return clock
+
+
+def test_bucket_starts_full(clock):
+    bucket = TokenBucket(60)
+    assert [bucket.reserve() for _ in range(60)] == [0.0] * 60
+
+
+def test_bucket_spreads_requests_once_empty(clock):
+    bucket = TokenBucket(60)
+    bucket.reserve(60)
+    # One token a second, and each reservation queues behind the previous one
+    assert bucket.reserve() == pytest.approx(1.0)
+    assert bucket.reserve() == pytest.approx(2.0)
+
+
+def test_bucket_refills_over_time_up_to_capacity(clock):
+    bucket = TokenBucket(60)
+    bucket.reserve(60)
+    clock.now += 30
+    assert bucket.reserve(30) == 0.0
+    assert bucket.reserve() == pytest.approx(1.0)
+    clock.now += 3600
+    bucket.reserve(0)
+    assert bucket.available == pytest.approx(60)
+
+
+def test_bucket_caps_a_reservation_at_capacity(clock):
+    bucket = TokenBucket(10)
+    # A request larger than the whole bucket waits for a full minute, not forever
+    assert bucket.reserve(100) == 0.0
+    assert bucket.reserve(100) == pytest.approx(60.0)
+
+
+def test_bucket_set_limit_and_sync(clock):
+    bucket = TokenBucket(60)
+    bucket.set_limit(600)
+    assert bucket.available == 60
+    bucket.sync(5)
+    assert bucket.available == 5
+    bucket.sync(50)
+    assert bucket.available == 5
+    assert bucket.reserve(6) == pytest.approx(0.1)
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("20ms", 0.02), ("1s", 1), ("6m0s", 360), ("1h2m3.5s", 3723.5), ("2.5", 2.5), ("soon", None), (None, None),
+])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == (pytest.approx(seconds) if seconds is not None else None)
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds({"retry-after-ms": "250", "retry-after": "9"}) == 0.25
+    assert retry_after_seconds({"retry-after": "2"}) == 2
+    assert retry_after_seconds({"x-ratelimit-reset-requests": "1s", "x-ratelimit-reset-tokens": "6m0s"}) == 360
+    assert retry_after_seconds({}) is None
+    assert retry_after_seconds(None) is None
+
+
+def test_limiter_follows_rate_limit_headers(clock):
+    limiter = RateLimiter("test", requests_per_minute=60, tokens_per_minute=1000)
+    limiter.update({"x-ratelimit-limit-requests": "120", "x-ratelimit-remaining-requests": "0",
+                    "x-ratelimit-limit-tokens": "bogus"})
+    assert limiter.requests.capacity == 120
+    with limiter.slot():
+        pass
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_limiter_halves_concurrency_on_429_and_grows_back(clock):
+    limiter = RateLimiter("test", requests_per_minute=1000, max_concurrency=8)
+    assert limiter.on_rate_limited({"retry-after": "3"}) == 3
+    assert limiter.concurrency == 4
+    with limiter.slot():
+        pass
+    assert clock.sleeps == [pytest.approx(3)]
+    for _ in range(4):
+        limiter.on_success()
+    assert limiter.concurrency == 5
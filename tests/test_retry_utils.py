@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+import openai
+import pytest
+import requests
+import retry_utils
+from retry_utils import CONTENT_POLICY, FATAL, RATE_LIMIT, TRANSIENT, backoff_delay, classify_error, retry
+
+# The errors only read these attributes of the HTTP request and response they wrap
+REQUEST = SimpleNamespace(method="POST", url="https://api.openai.com/v1/images/generations")
+
+
+def api_error(error_class, status_code, code=None, message="error"):
+    response = SimpleNamespace(request=REQUEST, status_code=status_code, headers={})
+    return error_class(message, response=response, body={"code": code, "message": message})
+
+
+def http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(f"{status_code} error", response=response)
+
+
+@pytest.mark.parametrize("error, kind", [
+    (api_error(openai.RateLimitError, 429), RATE_LIMIT),
+    (api_error(openai.RateLimitError, 429, code="insufficient_quota"), FATAL),
+    (api_error(openai.BadRequestError, 400, code="content_policy_violation"), CONTENT_POLICY),
+    (api_error(openai.BadRequestError, 400, message="Your request was rejected by our safety system."),
+     CONTENT_POLICY),
+    (api_error(openai.BadRequestError, 400, code="invalid_size"), FATAL),
+    (openai.APIConnectionError(request=REQUEST), TRANSIENT),
+    (openai.APITimeoutError(request=REQUEST), TRANSIENT),
+    (api_error(openai.InternalServerError, 500), TRANSIENT),
+    (api_error(openai.APIStatusError, 503), TRANSIENT),
+    (api_error(openai.APIStatusError, 409), TRANSIENT),
+    (api_error(openai.AuthenticationError, 401), FATAL),
+    (api_error(openai.NotFoundError, 404), FATAL),
+    (requests.ConnectionError(), TRANSIENT),
+    (requests.Timeout(), TRANSIENT),
+    (requests.exceptions.ChunkedEncodingError(), TRANSIENT),
+    (http_error(429), RATE_LIMIT),
+    (http_error(502), TRANSIENT),
+    (http_error(403), FATAL),
+    (requests.HTTPError("no response"), FATAL),
+    (ValueError("bug"), FATAL),
+])
+def test_classify_error(error, kind):
+    assert classify_error(error) == kind
+
+
+def test_backoff_delay_grows_exponentially_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(retry_utils.random, "uniform", lambda low, high: high)
+    assert [backoff_delay(attempt, base=0.5, cap=3) for attempt in range(1, 6)] == [0.5, 1, 2, 3, 3]
+
+
+def test_backoff_delay_is_jittered_from_zero():
+    delays = [backoff_delay(3, base=1, cap=30) for _ in range(200)]
+    assert all(0 <= delay <= 4 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_retry_retries_transient_errors(monkeypatch):
+    monkeypatch.setattr(retry_utils.time, "sleep", lambda seconds: None)
+    errors = [requests.ConnectionError(), http_error(503)]
+
+    def request():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    assert retry(request) == "ok"
+
+
+def test_retry_raises_fatal_errors_at_once(monkeypatch):
+    monkeypatch.setattr(retry_utils.time, "sleep", lambda seconds: None)
+    calls = []
+
+    def request():
+        calls.append(1)
+        raise http_error(403)
+
+    with pytest.raises(requests.HTTPError):
+        retry(request)
+    assert len(calls) == 1
+
+
+def test_retry_gives_up_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(retry_utils.time, "sleep", lambda seconds: None)
+    calls = []
+
+    def request():
+        calls.append(1)
+        raise requests.Timeout()
+
+    with pytest.raises(requests.Timeout):
+        retry(request, max_attempts=3)
+    assert len(calls) == 3
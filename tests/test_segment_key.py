@@ -0,0 +1,63 @@
+import pytest
+import ffmpeg_utils
+from ffmpeg_utils import render_segments, segment_key
+from render_benchmark import make_run_folder
+
+SIZE = (64, 64)
+PARAMS = dict(size=SIZE, fps=24, preset="medium", tune="stillimage", crf=None)
+
+
+@pytest.fixture
+def pair(tmp_path):
+    image_file, audio_file = tmp_path / "000.png", tmp_path / "000.mp3"
+    image_file.write_bytes(b"image")
+    audio_file.write_bytes(b"audio")
+    return image_file, audio_file
+
+
+def test_key_depends_on_content_not_path(tmp_path, pair):
+    copies = tmp_path / "copy"
+    copies.mkdir()
+    for path in pair:
+        (copies / path.name).write_bytes(path.read_bytes())
+    assert segment_key(*pair, **PARAMS) == segment_key(copies / "000.png", copies / "000.mp3", **PARAMS)
+
+
+@pytest.mark.parametrize("changed", ["image", "audio"])
+def test_key_changes_with_input_content(pair, changed):
+    before = segment_key(*pair, **PARAMS)
+    pair[0 if changed == "image" else 1].write_bytes(b"edited")
+    assert segment_key(*pair, **PARAMS) != before
+
+
+@pytest.mark.parametrize("name, value", [
+    ("size", (128, 64)), ("fps", 30), ("preset", "veryfast"), ("tune", None), ("crf", 18),
+])
+def test_key_changes_with_encoding_parameters(pair, name, value):
+    assert segment_key(*pair, **{**PARAMS, name: value}) != segment_key(*pair, **PARAMS)
+
+
+def test_key_changes_with_audio_copy_and_codecs(pair, monkeypatch):
+    key = segment_key(*pair, **PARAMS)
+    assert segment_key(*pair, **PARAMS, copy_audio=True) != key
+    monkeypatch.setattr(ffmpeg_utils, "AUDIO_CODEC", "aac")
+    assert segment_key(*pair, **PARAMS) != key
+
+
+def test_rerender_reencodes_only_changed_segments(tmp_path, capsys):
+    run_folder, segment_dir = tmp_path / "run", tmp_path / "segments"
+    make_run_folder(run_folder, 3, SIZE, (0.3, 0.3))
+    pairs = [(run_folder / f"{i:03}.png", run_folder / f"{i:03}.mp3") for i in range(3)]
+    render_segments(pairs, tmp_path / "first.mp4", segment_dir=segment_dir, workers=2)
+    assert "Encoding 3 segments, reusing 0 of 3" in capsys.readouterr().out
+    first_segments = set(segment_dir.glob("*.mp4"))
+
+    make_run_folder(tmp_path / "other", 2, SIZE, (0.3, 0.3), seed=1)
+    (tmp_path / "other" / "001.png").replace(pairs[1][0])
+    render_segments(pairs, tmp_path / "second.mp4", segment_dir=segment_dir, workers=2)
+    assert "Encoding 1 segments, reusing 2 of 3" in capsys.readouterr().out
+    # The segment of the old image is dropped, the other two are kept
+    second_segments = set(segment_dir.glob("*.mp4"))
+    assert len(second_segments) == 3
+    assert len(first_segments & second_segments) == 2
+    assert ffmpeg_utils.probe_duration(tmp_path / "second.mp4") == pytest.approx(0.9, abs=0.15)
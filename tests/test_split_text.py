@@ -0,0 +1,50 @@
+import pytest
+from openai_utils import split_text
+
+
+def test_short_text_is_one_chunk():
+    assert split_text("Hello there. How are you?", max_chars=100) == ["Hello there. How are you?"]
+
+
+def test_surrounding_whitespace_is_stripped():
+    assert split_text("  Hello.  \n", max_chars=100) == ["Hello."]
+
+
+def test_empty_text_has_no_chunks():
+    assert split_text("", max_chars=100) == []
+
+
+def test_breaks_between_sentences():
+    text = "One two three. Four five six! Seven eight nine?"
+    assert split_text(text, max_chars=30) == ["One two three. Four five six!", "Seven eight nine?"]
+
+
+def test_ellipsis_ends_a_sentence():
+    assert split_text("Wait for it… Here it is.", max_chars=15) == ["Wait for it…", "Here it is."]
+
+
+def test_does_not_break_inside_decimals():
+    assert split_text("It costs 3.50 today.", max_chars=15) == ["It costs 3.50", "today."]
+
+
+def test_sentence_of_exactly_max_chars_is_kept_whole():
+    assert split_text("abcd efgh.", max_chars=10) == ["abcd efgh."]
+
+
+def test_long_sentence_breaks_between_words():
+    text = "alpha beta gamma delta epsilon"
+    chunks = split_text(text, max_chars=12)
+    assert chunks == ["alpha beta", "gamma delta", "epsilon"]
+
+
+def test_word_longer_than_max_chars_is_cut():
+    assert split_text("abcdefghij klm", max_chars=4) == ["abcd", "efgh", "ij", "klm"]
+
+
+@pytest.mark.parametrize("max_chars", [5, 12, 40, 200])
+def test_chunks_keep_all_the_text_in_order(max_chars):
+    text = "The quick brown fox jumps over the lazy dog. It was not amused! Was it? Nobody knows… The end."
+    chunks = split_text(text, max_chars=max_chars)
+    assert all(0 < len(chunk) <= max_chars for chunk in chunks)
+    # Words longer than max_chars are cut, so compare without the whitespace
+    assert "".join("".join(chunks).split()) == "".join(text.split())
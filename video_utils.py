@@ -1,36 +1,199 @@
 from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from PIL import Image, ImageDraw, ImageFont
+import ffmpeg_utils
+import metrics_utils
+from cache_utils import make_key
+from folder_utils import file_checksum
+from openai_utils import TTS_FORMAT_EXTENSIONS, TTS_RESPONSE_FORMAT
 
-def create_video_from_clips(directory, output_file, fps=24):
+RENDER_BACKENDS = ("moviepy", "ffmpeg", "segments", "stream")
+
+# Extensions of the voice clips, one per TTS response format, see openai_utils.TTS_FORMAT_EXTENSIONS.
+AUDIO_EXTENSIONS = (".mp3", ".aac", ".opus", ".flac", ".wav")
+
+# Preview renders, for checking pacing and which image goes with which clip before the full render.
+# Images are shrunk to PREVIEW_MAX_SIZE pixels on their longest side and shown at PREVIEW_FPS.
+PREVIEW_MAX_SIZE = 320
+PREVIEW_FPS = 6
+PREVIEW_PRESET = "ultrafast"
+PREVIEW_CRF = 30
+PREVIEW_LABEL = "PREVIEW"
+
+
+def get_clip_pairs(directory, audio_format=None):
+    """
+    Pair up the numbered image and audio files in a directory.
+
+    Files are matched on the number their name starts with, e.g. 003.png with 003.mp3 or 003_Alex.mp3.
+    Numbers with only an image or only a clip are left out. When a number has clips in several formats,
+    e.g. after a run was resumed with another TTS_RESPONSE_FORMAT, the clip in audio_format is used.
+
+    :param directory: Directory containing numbered image and audio files.
+    :param audio_format: The TTS response format to prefer. Defaults to openai_utils.TTS_RESPONSE_FORMAT.
+    :return: List of (image_file, audio_file) tuples in playback order.
+    :raises ValueError: If a number has several images, or several clips and none or more than one in audio_format.
+    """
+    preferred_extension = TTS_FORMAT_EXTENSIONS[audio_format or TTS_RESPONSE_FORMAT]
+    image_files = {}
+    audio_files = {}
+    for path in Path(directory).iterdir():
+        match = re.match(r"\d+", path.name)
+        if match is None or not path.is_file():
+            continue
+        if path.suffix == ".png":
+            image_files.setdefault(int(match.group()), []).append(path)
+        elif path.suffix in AUDIO_EXTENSIONS:
+            audio_files.setdefault(int(match.group()), []).append(path)
+
+    pairs = []
+    for number in sorted(image_files.keys() | audio_files.keys()):
+        images = image_files.get(number, [])
+        clips = audio_files.get(number, [])
+        if not images or not clips:
+            print(f"Warning: {number:03} has no {'image' if not images else 'audio clip'}, leaving it out of the video")
+            continue
+        if len(clips) > 1:
+            clips = [clip for clip in clips if clip.suffix == preferred_extension]
+        if len(images) != 1 or len(clips) != 1:
+            names = ", ".join(sorted(path.name for path in image_files[number] + audio_files[number]))
+            raise ValueError(f"Can't tell which files belong to {number:03} in {directory}: {names}")
+        pairs.append((images[0], clips[0]))
+    return pairs
+
+
+def make_preview_image(image_file, preview_file, max_size=PREVIEW_MAX_SIZE):
+    """
+    Write a shrunk copy of an image, stamped with PREVIEW_LABEL so a preview is never mistaken for the real video.
+    """
+    with Image.open(image_file) as image:
+        image = image.convert("RGB")
+    image.thumbnail((max_size, max_size))
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.load_default(size=max(10, max_size // 20))
+    except TypeError:  # Pillow < 10.1 only has the small bitmap font
+        font = ImageFont.load_default()
+    left, top, right, bottom = draw.textbbox((4, 4), PREVIEW_LABEL, font=font)
+    draw.rectangle((0, 0, right + 4, bottom + 4), fill="black")
+    draw.text((4, 4), PREVIEW_LABEL, fill="white", font=font)
+    # Written to a temporary name so an interrupted run never leaves a truncated image behind
+    partial_file = Path(preview_file).with_name(f"{Path(preview_file).stem}.part.png")
+    image.save(partial_file, compress_level=1)
+    os.replace(partial_file, preview_file)
+    return preview_file
+
+
+def make_preview_pairs(pairs, preview_dir, max_size=PREVIEW_MAX_SIZE):
+    """
+    Swap the images of (image_file, audio_file) pairs for shrunk preview copies.
+
+    The copies are named by a hash of the source image, so they are only made once per image, and copies of
+    images no longer in use are removed.
+
+    :param pairs: List of (image_file, audio_file) tuples in playback order.
+    :param preview_dir: Directory for the preview images.
+    :param max_size: Longest side of the preview images in pixels.
+    :return: List of (preview_image_file, audio_file) tuples.
+    """
+    preview_dir = Path(preview_dir)
+    preview_dir.mkdir(parents=True, exist_ok=True)
+    preview_files = [preview_dir / f"{make_key(file_checksum(image_file), max_size, PREVIEW_LABEL)}.png"
+                     for image_file, _ in pairs]
+    pending = {preview_file: image_file for (image_file, _), preview_file in zip(pairs, preview_files)
+               if not preview_file.exists()}
+    # PIL releases the GIL while decoding and resizing, so threads are enough
+    with ThreadPoolExecutor() as executor:
+        for future in [executor.submit(make_preview_image, image_file, preview_file, max_size)
+                       for preview_file, image_file in pending.items()]:
+            future.result()
+    for stale_file in set(preview_dir.glob("*.png")) - set(preview_files):
+        stale_file.unlink(missing_ok=True)
+    return [(preview_file, audio_file) for preview_file, (_, audio_file) in zip(preview_files, pairs)]
+
+
+def create_video_from_clips(directory, output_file, fps=24, backend="moviepy", preset=ffmpeg_utils.DEFAULT_PRESET,
+                            tune=ffmpeg_utils.DEFAULT_TUNE, crf=None, workers=None, segment_dir=None, preview=False,
+                            preview_dir=None):
     """
     Creates a video from image and audio clips in a given directory.
 
     :param directory: Directory containing numbered image and audio files.
     :param output_file: Path for the output video file.
     :param fps: Frames per second for the output video.
+    :param backend: "moviepy" composites every frame in Python. "ffmpeg" builds the slideshow in a single
+                    ffmpeg pass, decoding each image once. "segments" encodes each image and audio pair as its own
+                    segment in parallel and joins them without re-encoding. "stream" feeds one encoder the frames of
+                    one image at a time, so its memory use and open processes don't grow with the number of segments.
+    :param preset: x264 preset.
+    :param tune: x264 tune for the ffmpeg backends, "stillimage" by default.
+    :param crf: Optional x264 constant rate factor for the ffmpeg backends.
+    :param workers: Number of segments encoded in parallel by the segments backend. Defaults to the number of CPUs.
+    :param segment_dir: Where the segments backend keeps its encoded segments. Keeping this directory between runs
+                        means only segments whose image or audio changed are re-encoded.
+    :param preview: Render a quick low-resolution preview instead, for checking pacing and image and voice pairing.
+                    Images are shrunk to PREVIEW_MAX_SIZE and stamped "PREVIEW", and the video is encoded at
+                    PREVIEW_FPS with the fastest x264 settings by the stream backend. fps, backend, preset and crf
+                    are ignored.
+    :param preview_dir: Where the shrunk preview images are kept between runs. Defaults to a "preview" subfolder
+                        of directory.
+
+    Every backend copies the audio clips into the video without re-encoding when they share one format that MP4
+    can hold, such as the mp3, aac or opus clips of a run, see ffmpeg_utils.can_copy_audio.
     """
-    # Get all image and audio files, assuming they are named with numbers
-    image_files = sorted(Path(directory).glob("*.png"))
-    audio_files = sorted(Path(directory).glob("*.mp3"))
+    if backend not in RENDER_BACKENDS:
+        raise ValueError(f"Unknown render backend '{backend}'. Expected one of {RENDER_BACKENDS}.")
+    with metrics_utils.stage("preview" if preview else "render"):
+        pairs = get_clip_pairs(directory)
+
+        if preview:
+            pairs = make_preview_pairs(pairs, preview_dir or Path(directory) / "preview")
+            return ffmpeg_utils.render_stream(pairs, output_file, fps=PREVIEW_FPS, preset=PREVIEW_PRESET, tune=tune,
+                                              crf=PREVIEW_CRF)
+
+        if backend == "ffmpeg":
+            return ffmpeg_utils.render_slideshow(pairs, output_file, fps=fps, preset=preset, tune=tune, crf=crf)
+        if backend == "segments":
+            return ffmpeg_utils.render_segments(pairs, output_file, fps=fps, preset=preset, tune=tune, crf=crf,
+                                                workers=workers, segment_dir=segment_dir)
+        if backend == "stream":
+            return ffmpeg_utils.render_stream(pairs, output_file, fps=fps, preset=preset, tune=tune, crf=crf)
 
-    clips = []
-    for image_file, audio_file in zip(image_files, audio_files):
-        # Create an ImageClip and set its duration to match the corresponding AudioFileClip
-        image_clip = ImageClip(str(image_file))
-        audio_clip = AudioFileClip(str(audio_file))
-        video_clip = image_clip.set_duration(audio_clip.duration).set_audio(audio_clip)
-        clips.append(video_clip)
+        audio_files = [audio_file for _, audio_file in pairs]
+        copy_audio = ffmpeg_utils.can_copy_audio(audio_files)
+        clips = []
+        for image_file, audio_file in pairs:
+            # Create an ImageClip and set its duration to match the corresponding AudioFileClip
+            image_clip = ImageClip(str(image_file))
+            if copy_audio:
+                # The clips are added afterwards with a stream copy, so only their duration is needed here
+                video_clip = image_clip.set_duration(ffmpeg_utils.probe_duration(audio_file))
+            else:
+                audio_clip = AudioFileClip(str(audio_file))
+                video_clip = image_clip.set_duration(audio_clip.duration).set_audio(audio_clip)
+            clips.append(video_clip)
 
-    # Concatenate all video clips
-    final_clip = concatenate_videoclips(clips)
+        # Concatenate all video clips
+        final_clip = concatenate_videoclips(clips)
 
-    # Write the final video to the specified file
-    final_clip.write_videofile(output_file, fps=fps)
+        # Write the final video to the specified file
+        if copy_audio:
+            output_path = Path(output_file)
+            video_only_file = output_path.with_name(f"{output_path.stem}.video{output_path.suffix}")
+            final_clip.write_videofile(str(video_only_file), fps=fps, preset=preset, audio=False)
+            try:
+                ffmpeg_utils.mux_audio(video_only_file, audio_files, output_file)
+            finally:
+                video_only_file.unlink(missing_ok=True)
+        else:
+            final_clip.write_videofile(output_file, fps=fps, preset=preset)
 
-    # Close the clips to free up resources
-    for clip in clips:
-        clip.close()
-    final_clip.close()
+        # Close the clips to free up resources
+        for clip in clips:
+            clip.close()
+        final_clip.close()
 
-    return output_file
+        return output_file
@@ -1,11 +1,46 @@
-import sys
-from video_utils import create_video_from_clips
+import argparse
+from pathlib import Path
+from video_utils import create_video_from_clips, RENDER_BACKENDS
+from ffmpeg_utils import DEFAULT_PRESET, DEFAULT_TUNE
+import metrics_utils
+import profile_utils
 
 # input arguments
 # user will specify a folder which contains png and mp3 files. these will be combined into a video.
+# the segments backend keeps one encoded segment per png/mp3 pair in a "segments" subfolder,
+# so re-running after replacing an image or clip only re-encodes the segments that changed.
+# --preview renders a small, fast final_video.preview.mp4 next to it instead, keeping its shrunk images
+# in a "preview" subfolder.
 
-directory = sys.argv[1]
+parser = argparse.ArgumentParser(description="Combine the png and mp3 files in a folder into a video.")
+parser.add_argument("directory", help="Folder containing numbered png and mp3 files.")
+parser.add_argument("--backend", choices=RENDER_BACKENDS, default="segments", help="Render backend.")
+parser.add_argument("--fps", type=int, default=24, help="Frames per second of the output video.")
+parser.add_argument("--preset", default=DEFAULT_PRESET, help="x264 preset.")
+parser.add_argument("--tune", default=DEFAULT_TUNE, help="x264 tune for the ffmpeg backends. Use '' to disable.")
+parser.add_argument("--crf", type=int, default=None, help="x264 constant rate factor for the ffmpeg backends.")
+parser.add_argument("--workers", type=int, default=None, help="Parallel segment encoders for the segments backend.")
+parser.add_argument("--preview", action="store_true",
+                    help="Render a quick low-resolution preview to final_video.preview.mp4 instead, "
+                         "for checking pacing and image and voice pairing.")
+profile_utils.add_profile_argument(parser)
+args = parser.parse_args()
+if args.profile:
+    profile_utils.enable()
 
-output_video_path = f"{directory}/final_video.mp4"
+directory = args.directory
 
-create_video_from_clips(directory, output_video_path)
\ No newline at end of file
+output_video_path = f"{directory}/final_video.preview.mp4" if args.preview else f"{directory}/final_video.mp4"
+
+
+@metrics_utils.record_run
+def vidgen():
+    create_video_from_clips(directory, output_video_path, fps=args.fps, backend=args.backend,
+                            preset=args.preset, tune=args.tune or None, crf=args.crf, workers=args.workers,
+                            segment_dir=Path(directory) / "segments", preview=args.preview,
+                            preview_dir=Path(directory) / "preview")
+    print(f"{'Preview' if args.preview else 'Video'} written to {output_video_path}")
+    return directory
+
+
+vidgen()